@@ -0,0 +1,94 @@
+import click
+import frappe
+from frappe.commands import get_site, pass_context
+
+
+@click.command("rra-push")
+@click.option("--action", "actions", multiple=True, type=click.Choice(["push_item", "save_sale", "save_purchase", "update_item_stock"]), help="Only push these document types")
+@click.option("--max-in-flight", type=int, help="Maximum concurrent requests per TIN/branch")
+@pass_context
+def rra_push(context, actions=None, max_in_flight=None):
+	"""Push unpushed documents to RRA concurrently"""
+	from rra_compliance.tasks import push_unpushed
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		for action, result in push_unpushed(max_in_flight=max_in_flight, actions=actions).items():
+			click.echo(f"{action}: {len(result['submitted'])} submitted, {len(result['failed'])} failed, {len(result['skipped'])} skipped, {len(result['held'])} held")
+	finally:
+		frappe.destroy()
+
+
+@click.command("rra-mock-vsdc")
+@click.option("--host", default="127.0.0.1", help="Interface to listen on")
+@click.option("--port", default=8085, type=int, help="Port to listen on")
+@click.option("--latency", default=0.0, type=float, help="Added latency per request in milliseconds")
+@click.option("--jitter", default=0.0, type=float, help="Random +/- latency in milliseconds")
+@click.option("--error-rate", default=0.0, type=float, help="Fraction of requests answered with --error-status")
+@click.option("--error-status", default=503, type=int, help="HTTP status used for injected errors")
+@click.option("--duplicate-rate", default=0.0, type=float, help="Fraction of numbered submissions answered with 924")
+@click.option("--seed", type=int, help="Random seed for reproducible runs")
+@click.option("--verbose", is_flag=True, help="Log every request")
+def rra_mock_vsdc(host, port, latency, jitter, error_rate, error_status, duplicate_rate, seed, verbose):
+	"""Run a local mock RRA VSDC for load and integration testing"""
+	from rra_compliance.utils.mock_vsdc import serve
+
+	serve(
+		host, port, quiet=not verbose, latency=latency, jitter=jitter, error_rate=error_rate,
+		error_status=error_status, duplicate_rate=duplicate_rate, seed=seed,
+	)
+
+
+@click.command("rra-benchmark-payloads")
+@click.option("--lines", default=200, type=int, help="Invoice lines per payload")
+@click.option("--categories", default=4, type=int, help="Tax categories of the company")
+@click.option("--repeat", default=50, type=int, help="Payloads built per run")
+def rra_benchmark_payloads(lines, categories, repeat):
+	"""Benchmark the payload tax aggregation on synthetic invoice lines"""
+	from rra_compliance.utils.payloads import benchmark
+
+	for name, seconds in benchmark(lines=lines, categories=categories, repeat=repeat).items():
+		click.echo(f"{name}: {seconds * 1000 / repeat:.3f} ms per payload")
+
+
+@click.command("rra-metrics")
+@pass_context
+def rra_metrics(context):
+	"""Show RRA submission lock and rate limit counters"""
+	from rra_compliance.utils.locks import lock_manager
+	from rra_compliance.utils.rate_limit import get_metrics
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		for name, metrics in (("locks", lock_manager.get_metrics()), ("rate limit", get_metrics())):
+			click.echo(f"{name}: " + ", ".join(f"{key}={value}" for key, value in metrics.items()))
+	finally:
+		frappe.destroy()
+
+
+@click.command("rra-sync")
+@click.option("--endpoint", "endpoints", multiple=True, type=click.Choice(["get_codes", "get_item_class", "get_branches", "get_items"]), help="Only sync these endpoints")
+@click.option("--company", help="Company whose TIN/branch to sync. Defaults to the default company.")
+@click.option("--full", is_flag=True, help="Ignore the watermarks and fetch every record")
+@pass_context
+def rra_sync(context, endpoints=None, company=None, full=False):
+	"""Sync RRA master data changed since the last successful sync"""
+	from rra_compliance.setup import RRAComplianceFactory
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		rra = RRAComplianceFactory()
+		rra.set_payload(company)
+		for endpoint in endpoints or ["get_codes", "get_item_class", "get_branches", "get_items"]:
+			getattr(rra, endpoint)(action="update", full=full)
+	finally:
+		frappe.destroy()
+
+
+commands = [rra_push, rra_mock_vsdc, rra_benchmark_payloads, rra_metrics, rra_sync]
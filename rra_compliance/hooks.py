@@ -154,18 +154,37 @@ override_doctype_class = {
 # 	}
 # }
 
+doc_events = {
+	"RRA Transaction Codes": {
+		"on_update": "rra_compliance.utils.codes.clear_code_index",
+		"on_update_after_submit": "rra_compliance.utils.codes.clear_code_index",
+		"on_cancel": "rra_compliance.utils.codes.clear_code_index",
+		"on_trash": "rra_compliance.utils.codes.clear_code_index",
+	},
+	"Item Tax Template": {
+		"on_update": "rra_compliance.utils.tax_rates.clear_tax_rate_table",
+		"on_trash": "rra_compliance.utils.tax_rates.clear_tax_rate_table",
+	},
+	"Account": {
+		"on_update": "rra_compliance.utils.tax_rates.clear_tax_rate_table",
+		"on_trash": "rra_compliance.utils.tax_rates.clear_tax_rate_table",
+		"after_rename": "rra_compliance.utils.tax_rates.clear_tax_rate_table",
+	},
+}
+
 # Scheduled Tasks
 # ---------------
 
 scheduler_events = {
-# 	"all": [
-# 		"rra_compliance.tasks.all"
-# 	],
+	"all": [
+		"rra_compliance.utils.outbox.drain"
+	],
 # 	"daily": [
 # 		"rra_compliance.tasks.daily"
 # 	],
 	"hourly": [
-		"rra_compliance.tasks.hourly"
+		"rra_compliance.tasks.hourly",
+		"rra_compliance.utils.staging.stage_all"
 	],
 	"weekly": [
 		"rra_compliance.tasks.weekly"
@@ -1,12 +1,12 @@
-from datetime import datetime
-
 import frappe
-from erpnext.accounts.doctype.sales_invoice.sales_invoice import get_bank_cash_account
 from frappe.utils import getdate
 
 from rra_compliance.setup import RRAComplianceFactory
+from rra_compliance.utils.purchase_import import enqueue_import
+from rra_compliance.utils.staging import STAGING_DOCTYPE, enqueue_stage, get_page, mark_processed
 
 rra = RRAComplianceFactory()
+IMPORTED_ITEMS_INLINE_LIMIT = 20
 
 @frappe.whitelist()
 def initialize_company(company, dvcSrlNo=None):
@@ -32,55 +32,71 @@ def get_imported_items(company: str, from_date: str):
 	return rra.get_imported_items(date=getdate(from_date))
 
 
+@frappe.whitelist()
+def get_staged_records(company: str, kind: str, from_date=None, search=None, processed=0, start=0, page_length=20):
+	"""Page through the Purchases or Imports staged from RRA"""
+	frappe.has_permission(STAGING_DOCTYPE, "read", throw=True)
+	return get_page(company, kind, from_date=from_date, search=search, processed=processed, start=start, page_length=page_length)
+
+
+@frappe.whitelist()
+def refresh_staged_records(company: str, kind: str):
+	"""Fetch the latest Purchases or Imports from RRA into the staging table"""
+	frappe.has_permission(STAGING_DOCTYPE, "read", throw=True)
+	enqueue_stage(company, kind)
+
+
 @frappe.whitelist()
 def save_mapped_purchases(company: str, purchases):
-	"""Save Mapped Purchases from RRA"""
-	try:
-		rra.set_payload(company)
-		purchases = frappe.parse_json(purchases)
-		for purchase in purchases:
-			doc = frappe.get_doc({
-				"doctype": "Purchase Invoice",
-				"company": company,
-				"supplier": purchase.get("spplrNm"),
-				"is_paid": 1,
-				"posting_date": datetime.strptime(purchase.get("cfmDt"), "%Y-%m-%d %H:%M:%S").date(),
-				"posting_time": datetime.strptime(purchase.get("cfmDt"), "%Y-%m-%d %H:%M:%S").time(),
-				"bill_date": datetime.strptime(purchase.get("cfmDt"), "%Y-%m-%d %H:%M:%S").date(),
-				"bill_no": purchase.get("spplrInvcNo"),
-				"mode_of_payment": frappe.get_value("RRA Transaction Codes Item", { "parent" : "Payment Type", "cd": purchase.get("pmtTyCd") }, 'cdnm'),
-				"paid_amount": purchase.get("totAmt"),
-				"sdc_id": purchase.get("sdcId") or purchase.get("spplrSdcId"),
-			})
-			doc.cash_bank_account = get_bank_cash_account(doc.mode_of_payment, company).get('account')
-			for item in purchase.get("itemList", []):
-				doc.append("items", {
-					"item_name": item.get("itemNm"),
-					"item_code": item.get("itemCd"),
-					"qty": item.get("qty"),
-					"rate": item.get("prc"),
-					"basic_rate": item.get("prc")
-				})
-			doc.insert()
-			doc.submit()
-			frappe.db.commit()
-		return "Purchases saved successfully"
+	"""Save Mapped Purchases from RRA in the background"""
+	purchases = frappe.parse_json(purchases)
+	if not purchases:
+		frappe.throw("No purchases to save")
 
-	except Exception as e:
-		frappe.throw(f"Error saving purchases: {e}")
+	frappe.has_permission("Purchase Invoice", "create", throw=True)
+	enqueue_import(company, purchases)
+	return f"Importing {len(purchases)} purchases in the background. Progress is shown as they are saved."
+
+
+def mark_updated(items, results):
+	updated = set(results["updated"])
+	mark_processed([item.get("staged_record") for item in items if item.get("itemCd") in updated])
+
+
+def get_update_summary(results):
+	return f"Updated count: {len(results['updated'])}\nFailed count: {len(results['failed'])}\nFailed items:\n" + \
+		"\n".join([f"{i['itemCd']}: {i['reason']}" for i in results['failed']])
 
 
 @frappe.whitelist()
 def update_imported_items(company: str, itemList):
-	""" Wrapper to update imported items from RRA """
+	""" Wrapper to update imported items from RRA. Large lists are updated in the background. """
 	try:
-		rra.set_payload(company)
 		items = frappe.parse_json(itemList)
 		if next((item for item in items if not item.get("imptItemsttsCd")), None):
 			frappe.throw("All items must have an Import Item Status Code")
 
-		rra.update_imported_items(items)
+		if len(items) > IMPORTED_ITEMS_INLINE_LIMIT:
+			frappe.enqueue(update_imported_items_job, queue="long", timeout=3600, company=company, items=items, user=frappe.session.user)
+			return f"Updating {len(items)} items in the background. Progress is shown as they are sent."
+
+		rra.set_payload(company)
+		results = rra.update_imported_items(items)
+		mark_updated(items, results)
+		frappe.msgprint(get_update_summary(results))
 		return "Items updated successfully"
 
 	except Exception as e:
 		frappe.throw(f"Error updating items: {e}")
+
+
+def update_imported_items_job(company, items, user=None):
+	""" Background job for `update_imported_items`, publishing progress to the user who started it. """
+	rra.set_payload(company)
+	results = rra.update_imported_items(items, progress=lambda done, total: frappe.publish_realtime(
+		"rra_imported_items_progress", {"progress": done, "total": total}, user=user
+	))
+	mark_updated(items, results)
+	frappe.db.commit()
+	frappe.publish_realtime("rra_imported_items_progress", {"done": 1, "message": get_update_summary(results)}, user=user)
+	return results
@@ -3,6 +3,7 @@ from erpnext.stock.doctype.item.item import Item
 from frappe.exceptions import DoesNotExistError
 
 from rra_compliance.setup import RRAComplianceFactory
+from rra_compliance.utils.codes import get_code_index
 
 rra = RRAComplianceFactory()
 class RRAItemOverrides(Item):
@@ -14,10 +15,11 @@ class RRAItemOverrides(Item):
 			self.name = self.get('item_code')
 			return
 
-		country = frappe.get_value("RRA Transaction Codes Item", { "parent" : "Cuntry", "cdnm": self.get('origin_country') }, 'cd')
-		item_type = frappe.get_value("RRA Transaction Codes Item", { "parent" : "Item Type", "cdnm": self.get('item_type') }, 'cd')
-		package_unit = frappe.get_value("RRA Transaction Codes Item", { "parent" : "Packing Unit", "cdnm": self.get('package_unit').split(' - ')[0] }, 'cd')
-		quantity_unit = frappe.get_value("RRA Transaction Codes Item", { "parent" : "Quantity Unit", "cdnm": self.get('stock_uom').split(' - ')[0] }, 'cd')
+		codes = get_code_index()
+		country = codes.get_code("Cuntry", self.get('origin_country'))
+		item_type = codes.get_code("Item Type", self.get('item_type'))
+		package_unit = codes.get_code("Packing Unit", self.get('package_unit').split(' - ')[0])
+		quantity_unit = codes.get_code("Quantity Unit", self.get('stock_uom').split(' - ')[0])
 
 		prefix = f"{country}{item_type}{package_unit}{quantity_unit}"
 
@@ -1,9 +1,9 @@
 import frappe
 from erpnext.accounts.doctype.purchase_invoice.purchase_invoice import PurchaseInvoice
 
-from rra_compliance.setup import RRAComplianceFactory
+from rra_compliance.utils.outbox import enqueue_submission
+
 
-rra = RRAComplianceFactory()
 class RRAPurchaseInvoiceOverrides(PurchaseInvoice):
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
@@ -12,4 +12,4 @@ class RRAPurchaseInvoiceOverrides(PurchaseInvoice):
 		super().on_submit()
 		pushed = frappe.get_value("RRA Purchase Invoice Log", {"purchase_invoice": self.name, "docstatus": 1}, "rra_pushed")
 		if not pushed:
-			rra.nock_lock(func=rra.save_purchase, purchase_invoice_id=str(self.name))
+			enqueue_submission("save_purchase", self)
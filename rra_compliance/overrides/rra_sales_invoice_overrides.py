@@ -1,13 +1,17 @@
+import frappe
 from erpnext.accounts.doctype.sales_invoice.sales_invoice import SalesInvoice
 
-from rra_compliance.setup import RRAComplianceFactory
+from rra_compliance.utils.outbox import submit
+
 
-rra = RRAComplianceFactory()
 class RRASalesInvoiceOverrides(SalesInvoice):
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
 
 	def on_submit(self):
 		super().on_submit()
-		rra.nock_lock(func=rra.save_sale, sales_invoice_id=str(self.name))
+		if len(self.taxes) == 0:
+			frappe.throw("Please apply taxes to the Sales Invoice before submitting.")
+
+		submit("save_sale", self)
 
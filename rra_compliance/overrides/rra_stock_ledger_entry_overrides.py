@@ -1,13 +1,13 @@
 from erpnext.stock.doctype.stock_ledger_entry.stock_ledger_entry import StockLedgerEntry
 
-from rra_compliance.setup import RRAComplianceFactory
+from rra_compliance.utils.outbox import enqueue_submission
+
 
-rra = RRAComplianceFactory()
 class RRAStockLedgerEntryOverrides(StockLedgerEntry):
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
 
 	def on_submit(self):
 		super().on_submit()
-		rra.nock_lock(func=rra.update_item_stock, stock_ledger_entry_id=self.name)
+		enqueue_submission("update_item_stock", self)
 
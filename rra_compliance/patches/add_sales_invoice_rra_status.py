@@ -0,0 +1,6 @@
+from rra_compliance.utils.customizations import create_independent_custom_fields
+
+
+def execute():
+	""" Sales Invoices show whether their RRA receipt is still pending. """
+	create_independent_custom_fields()
@@ -0,0 +1,6 @@
+from rra_compliance.utils.customizations import create_indexes
+
+
+def execute():
+	""" Suppliers of fetched RRA purchases are matched on TIN. """
+	create_indexes()
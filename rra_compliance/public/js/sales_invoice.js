@@ -2,7 +2,22 @@
 // For license information, please see license.txt
 
 frappe.ui.form.on('Sales Invoice', {
+  onload: (frm) => {
+	// Reload the form, or the print preview, once the background job has the RRA receipt signed.
+	frappe.realtime.off('rra_sale_submitted');
+	frappe.realtime.on('rra_sale_submitted', (data) => {
+	  const route = frappe.get_route();
+	  if (route[0] === 'print' && route[2] === data.sales_invoice) {
+		window.location.reload();
+	  } else if (cur_frm && cur_frm.doctype === 'Sales Invoice' && cur_frm.doc.name === data.sales_invoice) {
+		cur_frm.reload_doc();
+	  }
+	});
+  },
   refresh: async (frm) => {
+	if (frm.doc.docstatus === 1 && frm.doc.rra_status === 'Pending') {
+	  frm.set_intro(__('RRA receipt pending. The invoice is queued for submission to RRA and will refresh once it is signed.'), 'orange');
+	}
 	frm.set_df_property('taxes_and_charges', 'reqd', true);
 	frm.set_df_property('taxes_and_charges', 'read_only', true);
 	frm.set_query('item_code', 'items', () => {
@@ -36,6 +36,15 @@ const css = `
   width: 100%;
   padding: 4px;
 }
+.staged-pager {
+  display: flex;
+  gap: 8px;
+  align-items: center;
+  margin-bottom: 8px;
+}
+.staged-pager .staged-search {
+  max-width: 240px;
+}
 .badge {
   background: #e7f5ff;
   color: #1c7ed6;
@@ -104,6 +113,21 @@ function render_purchase_table(purchases) {
 	return html;
 }
 
+function render_pager(result) {
+	// Imported items are served a page at a time from the ones staged from RRA.
+	const first = result.total ? result.start + 1 : 0;
+	const last = result.start + result.records.length;
+	const fetched_on = result.fetched_on ? __('fetched {0}', [frappe.datetime.comment_when(result.fetched_on)]) : __('not fetched yet');
+	return `
+		<div class="staged-pager">
+			<input type="text" class="form-control input-xs staged-search" placeholder="${__('Search item or declaration')}" value="${frappe.utils.escape_html(page.search)}">
+			<button class="btn btn-xs btn-default staged-prev" ${result.start ? '' : 'disabled'}>${__('Previous')}</button>
+			<button class="btn btn-xs btn-default staged-next" ${last < result.total ? '' : 'disabled'}>${__('Next')}</button>
+			<span class="text-muted">${__('{0} - {1} of {2}, {3}', [first, last, result.total, fetched_on])}</span>
+		</div>
+	`;
+}
+
 function load_item_options() {
 	frappe.call({
 		method: 'frappe.client.get_list',
@@ -125,68 +149,126 @@ function load_item_options() {
 	});
 }
 
+const PAGE_LENGTH = 20;
 let itemList = [];
+let page = { start: 0, search: '', loaded: false };
+
+async function load_imported_items(frm, start = 0) {
+	frappe.dom.freeze('Getting imported items...');
+	try {
+		const r = await frappe.call({
+			method: 'rra_compliance.main.get_staged_records',
+			args: {
+				company: frm.doc.company, kind: 'Import', from_date: frm.doc.from_date,
+				search: page.search, start: start, page_length: PAGE_LENGTH
+			}
+		});
+		const result = r.message;
+		itemList = result.records;
+		page.start = result.start;
+		page.loaded = true;
+		frm.set_df_property('purchase_list', 'options', css + render_pager(result) + render_purchase_table(itemList));
+		bind_pager(frm, result);
+		load_item_options();
+	} finally {
+		frappe.dom.unfreeze();
+	}
+
+	frm.page.set_primary_action(__('Save Imported Items'), () => save_imported_items(frm));
+}
+
+function bind_pager(frm, result) {
+	const $wrapper = frm.fields_dict.purchase_list.$wrapper;
+	$wrapper.find('.staged-prev').on('click', () => load_imported_items(frm, Math.max(result.start - PAGE_LENGTH, 0)));
+	$wrapper.find('.staged-next').on('click', () => load_imported_items(frm, result.start + PAGE_LENGTH));
+	$wrapper.find('.staged-search').on('change', function() {
+		page.search = $(this).val();
+		load_imported_items(frm, 0);
+	});
+}
+
+async function save_imported_items(frm) {
+	frappe.dom.freeze('Saving mapped items...');
+	const mappings = {};
+	document.querySelectorAll('.mapping-select').forEach(select => {
+		const item_cd = select.dataset.itemNm;
+		const mapped_item = select.value;
+		if (mapped_item) {
+			mappings[item_cd] = { mapped_item };
+		}
+	});
+
+	document.querySelectorAll('.status-select').forEach(select => {
+		const item_cd = select.dataset.itemNm;
+		const status = select.value;
+		if (mappings[item_cd]) {
+			mappings[item_cd].status = status;
+		}
+	});
+
+	console.log('Saving mappings:', mappings);
+	itemList.forEach(item => {
+		if (mappings[item.itemNm]) {
+			item.itemNm = mappings[item.itemNm];
+		} else {
+			frappe.dom.unfreeze();
+			frappe.throw('Please map all items before saving.');
+		}
+	});
+	try {
+		const message = await frappe.call({
+			method: 'rra_compliance.main.update_imported_items',
+			args: { itemList, company: frm.doc.company }
+		});
+		frappe.dom.unfreeze();
+		frappe.msgprint(message.message);
+	} catch (error) {
+		frappe.msgprint('Error saving purchases: ' + error?.message || error);
+	} finally {
+		frm.page.clear_primary_action();
+		frm.set_df_property('purchase_list', 'options', css + '<div id="purchase-list"></div>');
+		page.loaded = false;
+	}
+}
+
 frappe.ui.form.on('RRA Import Items', {
+	onload: function(frm) {
+		// Published by the background job that updates large item lists.
+		frappe.realtime.off('rra_imported_items_progress');
+		frappe.realtime.on('rra_imported_items_progress', (data) => {
+			if (data.done) {
+				frappe.hide_progress();
+				frappe.msgprint(data.message);
+			} else {
+				frappe.show_progress(__('Updating Imported Items'), data.progress, data.total);
+			}
+		});
+		frappe.realtime.off('rra_staged_records_updated');
+		frappe.realtime.on('rra_staged_records_updated', (data) => {
+			if (page.loaded && data.kind === 'Import' && data.company === frm.doc.company) {
+				load_imported_items(frm, page.start);
+			}
+		});
+	},
 	refresh: function(frm) {
 		frm.disable_save();
 		frm.set_df_property('purchase_list', 'options', css + '<div id="purchase-list"></div>');
 		frm.set_value('from_date', '');
+		frm.add_custom_button(__('Fetch from RRA'), async () => {
+			if (!frm.doc.company) {
+				frappe.throw(__('Please select a Company'));
+			}
+			await frappe.call({
+				method: 'rra_compliance.main.refresh_staged_records',
+				args: { company: frm.doc.company, kind: 'Import' }
+			});
+			frappe.show_alert({ message: __('Fetching imported items from RRA, the list refreshes when done'), indicator: 'blue' });
+		});
 	},
 	from_date: async function(frm) {
-		frm.page.set_primary_action(__('Get Imported Items'), async function() {
-			frappe.dom.freeze('Getting imported items...');
-			itemList = await frappe.call({
-				method: 'rra_compliance.main.get_imported_items',
-				args: { from_date: frm.doc.from_date, company: frm.doc.company }
-			});
-
-			itemList = itemList.message || [];
-			frm.set_df_property('purchase_list', 'options', css + render_purchase_table(itemList));
-			load_item_options();
-			frappe.dom.unfreeze();
-
-			frm.page.set_primary_action(__('Save Imported Items'), async () => {
-				frappe.dom.freeze('Saving mapped items...');
-				const mappings = {};
-				document.querySelectorAll('.mapping-select').forEach(select => {
-					const item_cd = select.dataset.itemNm;
-					const mapped_item = select.value;
-					if (mapped_item) {
-						mappings[item_cd] = { mapped_item };
-					}
-				});
-
-				document.querySelectorAll('.status-select').forEach(select => {
-					const item_cd = select.dataset.itemNm;
-					const status = select.value;
-					if (mappings[item_cd]) {
-						mappings[item_cd].status = status;
-					}
-				});
-
-				console.log('Saving mappings:', mappings);
-				itemList.forEach(item => {
-					if (mappings[item.itemNm]) {
-						item.itemNm = mappings[item.itemNm];
-					} else {
-						frappe.dom.unfreeze();
-						frappe.throw('Please map all items before saving.');
-					}
-				});
-				try {
-					const message = await frappe.call({
-						method: 'rra_compliance.main.update_imported_items',
-						args: { itemList, company: frm.doc.company }
-					});
-					frappe.dom.unfreeze();
-					frappe.msgprint(message.message);
-				} catch (error) {
-					frappe.msgprint('Error saving purchases: ' + error?.message || error);
-				} finally {
-					frm.page.clear_primary_action();
-					frm.set_df_property('purchase_list', 'options', css + '<div id="purchase-list"></div>');
-				}
-			});
+		frm.page.set_primary_action(__('Get Imported Items'), () => {
+			page.search = '';
+			load_imported_items(frm, 0);
 		});
 	},
 });
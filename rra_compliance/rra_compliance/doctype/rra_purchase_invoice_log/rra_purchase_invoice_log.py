@@ -1,10 +1,12 @@
 # Copyright (c) 2025, Buffer Punk and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 
 class RRAPurchaseInvoiceLog(Document):
 	def autoname(self):
-		self.name = f"RRA-PIL-{self.invc_no}"
+		# Numbers are sequenced per company TIN/branch, so they only identify a log together with the company.
+		abbr = frappe.get_cached_value("Company", self.company, "abbr") if self.company else None
+		self.name = f"RRA-PIL-{abbr}-{self.invc_no}" if abbr else f"RRA-PIL-{self.invc_no}"
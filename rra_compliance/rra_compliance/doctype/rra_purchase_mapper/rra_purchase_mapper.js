@@ -36,6 +36,15 @@ const css = `
   width: 100%;
   padding: 4px;
 }
+.staged-pager {
+  display: flex;
+  gap: 8px;
+  align-items: center;
+  margin-bottom: 8px;
+}
+.staged-pager .staged-search {
+  max-width: 240px;
+}
 .badge {
   background: #e7f5ff;
   color: #1c7ed6;
@@ -127,61 +136,148 @@ function load_item_options() {
 	});
 }
 
+function render_pager(result) {
+	// Purchases are served a page at a time from the ones staged from RRA.
+	const first = result.total ? result.start + 1 : 0;
+	const last = result.start + result.records.length;
+	const fetched_on = result.fetched_on ? __('fetched {0}', [frappe.datetime.comment_when(result.fetched_on)]) : __('not fetched yet');
+	return `
+		<div class="staged-pager">
+			<input type="text" class="form-control input-xs staged-search" placeholder="${__('Search supplier, TIN or invoice')}" value="${frappe.utils.escape_html(page.search)}">
+			<button class="btn btn-xs btn-default staged-prev" ${result.start ? '' : 'disabled'}>${__('Previous')}</button>
+			<button class="btn btn-xs btn-default staged-next" ${last < result.total ? '' : 'disabled'}>${__('Next')}</button>
+			<span class="text-muted">${__('{0} - {1} of {2}, {3}', [first, last, result.total, fetched_on])}</span>
+		</div>
+	`;
+}
+
+function show_import_progress(data) {
+	// Published by the background purchase import after every few purchases.
+	const title = __('Importing Purchases');
+	frappe.show_progress(title, data.progress, data.total,
+		__('{0} created, {1} already imported, {2} failed', [data.created, data.skipped, data.failed]));
+	if (data.done) {
+		frappe.hide_progress();
+		const errors = Object.entries(data.errors || {}).map(([bill_no, error]) => `<li>${bill_no}: ${error}</li>`).join('');
+		frappe.msgprint({
+			title: title,
+			indicator: data.failed ? 'orange' : 'green',
+			message: __('{0} created, {1} already imported, {2} failed', [data.created, data.skipped, data.failed]) + (errors ? `<ul>${errors}</ul>` : ''),
+		});
+	}
+}
+
+const PAGE_LENGTH = 20;
 let purchase_list = [];
+let page = { start: 0, search: '', loaded: false };
+
+async function load_purchases(frm, start = 0) {
+	frappe.dom.freeze('Getting purchases...');
+	try {
+		const r = await frappe.call({
+			method: 'rra_compliance.main.get_staged_records',
+			args: {
+				company: frm.doc.company, kind: 'Purchase', from_date: frm.doc.from_date,
+				search: page.search, start: start, page_length: PAGE_LENGTH
+			}
+		});
+		const result = r.message;
+		purchase_list = result.records;
+		page.start = result.start;
+		page.loaded = true;
+		frm.set_df_property('purchase_list', 'options', css + render_pager(result) + render_purchase_table(purchase_list));
+		bind_pager(frm, result);
+		load_item_options();
+	} finally {
+		frappe.dom.unfreeze();
+	}
+
+	frm.page.set_primary_action(__('Save Purchases'), () => save_purchases(frm));
+}
+
+function bind_pager(frm, result) {
+	const $wrapper = frm.fields_dict.purchase_list.$wrapper;
+	$wrapper.find('.staged-prev').on('click', () => load_purchases(frm, Math.max(result.start - PAGE_LENGTH, 0)));
+	$wrapper.find('.staged-next').on('click', () => load_purchases(frm, result.start + PAGE_LENGTH));
+	$wrapper.find('.staged-search').on('change', function() {
+		page.search = $(this).val();
+		load_purchases(frm, 0);
+	});
+}
+
+async function save_purchases(frm) {
+	frappe.dom.freeze('Saving purchases...');
+	const mappings = {};
+	document.querySelectorAll('.mapping-select').forEach(select => {
+		const item_cd = select.dataset.itemCd;
+		const mapped_item = select.value;
+		if (mapped_item) {
+			mappings[item_cd] = mapped_item;
+		}
+	});
+	console.log('Saving mappings:', mappings);
+	purchase_list.forEach(purchase => {
+		purchase.itemList.forEach(item => {
+			if (mappings[item.itemCd]) {
+				item.itemCd = mappings[item.itemCd];
+			} else {
+				frappe.dom.unfreeze();
+				frappe.throw('Please map all items before saving.');
+			}
+		});
+	});
+	try {
+		const message = await frappe.call({
+			method: 'rra_compliance.main.save_mapped_purchases',
+			args: { purchases: purchase_list, company: frm.doc.company }
+		});
+		frappe.dom.unfreeze();
+		frappe.show_alert({ message: message.message, indicator: 'blue' });
+	} catch (error) {
+		frappe.msgprint('Error saving purchases: ' + error.message);
+	} finally {
+		frm.page.clear_primary_action();
+		frm.set_df_property('purchase_list', 'options', css + '<div id="purchase-list"></div>');
+		page.loaded = false;
+	}
+}
+
 frappe.ui.form.on('RRA Purchase Mapper', {
+	onload: function(frm) {
+		frappe.realtime.off('rra_purchase_import_progress');
+		frappe.realtime.on('rra_purchase_import_progress', (data) => {
+			show_import_progress(data);
+			// Imported purchases leave the pending list
+			if (data.done && data.company === frm.doc.company) {
+				load_purchases(frm, page.start);
+			}
+		});
+		frappe.realtime.off('rra_staged_records_updated');
+		frappe.realtime.on('rra_staged_records_updated', (data) => {
+			if (page.loaded && data.kind === 'Purchase' && data.company === frm.doc.company) {
+				load_purchases(frm, page.start);
+			}
+		});
+	},
 	refresh: function(frm) {
 		frm.disable_save();
 		frm.set_df_property('purchase_list', 'options', css + '<div id="purchase-list"></div>');
 		frm.set_value('from_date', '');
+		frm.add_custom_button(__('Fetch from RRA'), async () => {
+			if (!frm.doc.company) {
+				frappe.throw(__('Please select a Company'));
+			}
+			await frappe.call({
+				method: 'rra_compliance.main.refresh_staged_records',
+				args: { company: frm.doc.company, kind: 'Purchase' }
+			});
+			frappe.show_alert({ message: __('Fetching purchases from RRA, the list refreshes when done'), indicator: 'blue' });
+		});
 	},
 	from_date: async function(frm) {
-		frm.page.set_primary_action(__('Get Purchases'), async function() {
-			frappe.dom.freeze('Getting purchases...');
-			purchase_list = await frappe.call({
-				method: 'rra_compliance.main.get_purchases',
-				args: { from_date: frm.doc.from_date, company: frm.doc.company }
-			});
-
-			purchase_list = purchase_list.message || [];
-			frm.set_df_property('purchase_list', 'options', css + render_purchase_table(purchase_list));
-			load_item_options();
-			frappe.dom.unfreeze();
-
-			frm.page.set_primary_action(__('Save Purchases'), async () => {
-				frappe.dom.freeze('Saving purchases...');
-				const mappings = {};
-				document.querySelectorAll('.mapping-select').forEach(select => {
-					const item_cd = select.dataset.itemCd;
-					const mapped_item = select.value;
-					if (mapped_item) {
-						mappings[item_cd] = mapped_item;
-					}
-				});
-				console.log('Saving mappings:', mappings);
-				purchase_list.forEach(purchase => {
-					purchase.itemList.forEach(item => {
-						if (mappings[item.itemCd]) {
-							item.itemCd = mappings[item.itemCd];
-						} else {
-							frappe.dom.unfreeze();
-							frappe.throw('Please map all items before saving.');
-						}
-					});
-				});
-				try {
-					const message = await frappe.call({
-						method: 'rra_compliance.main.save_mapped_purchases',
-						args: { purchases: purchase_list, company: frm.doc.company }
-					});
-					frappe.dom.unfreeze();
-					frappe.msgprint(message.message);
-				} catch (error) {
-					frappe.msgprint('Error saving purchases: ' + error.message);
-				} finally {
-					frm.page.clear_primary_action();
-					frm.set_df_property('purchase_list', 'options', css + '<div id="purchase-list"></div>');
-				}
-			});
+		frm.page.set_primary_action(__('Get Purchases'), () => {
+			page.search = '';
+			load_purchases(frm, 0);
 		});
 	},
 });
@@ -4,6 +4,9 @@
 # import frappe
 from frappe.model.document import Document
 
+from rra_compliance.utils.transport import clear_transports
+
 
 class RRASettings(Document):
-	pass
+	def on_update(self):
+		clear_transports()
@@ -0,0 +1,10 @@
+# Copyright (c) 2026, Buffer Punk and contributors
+# For license information, please see license.txt
+
+# import frappe
+from frappe.model.document import Document
+
+
+class RRASyncWatermark(Document):
+	def autoname(self):
+		self.name = f"{self.tin}-{self.bhf_id}-{self.endpoint}"
@@ -1,5 +1,7 @@
 import frappe
 
+from rra_compliance.utils.tax_rates import get_tax_category, get_tax_rate_table
+
 
 @frappe.whitelist()
 def generate_invoice_print(doc_name: str) -> str:
@@ -9,10 +11,17 @@ def generate_invoice_print(doc_name: str) -> str:
     """
 
     doc = frappe.get_doc("Sales Invoice", doc_name)
-    rra = frappe.get_doc("RRA Sales Invoice Log", {"sales_invoice": doc.name, "docstatus": 1, "rra_pushed": 1})
+    rra = frappe.db.get_value("RRA Sales Invoice Log", {"sales_invoice": doc.name, "docstatus": 1, "rra_pushed": 1}, "name")
 
     if rra:
+        rra = frappe.get_doc("RRA Sales Invoice Log", rra)
         frappe.db.set_value("RRA Sales Invoice Log", rra.name, "printed_count", (rra.get("printed_count") or 0) + 1)
+    elif doc.get("rra_status") == "Pending":
+        # Queued for RRA, the form reloads this print once the receipt is signed
+        return frappe.render_template(
+            "rra_compliance/rra_compliance/print_format/rra_sales_invoice/rra_sales_invoice_pending.html",
+            {"doc": doc, "company": frappe.get_doc("Company", doc.company)},
+        )
     else:
         frappe.throw("<b>Entry not found for this Sales Invoice. Please ensure the invoice has been pushed to RRA and try again.</b>")
 
@@ -29,9 +38,14 @@ def generate_invoice_print(doc_name: str) -> str:
     qr_data = f"{log.get('salesDt','')}#{log.get('cfmDt','')[8:]}#{rra.get('sdc_id','')}#" f"{rra.get('rcpt_no','')}#{rra.get('intrl_data','')}#{rra.get('rcpt_sign','')}"
 
     tax_groups = {}
+    tax_table = get_tax_rate_table(doc.company)
+    item_tax_titles = {
+        item.item_tax_template: get_tax_category(tax_table, item.item_tax_template).get("title") or item.item_tax_template.split(" - ")[0]
+        for item in doc.items
+    }
     log_items = {item.get("itemCd"): item for item in log.get("itemList", [])}
     for item in doc.items:
-        code = item.item_tax_template.split(" - ")[0]
+        code = item_tax_titles[item.item_tax_template]
         if code not in tax_groups:
             tax_groups[code] = 0
 
@@ -55,6 +69,7 @@ def generate_invoice_print(doc_name: str) -> str:
             "log": log,
             "qr_data": qr_data,
             "tax_groups": tax_groups,
+            "item_tax_titles": item_tax_titles,
         },
     )
 
@@ -6,9 +6,36 @@ import frappe
 import requests
 from click import progressbar
 
+from rra_compliance.utils.bulk import bulk_insert_docs
+from rra_compliance.utils.codes import clear_code_index, get_code_index
+from rra_compliance.utils.dispatch import RRABulkDispatcher
 from rra_compliance.utils.functions import shorten_string
+from rra_compliance.utils.item_groups import sync_item_groups
+from rra_compliance.utils.item_sync import CHUNK_SIZE as ITEM_SYNC_CHUNK_SIZE
+from rra_compliance.utils.item_sync import sync_items
+from rra_compliance.utils.locks import lock_manager
 from rra_compliance.utils.naming_settings import update_amendment_settings
-from rra_compliance.utils.rra_frappe_translation import rra_to_frappe, to_replace
+from rra_compliance.utils.outbox import enqueue_submission
+from rra_compliance.utils.payloads import build_purchase_payload, build_sale_payload, get_invoice_lines
+from rra_compliance.utils.prefetch import get_item_attributes
+from rra_compliance.utils.rra_frappe_translation import (
+	get_translation_context,
+	rra_to_frappe,
+	to_replace,
+	translate,
+	upsert_maps,
+)
+from rra_compliance.utils.sequence import (
+	MAX_RESYNC_PROBES,
+	InvoiceSequence,
+	action_kinds,
+	allocate,
+	sequence_kinds,
+)
+from rra_compliance.utils.tax_rates import clear_tax_rate_table, get_tax_category, get_tax_rate_table
+from rra_compliance.utils.transport import get_transport, is_ambiguous
+from rra_compliance.utils.upsert import get_match_key, remove, upsert
+from rra_compliance.utils.watermarks import EPOCH, SyncWatermark, success_codes
 
 """
 	NOTE:
@@ -44,7 +71,8 @@ from rra_compliance.utils.rra_frappe_translation import rra_to_frappe, to_replac
 
 
 class RRAComplianceFactory:
-	def __init__(self, tin=None, bhf_id=None, base_url=None):
+	def __init__(self, tin=None, bhf_id=None, base_url=None, transport=None):
+		self._transport = transport
 		settings = frappe.get_doc("RRA Settings")
 		if base_url:
 			settings.update({"base_url": base_url})
@@ -78,13 +106,18 @@ class RRAComplianceFactory:
 			"update_stock_master": "/stockMaster/saveStockMaster" # Done
 		}
 
-		self.lock_keys = {
-			"push_item": "rra_item_push_lock",
-			"save_sale": "rra_sales_submission_lock",
-			"save_purchase": "rra_purchase_submission_lock",
-			"update_item_stock": "rra_item_stock_submission_lock",
+		self.bulk_handlers = {
+			"push_item": (self.prepare_item, self.apply_item_response),
+			"save_sale": (self.prepare_sale, self.apply_sale_response),
+			"save_purchase": (self.prepare_purchase, self.apply_purchase_response),
+			"update_item_stock": (self.prepare_item_stock, self.apply_item_stock_response),
 		}
 
+	@property
+	def transport(self):
+		""" Transport used for VSDC calls. Defaults to the pooled per-process transport from RRA Settings. """
+		return self._transport or get_transport()
+
 	def run_after_init(self, action="make"):
 		methods = ['get_item_class', 'get_branches', 'get_items']
 		for method in methods:
@@ -95,6 +128,7 @@ class RRAComplianceFactory:
 
 	def set_payload(self, company_name=None):
 		company = frappe.get_doc("Company", company_name or frappe.defaults.get_global_default("company"))
+		self.company = company.name
 		self.BASE_PAYLOAD = { "tin": company.get('tax_id'), "bhfId": company.get('branch_id') }
 
 	def get_url(self, action):
@@ -105,20 +139,46 @@ class RRAComplianceFactory:
 		payload.update(kwargs)
 		return payload
 
+	def get_watermark(self, action):
+		return SyncWatermark(self.BASE_PAYLOAD.get("tin"), self.BASE_PAYLOAD.get("bhfId"), action, company=self.company)
+
+	def fetch_changes(self, action, list_key, since: datetime | None = None, full=False, print_if=None, print_to: str = 'stdout'):
+		"""
+			Fetch master data changed on VSDC since the last successful sync of an endpoint.
+			:param action: Key of the endpoint in `self.endpoints`
+			:param list_key: Key of the records in the response data, e.g. "clsList"
+			:param since: Explicit start date overriding the watermark
+			:param full: Ignore the watermark and fetch every record
+			:return: (records, resultDt to advance the watermark to once they are applied, or None)
+		"""
+		last_req_dt = since.strftime("%Y%m%d%H%M%S") if since else EPOCH if full else self.get_watermark(action).get()
+		response = self.next(action, self.get_payload(lastReqDt=last_req_dt), print_if=print_if, print_to=print_to)
+		if response.get("resultCd") not in success_codes:
+			return [], None
+
+		# An explicit window may start after the watermark, advancing from it would skip the changes in between
+		return (response.get("data") or {}).get(list_key) or [], None if since else response.get("resultDt")
+
+	def advance_watermark(self, action, result_dt):
+		"""
+			Record a sync as complete once every fetched record was applied.
+			:param action: Key of the endpoint in `self.endpoints`
+			:param result_dt: resultDt returned by `fetch_changes`
+			:return: None
+		"""
+		if result_dt:
+			self.get_watermark(action).advance(result_dt)
+			frappe.db.commit()
+
 	def nock_lock(self, func, *args, **kwargs):
 		"""
-			Wrapper to prevent multiple simultaneous calls to the same endpoint.
+			Run a submission while holding a lease on the document it submits.
+			Only the same document is kept from being submitted twice at once, other documents go through concurrently,
+			and the lease expires on its own if the worker dies.
 		"""
-		lock_key = self.lock_keys.get(func.__name__)
-		if frappe.cache().setnx(lock_key, "locked"):
+		resource = ":".join([func.__name__, *(str(value) for value in (*args, *kwargs.values()))])
+		with lock_manager.lock(resource):
 			return func(*args, **kwargs)
-		else:
-			frappe.throw(f"Another process is currently trying to {func.__name__.replace('_', ' ')}. Please wait a moment and try again.")
-
-	def release_lock(self, func_name):
-		""" Release the lock after the function execution is complete. """
-		lock_key = self.lock_keys.get(func_name)
-		frappe.cache().delete(lock_key)
 
 	def initialize(self, action="make", company=None, dvcSrlNo=None, out='stdout') -> None:
 		""" Initialize connection with RRA and fetch taxpayer and branch details """
@@ -174,9 +234,15 @@ class RRAComplianceFactory:
 				}]
 				stact.save(ignore_permissions=True)
 
-	def get_codes(self, action="make"):
-		""" Get codes from RRA and dump them into respective doctypes """
-		response_data = self.next("get_codes", self.get_payload(lastReqDt="20180520000000")).get("data", {}).get("clsList", [])
+	def get_codes(self, action="make", full=False):
+		"""
+			Get codes from RRA and dump them into respective doctypes.
+			New code classes and the documents their codes translate to are written with one bulk insert per doctype,
+			and the whole sync is committed once.
+			Update runs only fetch and merge the code classes changed since the last successful sync, unless `full` is set.
+		"""
+		response_data, result_dt = self.fetch_changes("get_codes", "clsList", full=full or action != "update")
+		failed = 0
 		if response_data:
 			if action != "update":
 				for item, _ in to_replace.items():
@@ -192,13 +258,27 @@ class RRAComplianceFactory:
 					except Exception as e:
 						print(f"Could not delete existing {item} records: {e}")
 
+			context = get_translation_context()
+			existing = { name.casefold() for name in frappe.get_all("RRA Transaction Codes", pluck="name") }
+			new_classes, translated = [], []
 			with progressbar(length=len(response_data), empty_char=" ", fill_char="=", label="Syncing transaction codes", show_pos=True, item_show_func=lambda x: x) as bar:
 				for item in response_data:
 					try:
-						doc = frappe.get_doc({
-							"doctype": "RRA Transaction Codes",
+						name = item.get("cdClsNm").strip()
+						if action == "destroy":
+							frappe.db.delete("RRA Transaction Codes Item", {"parent": name})
+							frappe.db.delete("RRA Transaction Codes", {"name": name})
+							bar.update(1, f"Deleted Code: {item.get('cdCls')} - {name}")
+							continue
+
+						is_new = name.casefold() not in existing
+						if not is_new and action != "update":
+							bar.update(1, f"Skipped existing Code: {item.get('cdCls')} - {name}")
+							continue
+
+						doc = frappe.new_doc("RRA Transaction Codes").update({
 							"cdcls": item.get("cdCls"),
-							"cdclsnm": item.get("cdClsNm").strip(),
+							"cdclsnm": name,
 							"cdclsdesc": item.get("cdClsDesc"),
 							"useyn": 1 if item.get("useYn") == "Y" else 0,
 							"relation": rra_to_frappe.get(item.get("cdClsNm")),
@@ -207,253 +287,220 @@ class RRAComplianceFactory:
 							"userdfnnm3": item.get("userDfnNm3"),
 							"docstatus": 1
 						})
-						if action == "make":
-							if not frappe.db.exists("RRA Transaction Codes", item.get("cdClsNm")):
-								for i in item.get("dtlList", []):
-									doc.append("items", {
-										"cd": i.get("cd"),
-										"cdnm": i.get("cdNm").strip(),
-										"cddesc": i.get("cdDesc"),
-										"useyn": 1 if i.get("useYn") == "Y" else 0,
-										"srtord": i.get("srtOrd"),
-										"userdfn1": i.get("userDfn1"),
-										"userdfn2": i.get("userDfn2"),
-										"userdfn3": i.get("userDfn3"),
-									})
-									new_item_setting = to_replace.get(rra_to_frappe.get(item.get("cdClsNm")))
-									if new_item_setting:
-										try:
-											frappe.get_doc({
-												"doctype": rra_to_frappe.get(item.get("cdClsNm")),
-												**({ key: i.get(value) if not isinstance(value, dict) else eval(value.get('eval')) for key, value in new_item_setting.items() })
-											}).insert(ignore_permissions=True)
-										except Exception:
-											pass
-
-								doc.insert(ignore_permissions=True)
-								bar.update(1, f"Created Code: {item.get('cdCls')} - {item.get('cdClsNm')}")
-
-						elif action == "destroy":
-								doc.delete()
-								bar.update(1, f"Deleted Code: {item.get('cdCls')} - {item.get('cdClsNm')}")
+						rows = [{
+							"cd": i.get("cd"),
+							"cdnm": i.get("cdNm").strip(),
+							"cddesc": i.get("cdDesc"),
+							"useyn": 1 if i.get("useYn") == "Y" else 0,
+							"srtord": i.get("srtOrd"),
+							"userdfn1": i.get("userDfn1"),
+							"userdfn2": i.get("userDfn2"),
+							"userdfn3": i.get("userDfn3"),
+						} for i in item.get("dtlList") or []]
+
+						relation = rra_to_frappe.get(item.get("cdClsNm"))
+						if relation in to_replace:
+							translated += [frappe.new_doc(relation).update(translate(relation, i, item, context)) for i in item.get("dtlList") or []]
+
+						if is_new:
+							doc.extend("items", rows)
+							new_classes.append(doc)
+							existing.add(name.casefold())
+							bar.update(1, f"Created Code: {item.get('cdCls')} - {name}")
+						else:
+							self.merge_code_class(doc, rows)
+							bar.update(1, f"Updated Code: {item.get('cdCls')} - {name}")
 					except Exception as e:
+						failed += 1
 						bar.update(1, f"Could not process code {item.get('cdCls')}: {e}")
 
-					frappe.db.commit()
+			try:
+				bulk_insert_docs(new_classes)
+				# Countries, UOMs, templates and modes of payment that already exist are kept as they are
+				bulk_insert_docs(translated, ignore_duplicates=True)
+				frappe.db.commit()
+			except Exception as e:
+				frappe.db.rollback()
+				failed = len(response_data)
+				print(f"Could not save transaction codes: {e}")
 
+			clear_tax_rate_table()
+			clear_code_index()
 			print("\n\033[92mSUCCESS \033[0mCodes synchronization completed.")
 		else:
 			print("No codes found in the response.\n")
 
-	def get_item_class(self, action="make"):
-		""" Get items classes from RRA and dump them into item group """
-		response_data = self.next("get_item_class", self.get_payload(lastReqDt="20180520000000")).get("data", {}).get("itemClsList", [])
-		if response_data:
-			if action != "update":
-				existing_docs = frappe.get_all("Item Group", fields=["name"])
-				with progressbar(length=len(existing_docs), empty_char=" ", fill_char="=", label="Deleting existing item groups", show_pos=True, item_show_func=lambda x: x) as bar:
-					for doc in existing_docs:
-						# Deleting this doc takes an awfully long time. Beware.
-						frappe.get_doc("Item Group", doc.name).delete(force=True)
-						frappe.db.commit()
-						bar.update(1, f"Deleted Item Group: {doc.name}")
+		self.finish_sync("get_codes", action, result_dt, failed)
 
-				print("\n\033[92mSUCCESS \033[0mAll existing Item Group records deleted. Inserting new records...\n")
+	def merge_code_class(self, doc, rows):
+		"""
+			Merge changed codes into an existing, submitted, RRA Transaction Codes, matching rows on their code.
+			:param doc: Unsaved RRA Transaction Codes built from the VSDC code class
+			:param rows: Code rows from the VSDC code class
+			:return: None
+		"""
+		existing = frappe.get_doc("RRA Transaction Codes", doc.cdclsnm)
+		frappe.db.set_value("RRA Transaction Codes", existing.name, {
+			field: doc.get(field) for field in ["cdcls", "cdclsdesc", "useyn", "relation", "userdfnnm1", "userdfnnm2", "userdfnnm3"]
+		})
+		current = { row.cd: row for row in existing.items }
+		for row in rows:
+			if row["cd"] in current:
+				current[row["cd"]].db_set(row, update_modified=False)
+			else:
+				existing.append("items", {**row, "docstatus": existing.docstatus}).db_insert()
 
-			with progressbar(length=len(response_data), empty_char=" ", fill_char="=", label="Syncing item groups", show_pos=True, item_show_func=lambda x: x) as bar:
-				for item in response_data:
+	def finish_sync(self, action, sync_action, result_dt, failed):
+		"""
+			Advance the watermark of a master data sync if all its records were applied, or drop it when destroying.
+			Records that failed are fetched again by the next sync.
+		"""
+		if sync_action == "destroy":
+			self.get_watermark(action).reset()
+			frappe.db.commit()
+		elif not failed:
+			self.advance_watermark(action, result_dt)
+
+	def get_item_class(self, action="make", full=False):
+		"""
+			Get items classes from RRA and dump them into item group.
+			Only the groups that differ are inserted, updated, or on full runs disabled when VSDC no longer lists them.
+			Update runs only fetch the classes changed since the last successful sync, unless `full` is set.
+		"""
+		response_data, result_dt = self.fetch_changes("get_item_class", "itemClsList", full=full or action != "update")
+		failed = 0
+		if response_data:
+			if action == "destroy":
+				codes = [item.get("itemClsCd") for item in response_data]
+				for name in frappe.get_all("Item Group", filters={"itemclscd": ["in", codes]}, pluck="name"):
 					try:
-						doc = frappe.get_doc({
-							"doctype": "Item Group",
-							"item_group_name": item.get("itemClsNm").strip(),
-							"itemclscd": item.get("itemClsCd"),
-							"itemclslvl": item.get("itemClsLvl"),
-							"taxtycd": item.get("taxTyCd"),
-							"mjrtgyn": 1 if item.get("mjrTgYn") == "Y" else 0,
-							"useyn": 1 if item.get("useYn") == "Y" else 0,
-						})
-						if action == "make":
-							if not frappe.db.exists("Item Group", item.get("itemClsNm")):
-								doc.insert(ignore_permissions=True)
-								bar.update(1, f"Created Item Group: {item.get('itemClsCd')} - {item.get('itemClsNm')}")
-							else:
-								existing_doc = frappe.get_doc("Item Group", item.get("itemClsNm"))
-								existing_doc.update({
-									"itemclscd": item.get("itemClsCd"),
-									"itemclslvl": item.get("itemClsLvl"),
-									"taxtycd": item.get("taxTyCd"),
-									"mjrtgyn": 1 if item.get("mjrTgYn") == "Y" else 0,
-									"useyn": 1 if item.get("useYn") == "Y" else 0
-								})
-								existing_doc.save(ignore_permissions=True)
-								bar.update(1, f"Updated Item Group: {item.get('itemClsCd')} - {item.get('itemClsNm')}")
-
-						elif action == "destroy":
-								doc.delete()
-								bar.update(1, f"Deleted Item Group: {item.get('itemClsCd')} - {item.get('itemClsNm')}")
+						frappe.delete_doc("Item Group", name, ignore_permissions=True)
 					except Exception as e:
-						bar.update(1, f"Could not process item group {item.get('itemClsCd')}: {e}")
+						failed += 1
+						print(f"Could not delete item group {name}: {e}")
 
+				frappe.db.commit()
+			else:
+				try:
+					result = sync_item_groups(response_data, full=full or action != "update")
 					frappe.db.commit()
-
-				print("\n\033[92mSUCCESS \033[0mItem Categories synchronization completed.")
+					print(
+						"\n\033[92mSUCCESS \033[0mItem Categories synchronization completed: "
+						f"{len(result['inserted'])} created, {len(result['updated'])} updated, {len(result['disabled'])} disabled."
+					)
+				except Exception as e:
+					frappe.db.rollback()
+					failed = len(response_data)
+					print(f"Could not sync item groups: {e}")
 		else:
 			print("No item classes found in the response.\n")
 
+		self.finish_sync("get_item_class", action, result_dt, failed)
+
 	def get_customer(self, customer_tin, action="make"):
 		""" Get customers from RRA and dump them into customer doctype """
-		response_data = self.next("get_customer", self.get_payload(custmTin=customer_tin)).get("data", {}).get("custList", [])
+		response = self.next("get_customer", self.get_payload(custmTin=customer_tin))
+		response_data = [{ **item, "tin": item.get("tin") or customer_tin } for item in ((response.get("data") or {}).get("custList") or [])[:1]]
 		if response_data:
-			item = response_data[0]
-			try:
-				doc = frappe.get_doc({
-					"doctype": "Customer",
-					"customer_name": item.get("taxprnm"),
-					"tax_id": customer_tin,
-					"taxprsttscd": item.get("taxPrSttsCd"),
-				})
-				if action == "make":
-					if not frappe.db.exists("Customer", item.get("custNm")):
-						doc.insert(ignore_permissions=True)
-					else:
-						existing_doc = frappe.get_doc("Customer", item.get("custNm"))
-						existing_doc.update({
-							"customer_name": item.get("taxprnm"),
-							"tax_id": customer_tin,
-							"taxprsttscd": item.get("taxPrSttsCd"),
-						})
-						existing_doc.save(ignore_permissions=True)
+			if action == "destroy":
+				result = remove("Customer", response_data, upsert_maps["Customer"])
+			else:
+				result = upsert("Customer", response_data, upsert_maps["Customer"])
 
-				elif action == "destroy":
-					doc.delete()
-			except Exception as e:
-				print(f"Could not delete customer {item.get('custNm')}: {e}")
+			for name, error in result["failed"].items():
+				print(f"Could not process customer {name}: {error}")
 
-	def get_branches(self, action="make"):
-		""" Get branches from RRA and dump them into branch doctype """
-		response_data = self.next("get_branches", self.get_payload(lastReqDt="20180520000000")).get("data", {}).get("bhfList", [])
+	def get_branches(self, action="make", full=False):
+		"""
+			Get branches from RRA and dump them into branch doctype.
+			Only branches changed since the last successful sync are fetched, unless `full` is set.
+		"""
+		response_data, result_dt = self.fetch_changes("get_branches", "bhfList", full=full or action == "destroy")
+		failed = 0
 		if response_data:
 			with progressbar(length=len(response_data), empty_char=" ", fill_char="=", label="Syncing branches", show_pos=True, item_show_func=lambda x: x) as bar:
-				for item in response_data:
-					try:
-						doc = frappe.get_doc({
-							"doctype": "Branch",
-							"branch": item.get("brnchNm").strip(),
-							"bhfid": item.get("bhfId"),
-							"bhfsttscd": item.get("bhfSttsCd"),
-							"prvncnm": item.get("prvncNm"),
-							"dstrtnm": item.get("dstrtNm"),
-							"sctrnm": item.get("sctrNm"),
-							"locdesc": item.get("locDesc"),
-							"mgrnm": item.get("mgrNm"),
-							"mgrtelno": item.get("mgrTelNo"),
-							"mgremail": item.get("mgrEmail"),
-							"hqyn": 1 if item.get("hqYn") == "Y" else 0,
-						})
-						if action == "make":
-							if not frappe.db.exists("Branch", item.get("brnchNm")):
-								doc.insert(ignore_permissions=True)
-								bar.update(1, f"Created Branch: {item.get('bhfId')} - {item.get('brnchNm')}")
-							else:
-								existing_doc = frappe.get_doc("Branch", item.get("brnchNm"))
-								existing_doc.update({
-									"bhfid": item.get("bhfId"),
-									"bhfsttscd": item.get("bhfSttsCd"),
-									"prvncnm": item.get("prvncNm"),
-									"dstrtnm": item.get("dstrtNm"),
-									"sctrnm": item.get("sctrNm"),
-									"locdesc": item.get("locDesc"),
-									"mgrnm": item.get("mgrNm"),
-									"mgrtelno": item.get("mgrTelNo"),
-									"mgremail": item.get("mgrEmail"),
-									"hqyn": 1 if item.get("hqYn") == "Y" else 0,
-								})
-								existing_doc.save(ignore_permissions=True)
-								bar.update(1, f"Updated Branch: {item.get('bhfId')} - {item.get('brnchNm')}")
-
-						elif action == "destroy":
-								doc.delete()
-								bar.update(1, f"Deleted Branch: {item.get('bhfId')} - {item.get('brnchNm')}")
-					except Exception as e:
-						bar.update(1, f"Could not process branch {item.get('bhfId')}: {e}")
+				if action == "destroy":
+					result = remove("Branch", response_data, upsert_maps["Branch"])
+					bar.update(len(response_data), f"Deleted {len(result['deleted'])} branches")
+				else:
+					result = upsert("Branch", response_data, upsert_maps["Branch"], progress=bar.update)
+
+			failed = len(result["failed"])
+			for name, error in result["failed"].items():
+				print(f"Could not process branch {name}: {error}")
 
 			print("\n\033[92mSUCCESS \033[0mBranches synchronization completed.")
 
-	def get_notices(self, date: datetime = datetime(2018, 5, 20)):
-		return self.next('get_notices', self.get_payload(lastReqDt=date.strftime("%Y%m%d%H%M%S")), print_if='fail', print_to='frappe').get("data", {}).get("noticeList", [])
+		self.finish_sync("get_branches", action, result_dt, failed)
 
-	def get_items(self, last_request_date: datetime = datetime(2018, 5, 20), action="make"):
+	def get_notices(self, date: datetime | None = None, full=False):
 		"""
-			Get items from RRA and dump them into Item doctype.
-			This method is not yet implemented.
+			Get notices published by RRA since the last time they were fetched.
+			:param date: Explicit date from which to fetch notices. The watermark is left as is.
+			:param full: Fetch every notice
+			:return: List of notices
 		"""
-		response_data = self.next('get_items', self.get_payload(lastReqDt=last_request_date.strftime("%Y%m%d%H%M%S"))).get('data', {}).get('itemList', [])
+		notices, result_dt = self.fetch_changes("get_notices", "noticeList", since=date, full=full, print_if='fail', print_to='frappe')
+		self.advance_watermark("get_notices", result_dt)
+		return notices
+
+	def get_items(self, last_request_date: datetime | None = None, action="make", full=False, chunk_size=ITEM_SYNC_CHUNK_SIZE):
+		"""
+			Get items from RRA and dump them into Item doctype, in chunks committed one at a time. See `sync_items`.
+			Only items changed since the last successful sync are fetched, unless a date is given or `full` is set.
+		"""
+		response_data, result_dt = self.fetch_changes("get_items", "itemList", since=last_request_date, full=full or action == "destroy")
+		failed = 0
 		if response_data:
 			with progressbar(length=len(response_data), empty_char=" ", fill_char="=", label="Syncing items", show_pos=True, item_show_func=lambda x: x) as bar:
-				for item in response_data:
-					try:
-						doc = frappe.get_doc({
-							"doctype": "Item",
-							"item_code": item.get("itemCd"),
-							"item_name": item.get("itemNm").strip(),
-							"item_group": frappe.db.get_value("Item Group", {"itemclscd": item.get("itemClsCd")}, "item_group_name"),
-							"item_type": item.get("itemTyCd"),
-							"origin_country": item.get("orgnNatCd"),
-							"uom": frappe.db.get_value("RRA Transaction Codes Item", { "parent" : "Quantity Unit", "cdnm": item.get("qtyUnitCd") }, 'cdNm') + ' - QU',
-							"package_unit": frappe.db.get_value("RRA Transaction Codes Item", { "parent" : "Packing Unit", "cdnm": item.get("pkgUnitCd") }, 'cdNm') + ' - PU',
-							"tax_type": item.get("taxTyCd"),
-							"rra_pushed": 1,
-							"disabled": 0 if item.get("useYn") == "Y" else 1,
-						})
-						if action == "make":
-							if not frappe.db.exists("Item", item.get("itemCd")):
-								doc.insert(ignore_permissions=True)
-								bar.update(1, f"Created Item: {item.get('itemCd')} - {item.get('itemNm')}")
-							else:
-								existing_doc = frappe.get_doc("Item", item.get("itemCd"))
-								existing_doc.update({
-									"item_name": item.get("itemNm"),
-									"item_group": frappe.db.get_value("Item Group", {"itemclscd": item.get("itemClsCd")}, "item_group_name"),
-									"item_type": item.get("itemTyCd"),
-									"origin_country": item.get("orgnNatCd"),
-									"quantity_unit": frappe.db.get_value("RRA Transaction Codes Item", { "parent" : "Quantity Unit", "cdnm": item.get("qtyUnitCd") }, 'cdNm') + ' - QU',
-									"package_unit": frappe.db.get_value("RRA Transaction Codes Item", { "parent" : "Packing Unit", "cdnm": item.get("pkgUnitCd") }, 'cdNm') + ' - PU',
-									"tax_type": item.get("taxTyCd"),
-									"rra_pushed": 1,
-									"disabled": 0 if item.get("useYn") == "Y" else 1,
-								})
-								existing_doc.save(ignore_permissions=True)
-								bar.update(1, f"Updated Item: {item.get('itemCd')} - {item.get('itemNm')}")
-						elif action == "destroy":
-								doc.delete()
-								bar.update(1, f"Deleted Item: {item.get('itemCd')} - {item.get('itemNm')}")
-					except Exception as e:
-						bar.update(1, f"Could not process item {item.get('itemCd')}: {e}")
+				if action == "destroy":
+					for name in get_item_attributes([item.get("itemCd") for item in response_data], fields=["item_code"]):
+						try:
+							frappe.delete_doc("Item", name, ignore_permissions=True)
+							bar.update(1, f"Deleted Item: {name}")
+						except Exception as e:
+							failed += 1
+							bar.update(1, f"Could not delete item {name}: {e}")
 
-			print("\n\033[92mSUCCESS \033[0mItems synchronization completed.")
+					frappe.db.commit()
+				else:
+					result = sync_items(response_data, chunk_size=chunk_size, progress=bar.update)
+					failed = len(result["failed"])
+					for code, error in result["failed"].items():
+						print(f"Could not process item {code}: {error}")
+
+			print(
+				"\n\033[92mSUCCESS \033[0mItems synchronization completed"
+				+ (f": {len(result['created'])} created, {len(result['updated'])} updated, {len(result['unchanged'])} unchanged, {failed} failed." if action != "destroy" else ".")
+			)
 		else:
 			print("No items found in the response.\n")
 
+		self.finish_sync("get_items", action, result_dt, failed)
+
 	def get_purchases(self, date: datetime = datetime(2018, 5, 20)):
 		"""
-			Get purchases from RRA.
+			Get purchases from RRA, creating their missing suppliers.
+			Suppliers are matched on TIN, or on name when VSDC sends no TIN or no supplier has it yet, in one query,
+			and the missing ones are created in one batch.
 			:param date: Date from which to fetch purchases
-			:return: None
+			:return: Purchases, each with the name of its Supplier under "supplier"
 		"""
 		payload = self.get_payload(lastReqDt=date.strftime("%Y%m%d%H%M%S"))
 		response = self.next('get_purchases', payload, print_if='fail', print_to='frappe')
-		response_data = (response.get("data") or {}).get("saleList") or []
-		for purchase in response_data:
-			supplier = frappe.get_value("Supplier", { "supplier_name": purchase.get("spplrNm") }, "name")
-			if not supplier:
-				supplier = frappe.get_doc({
-					"doctype": "Supplier",
-					"supplier_name": purchase.get("spplrNm"),
-					"tax_id": purchase.get("spplrTin"),
-					"branch_id": purchase.get("spplrBhfId"),
-				}).insert(ignore_permissions=True).name
-
-		return response_data
+		return self.attach_suppliers((response.get("data") or {}).get("saleList") or [])
+
+	def attach_suppliers(self, purchases):
+		"""
+			Create the missing suppliers of VSDC purchases and set the name of each purchase's Supplier under "supplier".
+			:param purchases: VSDC `saleList`
+			:return: The same purchases
+		"""
+		suppliers = upsert("Supplier", purchases, upsert_maps["Supplier"], update=False)["names"]
+		for purchase in purchases:
+			purchase["supplier"] = suppliers.get(get_match_key(upsert_maps["Supplier"], purchase)) or purchase.get("spplrNm")
+
+		return purchases
 
 	def get_imported_items(self, date: datetime = datetime(2018, 5, 20)):
 		"""
@@ -465,50 +512,79 @@ class RRAComplianceFactory:
 		response = self.next('get_imported_items', payload, print_if='fail', print_to='frappe')
 		return (response.get("data") or {}).get("itemList", [])
 
-	def update_imported_items(self, items):
+	def update_imported_items(self, items, progress=None):
 		"""
 			Update imported items in RRA.
+			The Items are loaded in one query and the updates sent concurrently through the bulk dispatcher,
+			a batch at a time.
 			:param items: List of items to update
-			:return: None
+			:param progress: Optional callable of (done, total) called after every batch
+			:return: Dict with the item codes "updated" and the "failed" ones, as { "itemCd", "reason" }
 		"""
+		user = shorten_string(frappe.get_user().name, 60)
+		attributes = get_item_attributes([item.get("itemCd") for item in items], fields=["item_code", "itemclscd"])
 		results = {"updated": [], "failed": []}
+		pending = []
 		for item in items:
-			sys_item = frappe.get_doc("Item", item.get("itemCd"))
-			payload = self.get_payload(**{
+			sys_item = attributes.get(item.get("itemCd"))
+			if not sys_item:
+				results["failed"].append({ "itemCd": item.get("itemCd"), "reason": "Item not found" })
+				continue
+
+			pending.append((item, self.get_payload(**{
 				"itemCd": sys_item.item_code,
 				"itemClCd": sys_item.itemclscd,
 				"taskCd": item.get("taskCd"),
 				"dclDe": item.get("dclDe"),
 				"hsCd": item.get("hsCd"),
 				"imptItemsttsCd": item.get("imptItemSttsCd"),
-				"modrNm": shorten_string(frappe.get_user().name, 60),
-				"modrId": shorten_string(frappe.get_user().name, 60),
-			})
-			result = self.next('update_imported_items', payload)
-			if result.get("resultCd") == "000":
-				results["updated"].append(item.get("itemCd"))
-			else:
-				results["failed"].append({ "itemCd": item.get("itemCd"), "reason": result.get("resultMsg") })
+				"modrNm": user,
+				"modrId": user,
+			})))
+
+		dispatcher = RRABulkDispatcher(self)
+		for start in range(0, len(pending), dispatcher.batch_size):
+			batch = pending[start:start + dispatcher.batch_size]
+			responses = dispatcher.send_all("update_imported_items", [payload for _, payload in batch])
+			for (item, payload), response in zip(batch, responses, strict=True):
+				result = self.handle_response(payload, response)
+				if result.get("resultCd") == "000":
+					results["updated"].append(item.get("itemCd"))
+				else:
+					results["failed"].append({ "itemCd": item.get("itemCd"), "reason": result.get("resultMsg") or "No response from RRA" })
+
+			if progress:
+				progress(start + len(batch), len(pending))
 
-		frappe.msgprint(f"Updated count: {len(results['updated'])}\nFailed count: {len(results['failed'])}\nFailed items:\n" +
-			"\n".join([f"{i['itemCd']}: {i['reason']}" for i in results['failed']]))
+		return results
 
 	def push_item(self, item_code: str):
 		"""
 			Push item to RRA.
 			:param item_code: Item Code
 		"""
+		payload, doc = self.prepare_item(item_code)
+		response = self.next('push_item', payload, print_if='fail', print_to='frappe')
+		self.apply_item_response(doc, response)
+
+	def prepare_item(self, item_code: str):
+		"""
+			Build the VSDC payload for an item.
+			:param item_code: Item Code
+			:return: Tuple of (payload, Item document)
+		"""
 		doc = frappe.get_doc("Item", item_code)
+		codes = get_code_index()
 		payload = self.get_payload(**{
 			"itemCd": doc.get('item_code'),
 			"itemClsCd": doc.get('itemclscd'),
 			"itemNm": doc.get('item_name'),
 			"dftPrc": doc.get("valuation_rate") or 0,
-			"itemTyCd": frappe.get_value("RRA Transaction Codes Item", { "parent" : "Item Type", "cdnm": doc.get('item_type') }, 'cd'),
-			"orgnNatCd": frappe.get_value("RRA Transaction Codes Item", { "parent" : "Cuntry", "cdnm": doc.get('origin_country') }, 'cd'),
-			"pkgUnitCd": frappe.get_value("RRA Transaction Codes Item", { "parent" : "Packing Unit", "cdnm": doc.get('package_unit').split(' - ')[0] }, 'cd'),
-			"qtyUnitCd": frappe.get_value("RRA Transaction Codes Item", { "parent" : "Quantity Unit", "cdnm": doc.get('stock_uom').split(' - ')[0] }, 'cd'),
-			"taxTyCd": frappe.get_value("RRA Transaction Codes Item", {"parent" : "Taxation Type", "cdnm": doc.get('tax_type') }, 'cd'),
+			"itemTyCd": codes.get_code("Item Type", doc.get('item_type')),
+			"orgnNatCd": codes.get_code("Cuntry", doc.get('origin_country')),
+			"pkgUnitCd": codes.get_code("Packing Unit", doc.get('package_unit').split(' - ')[0]),
+			"qtyUnitCd": codes.get_code("Quantity Unit", doc.get('stock_uom').split(' - ')[0]),
+			"taxTyCd": codes.get_code("Taxation Type", doc.get('tax_type')),
 			"isrcAplcbYn": "Y" if doc.get('isrc_applicable') else "N",
 			"useYn": "N" if doc.get('disabled') else "Y",
 			"regrNm": "Admin",
@@ -516,10 +592,16 @@ class RRAComplianceFactory:
 			"modrNm": "Admin",
 			"modrId": "Admin"
 		})
-		response = self.next('push_item', payload, print_if='fail', print_to='frappe')
+		return payload, doc
+
+	def apply_item_response(self, doc, response: dict):
+		"""
+			Record the VSDC response for a pushed item.
+			:param doc: Item document returned by `prepare_item`
+			:param response: VSDC response
+		"""
 		if response.get("resultCd") == "000":
 			doc.rra_pushed = 1
-			self.release_lock("push_item")
 		else:
 			frappe.msgprint(
 				msg=f"Failed to push item {doc.get('item_code')} to RRA. Response: {response.get('resultMsg')}",
@@ -527,26 +609,42 @@ class RRAComplianceFactory:
 			)
 
 		doc.taxes = []
-		doc.append("taxes", { "item_tax_template": frappe.get_last_doc("Item Tax Template", filters={"title": doc.tax_type}).name })
+		doc.append("taxes", {
+			"item_tax_template": get_tax_category(get_tax_rate_table(), title=doc.tax_type).get("template")
+				or frappe.get_last_doc("Item Tax Template", filters={"title": doc.tax_type}).name
+		})
 		doc.save(ignore_permissions=True)
 
-	def save_sale(self, sales_invoice_id: str):
+	def save_sale(self, sales_invoice_id: str, deadline=None):
 		"""
 			Save sales to RRA.
 			:param sales_invoice_id: Sales Invoice ID
+			:param deadline: Optional `time.monotonic()` deadline for the VSDC call
 			:return: None
+		"""
+		payload, log = self.prepare_sale(sales_invoice_id)
+		res = self.next('save_sale', payload, print_if='fail', print_to='frappe', deadline=deadline)
+		self.apply_sale_response(log, res)
+
+	def prepare_sale(self, sales_invoice_id: str, invc_no=None):
+		"""
+			Build the VSDC payload and the pending log for a Sales Invoice.
+			:param sales_invoice_id: Sales Invoice ID
+			:param invc_no: Invoice number to use. Defaults to the next one of the company's sequence.
+			:return: Tuple of (payload, RRA Sales Invoice Log)
 			Note:
 				Don't worry about Pyright and Ruff complaints. They can't understand dynamic typing and complex structures.
 		"""
 		sales_invoice = frappe.get_doc("Sales Invoice", sales_invoice_id)
 		self.set_payload(sales_invoice.company)
+		codes = get_code_index()
 
 		if len(sales_invoice.taxes) == 0:
 			frappe.throw("Please apply taxes to the Sales Invoice before submitting.")
 
 		customer = frappe.get_doc("Customer", sales_invoice.customer)
 		last_log = None
-		new_invoc_no = int(frappe.get_value("RRA Sales Invoice Log", {}, "invc_no", order_by="invc_no desc") or 0) + 1
+		new_invoc_no = invc_no or allocate(sales_invoice.company, "sale")
 		try:
 			last_log = frappe.get_last_doc("RRA Sales Invoice Log", filters={"sales_invoice": sales_invoice_id}, order_by="invc_no desc")
 			if last_log and last_log.docstatus == 1:
@@ -555,12 +653,6 @@ class RRAComplianceFactory:
 		except Exception:
 			pass
 
-		items = { i.item_code: frappe.get_value("Item Tax Template", i.item_tax_template, "title") for i in sales_invoice.items }
-		tax_rates = {
-			template.title: frappe.get_value("Item Tax Template Detail", { "parent": template.name, "tax_type": ["like", "VAT - %"] }, "tax_rate")
-			for template in frappe.get_all("Item Tax Template", fields=["title", "name"])
-		}
-		tax_amounts = { key: val[1] for key, val in json.loads(sales_invoice.taxes[0].item_wise_tax_detail).items() }
 		date = datetime.strptime(f"{sales_invoice.posting_date} {sales_invoice.posting_time}", "%Y-%m-%d %H:%M:%S.%f")
 
 		if sales_invoice.is_return:
@@ -572,80 +664,33 @@ class RRAComplianceFactory:
 				"rptNo": new_invoc_no,
 				"rfdDt": date.strftime("%Y%m%d%H%M%S"),
 				"rfdRsnCd": "03",
-				"rcptTyCd": frappe.get_value("RRA Transaction Codes Item", {"parent" : "Sales Receipt Type","cdnm": "Refund after Sale"}, 'cd'),
+				"rcptTyCd": codes.get_code("Sales Receipt Type", "Refund after Sale"),
 				"salesSttsCd": "02"
 			})
 
 		else:
-			if sales_invoice.get('payments'):
-				payment_type = sales_invoice.get('payments')[0].mode_of_payment if len(sales_invoice.get('payments')) == 1 else "OTHER"
-			else:
-				payment_type = "CREDIT"
-
-			payload = self.get_payload(**{
-				"salesDt": date.strftime("%Y%m%d"),
-				"cfmDt": date.strftime("%Y%m%d%H%M%S"),
-				"invcNo": new_invoc_no,
-				"rptNo": new_invoc_no,
-				"orgInvcNo": 0,
-				**({"custTin": customer.tax_id, "prcOrdCd": sales_invoice.purchase_code} if customer.tax_id else {}),
-				"custNm": customer.customer_name,
-				"salesTyCd": "N",
-				"rcptTyCd": frappe.get_value("RRA Transaction Codes Item", {"parent" : "Sales Receipt Type","cdnm": "Sale"}, 'cd'),
-				"pmtTyCd": frappe.get_value("RRA Transaction Codes Item", {
-					"parent" : "Payment Type",
-					"cdnm": payment_type
-				}, 'cd'),
-				"salesSttsCd": "05",
-				**{ f"taxblAmt{key[0][0]}":
-					f"{sum(item.base_net_amount + tax_amounts.get(item.item_code, 0) for item in sales_invoice.items
-						if items.get(item.item_code) == key[0]):.2f}" for key in tax_rates.items()
-				},
-				**{ f"taxRt{key[0]}": f"{value:.2f}" for key, value in tax_rates.items() },
-				**{ f"taxAmt{key[0][0]}": f"{sum(tax_amounts.get(item.item_code, 0) for item in sales_invoice.items
-					if items.get(item.item_code) == key[0]):.2f}" for key in tax_rates.items()
-				},
-				"totTaxblAmt": f"{sales_invoice.base_grand_total:.2f}",
-				"totTaxAmt": f"{sales_invoice.base_total_taxes_and_charges:.2f}",
-				"totAmt": f"{sales_invoice.base_grand_total:.2f}",
-				"prchrAcptcYn": "Y" if not sales_invoice.is_return else "N",
-				"regrNm": shorten_string(sales_invoice.owner, 60),
-				"regrId": shorten_string(sales_invoice.owner, 20),
-				"modrNm": shorten_string(sales_invoice.modified_by, 60),
-				"modrId": shorten_string(sales_invoice.modified_by, 20),
-				"totItemCnt": len(sales_invoice.items),
-				"itemList": [
-					{
-						"itemSeq": item.idx,
-						"itemCd": item.item_code,
-						"itemClsCd": frappe.get_value("Item", item.item_code, "itemclscd"),
-						"itemNm": item.item_name,
-						"pkgUnitCd": frappe.get_value("RRA Transaction Codes Item", { "parent" : "Packing Unit", "cdnm": frappe.get_value("Item", item.item_code, "package_unit").split(' - ')[0] }, 'cd'),
-						"qtyUnitCd": frappe.get_value("RRA Transaction Codes Item", { "parent" : "Quantity Unit", "cdnm": item.uom.split(' - ')[0] }, 'cd'),
-						"qty": f"{item.qty:.2f}",
-						"pkg": f"{item.qty:.2f}", # / item.stock_uom_conversion_factor:.2f}" if item.stock_uom_conversion_factor else "0",
-						"prc": f"{item.base_rate + item.discount_amount:.2f}",
-						"dcRt": f"{item.discount_percentage:.2f}",
-						"dcAmt": f"{item.discount_amount * item.qty:.2f}",
-						"splyAmt": f"{item.base_amount + (item.discount_amount * item.qty):.2f}",
-						"taxTyCd": frappe.get_value("RRA Transaction Codes Item", {"parent" : "Taxation Type", "cdnm": items.get(item.item_code) }, 'cd'),
-						"taxblAmt": f"{item.base_amount:.2f}",
-						"totAmt": f"{item.base_amount:.2f}",
-						"taxAmt": f"{tax_amounts.get(item.item_code, 0):.2f}", # This is not in the documentation but seems required.
-					} for item in sales_invoice.items
-				]
-			})
+			item_attributes = get_item_attributes(i.item_code for i in sales_invoice.items)
+			tax_table = get_tax_rate_table(sales_invoice.company)
+			lines = get_invoice_lines(sales_invoice, item_attributes, codes, tax_table)
+			payload = build_sale_payload(self.get_payload(), sales_invoice, customer, new_invoc_no, date, lines, codes, tax_table)
 
 		log = frappe.get_doc({
 			"doctype": "RRA Sales Invoice Log",
 			"sales_invoice": sales_invoice_id,
+			"company": sales_invoice.company,
 			"invc_no": new_invoc_no,
 			"payload": json.dumps(payload),
 			"docstatus": 1,
 			**({"amended_from": last_log.name} if last_log else {})
 		})
+		return payload, log
 
-		res = self.next('save_sale', payload, print_if='fail', print_to='frappe')
+	def apply_sale_response(self, log, res: dict):
+		"""
+			Record the VSDC response for a sale, retrying on duplicate invoice numbers.
+			:param log: RRA Sales Invoice Log returned by `prepare_sale`
+			:param res: VSDC response
+		"""
 		if (res.get("resultCd") == "000"):
 			log.update({
 				"rra_pushed": 1, "response": json.dumps(res),
@@ -658,7 +703,11 @@ class RRAComplianceFactory:
 				"mrc_no": res["data"].get("mrcNo"),
 			})
 			log.save()
-			self.release_lock("save_sale")
+			frappe.db.set_value("Sales Invoice", log.sales_invoice, "rra_status", "Submitted", update_modified=False)
+			frappe.publish_realtime(
+				"rra_sale_submitted", {"sales_invoice": log.sales_invoice},
+				user=frappe.db.get_value("Sales Invoice", log.sales_invoice, "modified_by"), after_commit=True,
+			)
 			frappe.msgprint(
 				alert=True,
 				msg=f"Sales Invoice successfully submitted to RRA with Invoice No: {log.invc_no}",
@@ -666,32 +715,44 @@ class RRAComplianceFactory:
 			)
 		elif (res.get("resultCd") == "924"):  # 924 = Duplicate Entry
 			"""
-				Recursive until it finds a non-duplicate invoice number.
+				Retried from a single background job until it finds a non-duplicate invoice number.
 				This is necessary because RRA provides no way to check for existing invoice numbers
 				... Like I said, their API design is awful.
 			"""
 			log.update({ "response": json.dumps(res), "rra_pushed": 1})
 			self.save_doc(log)
-			frappe.enqueue(self.save_sale, sales_invoice_id=sales_invoice_id, timeout=1500)
+			self.enqueue_resync("save_sale", log.sales_invoice, log)
 		else:
-			self.release_lock("save_sale")
 			frappe.throw(
 				title="RRA Sales Invoice Submission Failed",
 				msg= res.get("resultMsg", "Failed to submit Sales Invoice to RRA. Please check error log for details."),
 			)
 
-	def save_purchase(self, purchase_invoice_id: str):
+	def save_purchase(self, purchase_invoice_id: str, deadline=None):
 		"""
 			Save purchase to RRA.
 			:param purchase_invoice_id: Purchase Invoice ID
+			:param deadline: Optional `time.monotonic()` deadline for the VSDC call
 			:return: None
 		"""
+		payload, log = self.prepare_purchase(purchase_invoice_id)
+		res = self.next('save_purchase', payload, print_if='fail', print_to='frappe', deadline=deadline)
+		self.apply_purchase_response(log, res)
+
+	def prepare_purchase(self, purchase_invoice_id: str, invc_no=None):
+		"""
+			Build the VSDC payload and the pending log for a Purchase Invoice.
+			:param purchase_invoice_id: Purchase Invoice ID
+			:param invc_no: Invoice number to use. Defaults to the next one of the company's sequence.
+			:return: Tuple of (payload, RRA Purchase Invoice Log)
+		"""
 		purchase_invoice = frappe.get_doc("Purchase Invoice", purchase_invoice_id)
 		self.set_payload(purchase_invoice.company)
+		codes = get_code_index()
 
 		supplier = frappe.get_doc("Supplier", purchase_invoice.supplier)
 		last_log = None
-		new_invoc_no = int(frappe.get_value("RRA Purchase Invoice Log", {}, "invc_no", order_by="invc_no desc") or 0) + 1
+		new_invoc_no = invc_no or allocate(purchase_invoice.company, "purchase")
 		try:
 			last_log = frappe.get_last_doc("RRA Purchase Invoice Log", filters={"purchase_invoice": purchase_invoice_id}, order_by="invc_no desc")
 			if last_log and last_log.docstatus == 1:
@@ -700,12 +761,6 @@ class RRAComplianceFactory:
 		except Exception:
 			pass
 
-		items = { i.item_code: frappe.get_value("Item Tax Template", i.item_tax_template, "title") for i in purchase_invoice.items }
-		tax_rates = {
-			template.title: frappe.get_value("Item Tax Template Detail", { "parent": template.name, "tax_type": frappe.get_last_doc("Account", filters={"name": ["like", "VAT - %"]}).name }, "tax_rate")
-			for template in frappe.get_all("Item Tax Template", fields=["title", "name"])
-		}
-		tax_amounts = { key: val[1] for key, val in json.loads(purchase_invoice.taxes[0].item_wise_tax_detail).items() }
 		date = datetime.strptime(f"{purchase_invoice.posting_date} {purchase_invoice.posting_time}", "%Y-%m-%d %H:%M:%S.%f")
 
 		if purchase_invoice.is_return:
@@ -716,75 +771,34 @@ class RRAComplianceFactory:
 				"invcNo": new_invoc_no,
 				"rfdDt": date.strftime("%Y%m%d%H%M%S"),
 				"rfdRsnCd": "03",
-				"rcptTyCd": frappe.get_value("RRA Transaction Codes Item", { "parent": "Purchase Receipt Type", "cdnm": "Refund after Purchase" }, 'cd')
+				"rcptTyCd": codes.get_code("Purchase Receipt Type", "Refund after Purchase")
 			})
 		else:
-			payload = self.get_payload(**{
-				"invcNo": new_invoc_no,
-				"cfmDt": date.strftime("%Y%m%d%H%M%S"),
-				"pchsDt": date.strftime("%Y%m%d"),
-				"wrhsDt": date.strftime("%Y%m%d%H%M%S"),
-				**({"supplrTin": supplier.tax_id} if supplier.tax_id else {}),
-				"supplrNm": supplier.supplier_name,
-				"orgInvcNo": 0,
-				**({"spplrBhfId": supplier.get("branch_id")} if supplier.get("branch_id") else {}),
-				**({"spplrInvcNo": purchase_invoice.bill_no} if purchase_invoice.bill_no else {}),
-				**({"spplrSdcId": purchase_invoice.get("sdc_id")} if purchase_invoice.get("sdc_id") else {}),
-				"regTyCd": "M",
-				"pchsTyCd": "N",
-				"rcptTyCd": frappe.get_value("RRA Transaction Codes Item", {"parent" : "Purchase Receipt Type","cdnm": "Purchase"}, 'cd'),
-				"pmtTyCd": frappe.get_value("RRA Transaction Codes Item", {"parent" : "Payment Type", "cdnm": purchase_invoice.get('mode_of_payment') or "CREDIT"}, 'cd'),
-				"pchsSttsCd": "05",
-				"totItemCnt": len(purchase_invoice.items),
-				**{ f"taxblAmt{key[0][0]}":
-					f"{sum(item.base_net_amount + tax_amounts.get(item.item_code, 0) for item in purchase_invoice.items
-						if items.get(item.item_code) == key[0]):.2f}" for key in tax_rates.items()
-				},
-				**{ f"taxRt{key[0]}": f"{value:.2f}" for key, value in tax_rates.items() },
-				**{ f"taxAmt{key[0][0]}": f"{sum(tax_amounts.get(item.item_code, 0) for item in purchase_invoice.items
-					if items.get(item.item_code) == key[0]):.2f}" for key in tax_rates.items()
-				},
-				"totTaxblAmt": f"{purchase_invoice.base_grand_total:.2f}",
-				"totTaxAmt": f"{purchase_invoice.base_total_taxes_and_charges:.2f}",
-				"totAmt": f"{purchase_invoice.base_grand_total:.2f}",
-				"regrNm": shorten_string(purchase_invoice.owner, 60),
-				"regrId": shorten_string(purchase_invoice.owner, 20),
-				"modrNm": shorten_string(purchase_invoice.modified_by, 60),
-				"modrId": shorten_string(purchase_invoice.modified_by, 20),
-				"itemList": [
-					{
-						"itemSeq": item.idx,
-						"itemCd": item.item_code,
-						"itemClsCd": frappe.get_value("Item", item.item_code, "itemclscd"),
-						"itemNm": item.item_name,
-						"pkgUnitCd": frappe.get_value("RRA Transaction Codes Item", { "parent" : "Packing Unit", "cdnm": frappe.get_value("Item", item.item_code, "package_unit").split(' - ')[0] }, 'cd'),
-						"qtyUnitCd": frappe.get_value("RRA Transaction Codes Item", { "parent" : "Quantity Unit", "cdnm": item.uom.split(' - ')[0] }, 'cd'),
-						"qty": int(item.qty),
-						"pkg": int(item.qty),
-						"prc": f"{item.base_net_rate + (tax_amounts.get(item.item_code, 0) / item.qty):.2f}",
-						"splyAmt": f"{item.base_net_amount + tax_amounts.get(item.item_code, 0):.2f}",
-						"dcRt": f"{item.discount_percentage:.2f}",
-						"dcAmt": f"{item.discount_amount:.2f}",
-						"taxTyCd": frappe.get_value("RRA Transaction Codes Item", {"parent" : "Taxation Type", "cdnm": items.get(item.item_code) }, 'cd'),
-						"taxblAmt": f"{item.base_net_amount + tax_amounts.get(item.item_code, 0):.2f}",
-						"totAmt": f"{item.base_net_amount + tax_amounts.get(item.item_code, 0):.2f}",
-						"taxAmt": f"{tax_amounts.get(item.item_code, 0):.2f}",
-					} for item in purchase_invoice.items
-				]
-			})
+			item_attributes = get_item_attributes(i.item_code for i in purchase_invoice.items)
+			tax_table = get_tax_rate_table(purchase_invoice.company)
+			lines = get_invoice_lines(purchase_invoice, item_attributes, codes, tax_table)
+			payload = build_purchase_payload(self.get_payload(), purchase_invoice, supplier, new_invoc_no, date, lines, codes, tax_table)
+
 		log = frappe.get_doc({
 			"doctype": "RRA Purchase Invoice Log",
 			"purchase_invoice": purchase_invoice_id,
+			"company": purchase_invoice.company,
 			"invc_no": new_invoc_no,
 			"payload": json.dumps(payload),
 			"docstatus": 1,
 			**({"amended_from": last_log.name} if last_log else {})
 		})
-		res = self.next('save_purchase', payload, print_if='fail', print_to='frappe')
+		return payload, log
+
+	def apply_purchase_response(self, log, res: dict):
+		"""
+			Record the VSDC response for a purchase, retrying on duplicate invoice numbers.
+			:param log: RRA Purchase Invoice Log returned by `prepare_purchase`
+			:param res: VSDC response
+		"""
 		log.update({"rra_pushed": 1, "response": json.dumps(res)})
 		if (res.get("resultCd") == "000"):
 			log.save()
-			self.release_lock("save_purchase")
 			frappe.msgprint(
 				alert=True,
 				msg=f"Purchase Invoice successfully submitted to RRA with Invoice No: {log.invc_no}",
@@ -792,10 +806,9 @@ class RRAComplianceFactory:
 			)
 		elif (res.get("resultCd") == "924"):  # 924 = Duplicate Entry
 			self.save_doc(log)
-			frappe.enqueue(self.save_purchase, purchase_invoice_id=purchase_invoice_id, timeout=1500)
+			self.enqueue_resync("save_purchase", log.purchase_invoice, log)
 		else:
-			self.release_lock("save_purchase")
-			frappe.log_error(title="RRA Purchase Invoice Submission Failed", message=f"Res: {json.dumps(res)}\nPayload: {json.dumps(payload)}")
+			frappe.log_error(title="RRA Purchase Invoice Submission Failed", message=f"Res: {json.dumps(res)}\nPayload: {log.payload}")
 			frappe.throw(
 				title="RRA Purchase Invoice Submission Failed",
 				msg= res.get("resultMsg", "Failed to submit Purchase Invoice to RRA. Please check linked log for details."),
@@ -831,19 +844,32 @@ class RRAComplianceFactory:
 
 		return "16" if sle.actual_qty < 0 else "06"
 
-	def update_item_stock(self, stock_ledger_entry_id: str):
+	def update_item_stock(self, stock_ledger_entry_id: str, deadline=None):
 		"""
 			Update item stock to RRA.
 			:param stock_ledger_entry_id: Stock Ledger Entry ID to process
+			:param deadline: Optional `time.monotonic()` deadline for the VSDC call
 			:return: None
+		"""
+		payload, log = self.prepare_item_stock(stock_ledger_entry_id)
+		res = self.next('update_item_stock', payload, print_if='fail', print_to='frappe', deadline=deadline)
+		self.apply_item_stock_response(log, res)
+
+	def prepare_item_stock(self, stock_ledger_entry_id: str, sar_no=None):
+		"""
+			Build the VSDC payload and the pending log for a Stock Ledger Entry.
+			:param stock_ledger_entry_id: Stock Ledger Entry ID to process
+			:param sar_no: Stored and released number to use. Defaults to the next one of the company's sequence.
+			:return: Tuple of (payload, RRA Stock IO Log)
 			:Note:
 				Code is currently untested.
 		"""
 		sle = frappe.get_doc("Stock Ledger Entry", stock_ledger_entry_id)
 		self.set_payload(sle.company)
+		codes = get_code_index()
 
 		last_log = None
-		new_sar_no = int(frappe.get_value("RRA Stock IO Log", {}, "sar_no", order_by="sar_no desc") or 0) + 1
+		new_sar_no = sar_no or allocate(sle.company, "stock")
 		try:
 			last_log = frappe.get_last_doc("RRA Purchase Invoice Log", filters={"stock_ledger_entry": stock_ledger_entry_id}, order_by="sar_no desc")
 			if last_log and last_log.docstatus == 1:
@@ -853,11 +879,11 @@ class RRAComplianceFactory:
 			pass
 
 		item = frappe.get_doc("Item", sle.item_code)
-		tax_temp = frappe.get_value("Item Tax Template", item.taxes[0].item_tax_template, "name") if \
-			item.taxes and len(item.taxes) > 0 else \
-			frappe.get_value('Item Tax Template', {'title': item.tax_type}, 'name')
-
-		tax_rate = frappe.get_value("Item Tax Template Detail", { "parent": tax_temp, "tax_type": ["like", "VAT - %"] }, "tax_rate")
+		tax_rate = get_tax_category(
+			get_tax_rate_table(sle.company),
+			template=item.taxes[0].item_tax_template if item.taxes else None,
+			title=item.tax_type
+		).get("rate", 0)
 		record = frappe.get_doc(sle.voucher_type, sle.voucher_no)
 
 		is_sale_or_purchase = sle.voucher_type in ["Purchase Receipt", "Purchase Invoice", "Delivery Note", "Sales Invoice"]
@@ -880,16 +906,16 @@ class RRAComplianceFactory:
 				{
 					"itemSeq": 1,
 					"itemCd": sle.item_code,
-					"itemClsCd": frappe.get_value("Item", sle.item_code, "itemclscd"),
+					"itemClsCd": item.itemclscd,
 					"itemNm": item.item_name,
-					"pkgUnitCd": frappe.get_value("RRA Transaction Codes Item", { "parent" : "Packing Unit", "cdnm": frappe.get_value("Item", sle.item_code, "package_unit").split(' - ')[0] }, 'cd'),
-					"qtyUnitCd": frappe.get_value("RRA Transaction Codes Item", { "parent" : "Quantity Unit", "cdnm": item.stock_uom.split(' - ')[0] }, 'cd'),
+					"pkgUnitCd": codes.get_code("Packing Unit", item.package_unit.split(' - ')[0]),
+					"qtyUnitCd": codes.get_code("Quantity Unit", item.stock_uom.split(' - ')[0]),
 					"qty": abs(sle.actual_qty),
 					"pkg": abs(sle.actual_qty),
 					"prc": f"{item_in_record.base_rate:.2f}" if is_sale_or_purchase else "0.00",
 					"splyAmt": f"{item_in_record.base_rate * abs(sle.actual_qty):.2f}" if is_sale_or_purchase else "0.00",
 					"totDcAmt": "0.00",
-					"taxTyCd": frappe.get_value("RRA Transaction Codes Item", {"parent" : "Taxation Type", "cdnm": item.tax_type }, 'cd'),
+					"taxTyCd": codes.get_code("Taxation Type", item.tax_type),
 					"taxblAmt": f"{item_in_record.base_rate * abs(sle.actual_qty):.2f}" if is_sale_or_purchase else "0.00",
 					"totAmt": f"{item_in_record.base_rate * abs(sle.actual_qty):.2f}" if is_sale_or_purchase else "0.00",
 					"taxAmt": f"{(item_in_record.base_rate * abs(sle.actual_qty)) * (tax_rate / 100):.2f}" if is_sale_or_purchase else "0.00",
@@ -900,23 +926,28 @@ class RRAComplianceFactory:
 		log = frappe.get_doc({
 			"doctype": "RRA Stock IO Log",
 			"stock_ledger_entry": stock_ledger_entry_id,
+			"company": sle.company,
 			"sar_no": new_sar_no,
 			"payload": json.dumps(payload),
 			"docstatus": 1,
 			**({"amended_from": last_log.name} if last_log else {})
 		})
+		return payload, log
 
-		res = self.next('update_item_stock', payload, print_if='fail', print_to='frappe')
+	def apply_item_stock_response(self, log, res: dict):
+		"""
+			Record the VSDC response for a stock movement and update the stock master on success.
+			:param log: RRA Stock IO Log returned by `prepare_item_stock`
+			:param res: VSDC response
+		"""
 		log.update({"rra_pushed": 1, "response": json.dumps(res)})
 		if (res.get("resultCd") == "000"):
-			self.release_lock("update_item_stock")
-			self.update_stock_master(sle, log)
+			self.update_stock_master(frappe.get_doc("Stock Ledger Entry", log.stock_ledger_entry), log)
 		elif (res.get("resultCd") == "924"):  # 924 = Duplicate Entry
 			self.save_doc(log)
-			frappe.enqueue(self.update_item_stock, stock_ledger_entry_id=stock_ledger_entry_id, timeout=1500)
+			self.enqueue_resync("update_item_stock", log.stock_ledger_entry, log)
 		else:
-			self.release_lock("update_item_stock")
-			frappe.log_error(title="RRA Item Stock Submission Failed", message=f"Res: {json.dumps(res)}\nPayload: {json.dumps(payload)}")
+			frappe.log_error(title="RRA Item Stock Submission Failed", message=f"Res: {json.dumps(res)}\nPayload: {log.payload}")
 			frappe.throw(
 				title="RRA Item Stock Submission Failed",
 				msg= res.get("resultMsg", "Failed to submit Item Stock to RRA. Please check linked log for details."),
@@ -927,7 +958,11 @@ class RRAComplianceFactory:
 			Update stock master to RRA.
 			:param sle: Stock Ledger Entry document to update stock master for
 			:param io_log: RRA Stock IO Log document to update with response
+			:param attempt: Number of earlier attempts
 			:return: None
+			Note:
+				Transient failures are retried by the transport first. Anything still failing, business rejections
+				included, is retried in a background job, up to 10 times, and the last response is kept on the log.
 		"""
 		payload = self.get_payload(**{
 			"itemCd": sle.item_code,
@@ -942,7 +977,78 @@ class RRAComplianceFactory:
 		io_log.update({ "stock_master_response": json.dumps(response) })
 		io_log.save()
 		if response.get("resultCd") != "000" and attempt < 10:
-			frappe.enqueue(self.update_stock_master, sle=sle, io_log=io_log, attempt=attempt+1, timeout=1500)
+			frappe.enqueue(
+				self.update_stock_master, sle=sle, io_log=io_log, attempt=attempt + 1, timeout=1500, enqueue_after_commit=True,
+			)
+
+	def enqueue_resync(self, action, name, log):
+		""" Recover from a `924` in one background job. See `resync_numbering`. """
+		frappe.enqueue(
+			self.resync_numbering, action=action, name=name, company=log.company,
+			number=log.get(sequence_kinds[action_kinds[action]][2]),
+			timeout=1500, job_id=f"rra_resync::{action}::{name}", deduplicate=True,
+		)
+
+	def hold_for_reconciliation(self, log, res: dict):
+		"""
+			Keep a submission VSDC answered `924` to on a retry of a number already sent without a definite answer.
+			VSDC most likely recorded that first attempt but its receipt is lost, so the document is neither marked
+			submitted nor resynced under a new number: the log is flagged to be reconciled with VSDC.
+			:param log: Log returned by the action's prepare
+			:param res: VSDC response
+		"""
+		log.update({"rra_pushed": 0, "needs_reconciliation": 1, "response": json.dumps(res)})
+		log.save(ignore_permissions=True)
+		frappe.log_error(
+			title="RRA Compliance: Submission needs reconciliation",
+			message=f"VSDC answered 924 to a retry of number {log.get('invc_no') or log.get('sar_no')} on {log.doctype} {log.name}. "
+				"The first attempt was probably recorded, but its receipt is unknown.",
+		)
+
+	def resync_numbering(self, action, name, company, number):
+		"""
+			Find a free number after VSDC answered `924` for `number`, and submit the document with it.
+			VSDC cannot be asked which numbers are used and every probe is a real submission, so numbers are probed
+			exponentially further ahead (+1, +2, +4, ...) until one is accepted. There is no binary search back into
+			the last gap, since the accepted probe has already been recorded by VSDC.
+			Rejected numbers are pushed into the company's sequence right away, so other submissions skip them too.
+			A probe without a definite answer (transport failure, 429 or 5xx) hands the document back to the outbox.
+			:param action: "save_sale", "save_purchase" or "update_item_stock"
+			:param name: Name of the document to submit
+			:param company: Company of the document
+			:param number: Number rejected with `924`
+		"""
+		prepare, apply = self.bulk_handlers[action]
+		sequence = InvoiceSequence(company, action_kinds[action])
+		step = 1
+		with lock_manager.lock(f"{action}:{name}", wait=lock_manager.get_ttl()) as lease:
+			for _ in range(MAX_RESYNC_PROBES):
+				sequence.advance_to(number + step - 1)
+				number = sequence.allocate()
+				payload, log = prepare(name, number)
+				try:
+					response = self.transport.post(self.get_url(action), payload)
+				except requests.RequestException as e:
+					response = e
+
+				res = self.handle_response(payload, response, print_if='fail', print_to='frappe')
+				if res.get("resultCd") != "924":
+					lease.check()
+					if not res.get("resultCd"):
+						# No definite answer: `apply` would throw and drop the document, so the outbox retries it,
+						# with this number if VSDC may have recorded it
+						source, _, _ = sequence_kinds[action_kinds[action]]
+						return enqueue_submission(action, frappe.get_doc(source, name), number=number if is_ambiguous(response) else None)
+
+					return apply(log, res)
+
+				step *= 2
+				lease.renew()
+
+		frappe.log_error(
+			title="RRA Compliance: Numbering resync failed",
+			message=f"No free number found for {name} after {MAX_RESYNC_PROBES} probes. Last rejected number: {number}",
+		)
 
 	def save_doc(self, doc, **kwargs) -> None:
 		"""
@@ -953,8 +1059,39 @@ class RRAComplianceFactory:
 		doc.save(**kwargs)
 		frappe.db.commit()
 
-	def next(self, action, payload, print_if=None, print_to: str = 'stdout') -> dict:
-		response = requests.post(self.get_url(action), json=payload)
+	def next(self, action, payload, print_if=None, print_to: str = 'stdout', deadline=None) -> dict:
+		"""
+			Send a payload to a VSDC endpoint through the factory's transport.
+			:param action: Key of the endpoint in `self.endpoints`
+			:param payload: Payload to send
+			:param print_if: When to report the outcome: 'any', 'success' or 'fail'
+			:param print_to: 'stdout' or 'frappe'
+			:param deadline: Optional `time.monotonic()` deadline propagated to the transport timeouts
+			:return: VSDC JSON response, or an empty dict if the call could not be completed
+		"""
+		try:
+			response = self.transport.post(self.get_url(action), payload, deadline=deadline)
+		except requests.RequestException as e:
+			response = e
+
+		return self.handle_response(payload, response, print_if=print_if, print_to=print_to)
+
+	def handle_response(self, payload, response, print_if=None, print_to: str = 'stdout') -> dict:
+		"""
+			Turn a transport result into the VSDC JSON response, reporting failures.
+			:param payload: Payload that was sent
+			:param response: requests.Response, or the exception raised while sending
+			:return: VSDC JSON response, or an empty dict if the call could not be completed
+		"""
+		if isinstance(response, Exception):
+			e = response
+			if print_if in ['any', 'fail']:
+				if print_to == 'stdout':
+					print("RRA Transaction failed:\n", f"Error: {e}\n", sep="\n")
+				else:
+					frappe.log_error(message=f"RRA Transaction failed:\nError: {e}\nPayload: {payload}", title="RRA API Error")
+			return {}
+
 		if response.ok:
 			json_response = response.json()
 			if json_response.get("resultCd") == "000":
@@ -998,7 +1135,7 @@ def initialize(action="make", force=False):
 		:return: None
 	"""
 	from frappe.printing.doctype.print_format.print_format import make_default
-	from rra_compliance.utils.customizations import create_dependent_custom_fields, create_independent_custom_fields, delete_all_fields
+	from rra_compliance.utils.customizations import create_dependent_custom_fields, create_independent_custom_fields, create_indexes, delete_all_fields
 
 
 	rra = RRAComplianceFactory(
@@ -1009,6 +1146,7 @@ def initialize(action="make", force=False):
 
 	if action == "make":
 		create_independent_custom_fields()
+		create_indexes()
 		print("\n\033[92mSUCCESS \033[0m" + "Custom fields created successfully.\n")
 		rra.initialize(action=action)
 		rra.get_codes(action=action)
@@ -1,39 +1,107 @@
 from rra_compliance.setup import RRAComplianceFactory
+from rra_compliance.utils.dispatch import DEFAULT_BATCH_SIZE, RRABulkDispatcher
+from rra_compliance.utils.locks import Lease, lock_manager
+from rra_compliance.utils.sequence import checkpoint_sequences
+from frappe.utils.background_jobs import get_queues_timeout
 import frappe
 
+LEADER_LOCK = "rra_push_leader"
+LEADER_TTL = 55 * 60
+
+"""
+	Unpushed documents per action, in order of priority: sales > purchases > items > stock.
+	Logs waiting to be reconciled with VSDC are left alone, since sending them again would report them twice.
+"""
+pending = {
+	"save_sale": lambda: frappe.get_all("RRA Sales Invoice Log", filters={"rra_pushed": 0, "needs_reconciliation": 0}, pluck="sales_invoice"),
+	"save_purchase": lambda: frappe.get_all("RRA Purchase Invoice Log", filters={"rra_pushed": 0, "needs_reconciliation": 0}, pluck="purchase_invoice"),
+	"push_item": lambda: frappe.get_all("Item", filters={"rra_pushed": 0}, pluck="name"),
+	"update_item_stock": lambda: frappe.get_all("RRA Stock IO Log", filters={"rra_pushed": 0, "needs_reconciliation": 0}, pluck="stock_ledger_entry"),
+}
+
+"""
+	RQ queue per action, and the standard queue used when that one is not configured in the bench's workers.
+"""
+push_queues = {
+	"save_sale": ("rra_sales", "short"),
+	"save_purchase": ("rra_purchases", "default"),
+	"push_item": ("rra_items", "default"),
+	"update_item_stock": ("rra_stock", "long"),
+}
+
 rra = RRAComplianceFactory()
 def hourly():
 	"""Push Unpushed Data to RRA"""
-	items = frappe.get_all("Item", filters={"rra_pushed": 0}, fields=["name"])
-	sales_invoices = frappe.get_all("RRA Sales Invoice Log", filters={"rra_pushed": 0}, fields=["sales_invoice"])
-	purchase_invoices = frappe.get_all("RRA Purchase Invoice Log", filters={"rra_pushed": 0}, fields=["purchase_invoice"])
-	stock_ios = frappe.get_all("RRA Stock IO Log", filters={"rra_pushed": 0}, fields=["stock_ledger_entry"])
-
-	for item in items:
-		try:
-			rra.push_item(item.name)
-		except Exception as e:
-			frappe.log_error(message=frappe.get_traceback(), title=f"RRA Compliance: Failed to push item {item.name}")
-
-	for invoice in sales_invoices:
-		try:
-			rra.save_sale(invoice.sales_invoice)
-		except Exception as e:
-			frappe.log_error(message=frappe.get_traceback(), title=f"RRA Compliance: Failed to push sales invoice {invoice.sales_invoice}")
-
-	for invoice in purchase_invoices:
-		try:
-			rra.save_purchase(invoice.purchase_invoice)
-		except Exception as e:
-			frappe.log_error(message=frappe.get_traceback(), title=f"RRA Compliance: Failed to push purchase invoice {invoice.purchase_invoice}")
-
-	for stock_io in stock_ios:
-		try:
-			rra.update_item_stock(stock_io.stock_ledger_entry)
-		except Exception as e:
-			frappe.log_error(message=frappe.get_traceback(), title=f"RRA Compliance: Failed to push stock ledger entry {stock_io.stock_ledger_entry}")
+	schedule_push()
+	checkpoint_sequences()
+
+def get_push_queue(action):
+	queue, fallback = push_queues[action]
+	return queue if queue in get_queues_timeout() else fallback
+
+def schedule_push(actions=None, chunk_size=None):
+	"""
+		Fan unpushed documents out to background workers, in chunks and in order of priority.
+		A leader lock is held from scheduling until the last chunk finishes, so runs never overlap.
+		:param actions: Subset of actions to run. Defaults to all of them.
+		:param chunk_size: Documents per job. Defaults to RRA Settings > Bulk Batch Size.
+		:return: Dict of chunks enqueued per action, or None if the previous run is still going
+	"""
+	lease = lock_manager.acquire(LEADER_LOCK, ttl=LEADER_TTL)
+	if lease is None:
+		return None
+
+	chunk_size = int(chunk_size or frappe.get_cached_doc("RRA Settings").get("bulk_batch_size") or DEFAULT_BATCH_SIZE)
+	chunks = []
+	for action, get_names in pending.items():
+		if actions and action not in actions:
+			continue
+
+		names = list(dict.fromkeys(get_names()))
+		chunks += [(action, names[start:start + chunk_size]) for start in range(0, len(names), chunk_size)]
+
+	if not chunks:
+		lease.release()
+		return {}
+
+	frappe.cache().set(get_run_key(lease.token), len(chunks), ex=LEADER_TTL)
+	for action, names in chunks:
+		frappe.enqueue(
+			"rra_compliance.tasks.push_chunk", queue=get_push_queue(action), timeout=1500,
+			at_front=action == "save_sale", action=action, names=names, leader_token=lease.token,
+		)
+
+	return { action: sum(1 for a, _ in chunks if a == action) for action in dict.fromkeys(a for a, _ in chunks) }
+
+def get_run_key(token):
+	return frappe.cache().make_key(f"{LEADER_LOCK}:{token}:pending")
+
+def push_chunk(action, names, leader_token=None):
+	"""
+		Push one chunk of documents scheduled by `schedule_push`.
+		The last chunk of a run releases the leader lock.
+	"""
+	try:
+		return RRABulkDispatcher(rra).run(action, names)
+	finally:
+		if leader_token is not None and frappe.cache().decr(get_run_key(leader_token)) <= 0:
+			frappe.cache().delete(get_run_key(leader_token))
+			Lease(lock_manager, LEADER_LOCK, leader_token, LEADER_TTL).release()
+
+def push_unpushed(max_in_flight=None, actions=None):
+	"""
+		Push every unpushed Sales Invoice, Purchase Invoice, Item and Stock Ledger Entry to RRA from this process.
+		:param max_in_flight: Maximum concurrent requests per TIN/branch. Defaults to RRA Settings.
+		:param actions: Subset of actions to run. Defaults to all of them.
+		:return: Dict of results per action
+	"""
+	dispatcher = RRABulkDispatcher(rra, max_in_flight=max_in_flight)
+	return {
+		action: dispatcher.run(action, get_names())
+		for action, get_names in pending.items() if not actions or action in actions
+	}
 
 def weekly():
-	"""Fetch RRA Reports"""
+	"""Fetch RRA master data changed since the last successful sync"""
 	rra.get_item_class(action="update")
 	rra.get_codes(action="update")
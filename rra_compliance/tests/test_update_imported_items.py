@@ -0,0 +1,57 @@
+# Copyright (c) 2026, Buffer Punk and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from rra_compliance.setup import RRAComplianceFactory
+
+
+class FakeDispatcher:
+	batch_size = 2
+	batches = None
+
+	def __init__(self, rra):
+		self.rra = rra
+
+	def send_all(self, action, payloads):
+		self.batches.append([payload["itemCd"] for payload in payloads])
+		return [{"resultCd": "000"} for _ in payloads]
+
+
+class TestUpdateImportedItems(FrappeTestCase):
+	def setUp(self):
+		FakeDispatcher.batches = []
+		self.rra = RRAComplianceFactory.__new__(RRAComplianceFactory)
+		self.rra.BASE_PAYLOAD = {"tin": "100000000", "bhfId": "00"}
+		self.rra.handle_response = lambda payload, response, **kwargs: response
+
+	def test_every_item_is_sent_across_batches(self):
+		items = [{"itemCd": f"ITEM-{i}", "taskCd": "T1", "dclDe": "20260101", "imptItemSttsCd": "3"} for i in range(5)]
+		attributes = { item["itemCd"]: frappe._dict(item_code=item["itemCd"], itemclscd="5059690800") for item in items }
+		progress = []
+		with (
+			patch("rra_compliance.setup.get_item_attributes", return_value=attributes),
+			patch("rra_compliance.setup.RRABulkDispatcher", FakeDispatcher),
+		):
+			results = self.rra.update_imported_items(items, progress=lambda done, total: progress.append((done, total)))
+
+		self.assertEqual(FakeDispatcher.batches, [["ITEM-0", "ITEM-1"], ["ITEM-2", "ITEM-3"], ["ITEM-4"]])
+		self.assertEqual(results["updated"], [item["itemCd"] for item in items])
+		self.assertEqual(results["failed"], [])
+		self.assertEqual(progress, [(2, 5), (4, 5), (5, 5)])
+
+	def test_missing_items_fail_without_being_sent(self):
+		items = [{"itemCd": "ITEM-0", "imptItemSttsCd": "3"}, {"itemCd": "MISSING", "imptItemSttsCd": "3"}]
+		attributes = {"ITEM-0": frappe._dict(item_code="ITEM-0", itemclscd="5059690800")}
+		with (
+			patch("rra_compliance.setup.get_item_attributes", return_value=attributes),
+			patch("rra_compliance.setup.RRABulkDispatcher", FakeDispatcher),
+		):
+			results = self.rra.update_imported_items(items)
+
+		self.assertEqual(FakeDispatcher.batches, [["ITEM-0"]])
+		self.assertEqual(results["updated"], ["ITEM-0"])
+		self.assertEqual(results["failed"], [{"itemCd": "MISSING", "reason": "Item not found"}])
@@ -0,0 +1,53 @@
+import frappe
+from frappe.utils import now
+
+
+def bulk_insert_docs(docs, ignore_duplicates=False, chunk_size=1000):
+	"""
+		Insert new documents, and their child rows, with one multi row INSERT per doctype.
+		Documents are named by their usual naming rules, but not validated and no controller hooks run,
+		so callers are responsible for passing complete documents and clearing whatever caches depend on them.
+		:param docs: Unsaved Documents, e.g. from `frappe.new_doc`
+		:param ignore_duplicates: Skip documents whose name already exists, or repeats one earlier in `docs`, instead of failing
+		:param chunk_size: Rows per INSERT
+		:return: Names of the documents inserted
+	"""
+	for doc in docs:
+		doc.set_new_name()
+
+	if ignore_duplicates:
+		seen = set()
+		for doctype in {doc.doctype for doc in docs}:
+			names = [doc.name for doc in docs if doc.doctype == doctype]
+			seen.update((doctype, name.casefold()) for name in frappe.get_all(doctype, filters={"name": ["in", names]}, pluck="name"))
+
+		unique = []
+		for doc in docs:
+			if (doc.doctype, doc.name.casefold()) not in seen:
+				seen.add((doc.doctype, doc.name.casefold()))
+				unique.append(doc)
+
+		docs = unique
+
+	timestamp, user = now(), frappe.session.user
+	rows = {}
+	for doc in docs:
+		doc.update({ "owner": user, "modified_by": user, "creation": timestamp, "modified": timestamp })
+		for child in doc.get_all_children():
+			child.update({
+				"parent": doc.name, "parenttype": doc.doctype, "docstatus": doc.docstatus,
+				"owner": user, "modified_by": user, "creation": timestamp, "modified": timestamp,
+			})
+			child.set_new_name()
+
+		for row in (doc, *doc.get_all_children()):
+			rows.setdefault(row.doctype, []).append(row.get_valid_dict(convert_dates_to_str=True, ignore_nulls=False))
+
+	for doctype, values in rows.items():
+		fields = list(values[0])
+		frappe.db.bulk_insert(
+			doctype, fields, [[value.get(field) for field in fields] for value in values],
+			ignore_duplicates=ignore_duplicates, chunk_size=chunk_size,
+		)
+
+	return [doc.name for doc in docs]
@@ -0,0 +1,72 @@
+import frappe
+
+CACHE_KEY = "rra_transaction_code_rows"
+VERSION_KEY = "rra_transaction_code_version"
+
+_local = {"version": None, "index": None}
+
+
+def normalize(value):
+	""" Codes were matched by the database with a case insensitive collation, keep it that way. """
+	return str(value).strip().casefold() if value is not None else None
+
+
+class CodeIndex:
+	"""
+		Bidirectional lookup of RRA Transaction Codes Items.
+		Keys are (code class name, code name) -> code and (code class name, code) -> code name,
+		where the code class name is the parent RRA Transaction Codes (e.g. "Packing Unit").
+	"""
+	def __init__(self, rows):
+		self.codes = {}
+		self.names = {}
+		for row in rows:
+			self.codes.setdefault((row["parent"], normalize(row["cdnm"])), row["cd"])
+			self.names.setdefault((row["parent"], normalize(row["cd"])), row["cdnm"])
+
+	def get_code(self, code_class, name):
+		""" Get the RRA code (cd) for a code name (cdnm). """
+		return self.codes.get((code_class, normalize(name)))
+
+	def get_name(self, code_class, code):
+		""" Get the code name (cdnm) for an RRA code (cd). """
+		return self.names.get((code_class, normalize(code)))
+
+
+def get_code_index() -> CodeIndex:
+	"""
+		Get the transaction code index.
+		It is built once per worker from rows kept in Redis, and rebuilt whenever the shared version changes.
+	"""
+	cache = frappe.cache()
+	version = cache.get_value(VERSION_KEY)
+	if version and _local["index"] is not None and _local["version"] == version:
+		return _local["index"]
+
+	rows = cache.get_value(CACHE_KEY)
+	if rows is None or not version:
+		rows = [dict(row) for row in frappe.db.get_all("RRA Transaction Codes Item", fields=["parent", "cd", "cdnm"], order_by="idx asc")]
+		version = version or frappe.generate_hash(length=10)
+		cache.set_value(CACHE_KEY, rows)
+		cache.set_value(VERSION_KEY, version)
+
+	_local.update({"version": version, "index": CodeIndex(rows)})
+	return _local["index"]
+
+
+def get_code(code_class, name):
+	""" Shortcut for `get_code_index().get_code()`. """
+	return get_code_index().get_code(code_class, name)
+
+
+def get_code_name(code_class, code):
+	""" Shortcut for `get_code_index().get_name()`. """
+	return get_code_index().get_name(code_class, code)
+
+
+def clear_code_index(doc=None, method=None):
+	""" Invalidate the index in every worker. Used as a doc event on RRA Transaction Codes. """
+	cache = frappe.cache()
+	cache.delete_value(CACHE_KEY)
+	cache.set_value(VERSION_KEY, frappe.generate_hash(length=10))
+	_local.update({"version": None, "index": None})
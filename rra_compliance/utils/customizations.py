@@ -41,6 +41,18 @@ def delete_all_fields():
 		frappe.clear_cache(doctype=doctype)
 	frappe.db.commit()
 
+"""
+	Indexes on standard fields the RRA integration looks records up by.
+"""
+indexes = {
+	"Supplier": [["tax_id"]],
+}
+
+def create_indexes():
+	for doctype, field_sets in indexes.items():
+		for fields in field_sets:
+			frappe.db.add_index(doctype, fields)
+
 def get_independent_custom_fields():
 	return {
 		"Company": [
@@ -382,6 +394,17 @@ def get_independent_custom_fields():
 				"insert_after": "due_date",
 				"display_depends_on": "eval: doc.tax_id ? true : false",
 				"description": _("Required if Customer has a Tax ID"),
+			},
+			{
+				"fieldname": "rra_status",
+				"label": _("RRA Status"),
+				"fieldtype": "Select",
+				"options": "\nPending\nSubmitted",
+				"insert_after": "purchase_code",
+				"read_only": 1,
+				"allow_on_submit": 1,
+				"no_copy": 1,
+				"in_standard_filter": 1,
 			}
 		]
 	}
@@ -0,0 +1,224 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import frappe
+
+from rra_compliance.utils.locks import lock_manager
+from rra_compliance.utils.sequence import InvoiceSequence, action_kinds, sequence_kinds
+from rra_compliance.utils.transport import is_ambiguous
+
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_BATCH_SIZE = 50
+
+"""
+	Actions whose payloads reference items by `itemCd`, and how to get (document, item) pairs for their documents.
+"""
+item_dependencies = {
+	"save_sale": lambda names: frappe.get_all(
+		"Sales Invoice Item", filters={"parenttype": "Sales Invoice", "parent": ["in", names]}, fields=["parent", "item_code"]
+	),
+	"save_purchase": lambda names: frappe.get_all(
+		"Purchase Invoice Item", filters={"parenttype": "Purchase Invoice", "parent": ["in", names]}, fields=["parent", "item_code"]
+	),
+	"update_item_stock": lambda names: frappe.get_all(
+		"Stock Ledger Entry", filters={"name": ["in", names]}, fields=["name as parent", "item_code"]
+	),
+}
+
+"""
+	Numbered actions -> field of their log linking it to the submitted document.
+"""
+log_links = {
+	"save_sale": "sales_invoice",
+	"save_purchase": "purchase_invoice",
+	"update_item_stock": "stock_ledger_entry",
+}
+
+
+class RRABulkDispatcher:
+	"""
+		Submit many documents to a VSDC endpoint with bounded concurrency.
+		Payloads are prepared and responses recorded on the calling thread, since frappe's database
+		connection is not shared between threads. Only the HTTP round trips run in the thread pool,
+		with at most `max_in_flight` requests open per TIN/branch.
+	"""
+	def __init__(self, rra, max_in_flight=None, batch_size=None):
+		settings = frappe.get_cached_doc("RRA Settings")
+		self.rra = rra
+		self.max_in_flight = int(max_in_flight or settings.get("max_in_flight") or DEFAULT_MAX_IN_FLIGHT)
+		self.batch_size = int(batch_size or settings.get("bulk_batch_size") or DEFAULT_BATCH_SIZE)
+		self._semaphores = {}
+		self._semaphores_lock = threading.Lock()
+
+	def get_semaphore(self, payload):
+		""" Get the in-flight limiter for the TIN/branch a payload belongs to. """
+		key = (payload.get("tin"), payload.get("bhfId"))
+		with self._semaphores_lock:
+			if key not in self._semaphores:
+				self._semaphores[key] = threading.BoundedSemaphore(self.max_in_flight)
+
+			return self._semaphores[key]
+
+	def send_all(self, action, payloads):
+		"""
+			Send payloads to an endpoint concurrently.
+			:param action: Key of the endpoint in the factory's endpoints
+			:param payloads: List of payloads
+			:return: List of requests.Response (or the exception raised) in the same order as the payloads
+		"""
+		if not payloads:
+			return []
+
+		transport = self.rra.transport
+		url = self.rra.get_url(action)
+
+		def send(payload):
+			with self.get_semaphore(payload):
+				try:
+					return transport.post(url, payload)
+				except Exception as e:
+					return e
+
+		branches = {(payload.get("tin"), payload.get("bhfId")) for payload in payloads}
+		workers = min(len(payloads), self.max_in_flight * len(branches))
+		with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rra-dispatch") as pool:
+			return list(pool.map(send, payloads))
+
+	def get_numbers(self, action, names):
+		"""
+			Reserve one number per document from the sequence of each document's company.
+			Numbered submissions need distinct numbers before any response comes back, so every company
+			in the batch takes a contiguous block in a single allocation.
+			:return: Dict of document name -> number
+		"""
+		source, _, _ = sequence_kinds[action_kinds[action]]
+		companies = dict(frappe.get_all(source, filters={"name": ["in", names]}, fields=["name", "company"], as_list=True))
+		numbers = {}
+		for company in set(companies.values()):
+			members = [name for name in names if companies.get(name) == company]
+			start = InvoiceSequence(company, action_kinds[action]).allocate(len(members))
+			numbers.update({ name: start + offset for offset, name in enumerate(members) })
+
+		return numbers
+
+	def get_unpushed_items(self, item_codes):
+		if not item_codes:
+			return set()
+
+		return set(frappe.get_all("Item", filters={"name": ["in", list(item_codes)], "rra_pushed": 0}, pluck="name"))
+
+	def resolve_dependencies(self, action, names):
+		"""
+			Push the unpushed items referenced by a batch, together and before the batch itself, and hold back
+			the documents whose items still could not be pushed instead of letting VSDC reject them.
+			:return: Tuple of (names ready to submit, dict of held back name -> its unpushed item codes)
+		"""
+		if action not in item_dependencies or not names:
+			return names, {}
+
+		lines = item_dependencies[action](names)
+		unpushed = self.get_unpushed_items({line.item_code for line in lines})
+		if unpushed:
+			self.run("push_item", sorted(unpushed))
+			unpushed = self.get_unpushed_items(unpushed)
+
+		held = {}
+		for line in lines:
+			if line.item_code in unpushed:
+				held.setdefault(line.parent, []).append(line.item_code)
+
+		return [name for name in names if name not in held], held
+
+	def get_pushed(self, action, names):
+		""" Documents of a numbered action that already have a submitted log pushed to VSDC. """
+		if action not in log_links or not names:
+			return set()
+
+		_, doctype, _ = sequence_kinds[action_kinds[action]]
+		return set(frappe.get_all(
+			doctype, filters={log_links[action]: ["in", names], "rra_pushed": 1, "docstatus": 1}, pluck=log_links[action]
+		))
+
+	def run(self, action, names, numbers=None, retried=(), heartbeat=None):
+		"""
+			Prepare, submit and record documents for an endpoint, one batch at a time.
+			:param action: One of the factory's `bulk_handlers`
+			:param names: Names of the documents to submit
+			:param numbers: Numbers already given to some of the documents, by name, used instead of new ones
+			:param retried: Names whose number was already sent without a definite answer. A `924` for one of them most
+				likely means that attempt was recorded, so it is held for reconciliation instead of being resynced.
+			:param heartbeat: Optional callable run after every batch, e.g. to renew the caller's leases
+			:return: Dict with the "submitted" (including the ones found already pushed), "failed", "skipped" (locked by
+				another process), "held" (waiting on items that could not be pushed) and "reconcile" (held for
+				reconciliation) document names, the failed ones that may have reached VSDC in "ambiguous", and the reason
+				for each failure or hold in "errors"
+		"""
+		prepare, apply = self.rra.bulk_handlers[action]
+		numbers, retried = numbers or {}, set(retried)
+		results = {"submitted": [], "failed": [], "skipped": [], "held": [], "reconcile": [], "ambiguous": [], "errors": {}}
+		for start in range(0, len(names), self.batch_size):
+			batch = []
+			chunk = []
+			leases = {}
+			ready, held = self.resolve_dependencies(action, list(dict.fromkeys(names[start:start + self.batch_size])))
+			for name, item_codes in held.items():
+				results["held"].append(name)
+				results["errors"][name] = f"Waiting for items to be pushed to RRA: {', '.join(item_codes)}"
+
+			for name in ready:
+				# Documents being submitted by another process right now are left for the next run
+				lease = lock_manager.acquire(f"{action}:{name}")
+				if lease is None:
+					results["skipped"].append(name)
+					continue
+
+				leases[name] = lease
+				chunk.append(name)
+
+			try:
+				# Checked under the document locks, so a document pushed by an earlier or concurrent attempt is never
+				# prepared again, which would cancel its log or submit it twice
+				pushed = self.get_pushed(action, chunk)
+				results["submitted"] += [name for name in chunk if name in pushed]
+				chunk = [name for name in chunk if name not in pushed]
+
+				fresh = [name for name in chunk if name not in numbers]
+				chunk_numbers = self.get_numbers(action, fresh) if action in action_kinds and fresh else {}
+				chunk_numbers.update({ name: numbers[name] for name in chunk if name in numbers })
+				for name in chunk:
+					try:
+						payload, context = prepare(name, chunk_numbers[name]) if name in chunk_numbers else prepare(name)
+						batch.append((name, payload, context))
+					except Exception:
+						results["errors"][name] = frappe.get_traceback()
+						frappe.log_error(message=results["errors"][name], title=f"RRA Compliance: Failed to prepare {action.replace('_', ' ')} for {name}")
+						results["failed"].append(name)
+
+				responses = self.send_all(action, [payload for _, payload, _ in batch])
+				for (name, payload, context), response in zip(batch, responses, strict=True):
+					try:
+						leases[name].check()
+						res = self.rra.handle_response(payload, response, print_if='fail', print_to='frappe')
+						if name in retried and res.get("resultCd") == "924":
+							self.rra.hold_for_reconciliation(context, res)
+							results["reconcile"].append(name)
+							results["errors"][name] = "VSDC answered 924 to a retry of a number already sent. Reconcile the log with VSDC."
+						else:
+							apply(context, res)
+							results["submitted"].append(name)
+					except Exception:
+						results["errors"][name] = frappe.get_traceback()
+						frappe.log_error(message=results["errors"][name], title=f"RRA Compliance: Failed to {action.replace('_', ' ')} {name}")
+						results["failed"].append(name)
+						if is_ambiguous(response):
+							results["ambiguous"].append(name)
+
+				frappe.db.commit()
+			finally:
+				for lease in leases.values():
+					lease.release()
+
+			if heartbeat:
+				heartbeat()
+
+		return results
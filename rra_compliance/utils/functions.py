@@ -1,8 +1,10 @@
 import base64
 import hashlib
 import re
+from functools import lru_cache
 
 
+@lru_cache(maxsize=1024)
 def shorten_string(input_string, length=20):
 	"""Shortens a string to the specified length."""
 	sha = hashlib.sha256(input_string.encode()).digest()
@@ -0,0 +1,91 @@
+import frappe
+from frappe.utils import cint, now
+from frappe.utils.nestedset import get_root_of, rebuild_tree
+
+"""
+	Item Group fields kept in sync with VSDC item classes.
+"""
+tracked_fields = ("itemclscd", "itemclslvl", "taxtycd", "mjrtgyn", "useyn")
+
+
+def get_group_values(item) -> dict:
+	""" Item Group values of a VSDC item class. """
+	return {
+		"item_group_name": item.get("itemClsNm").strip(),
+		"itemclscd": item.get("itemClsCd"),
+		"itemclslvl": cint(item.get("itemClsLvl")),
+		"taxtycd": item.get("taxTyCd"),
+		"mjrtgyn": 1 if item.get("mjrTgYn") == "Y" else 0,
+		"useyn": 1 if item.get("useYn") == "Y" else 0,
+	}
+
+
+def diff_item_groups(records, full=False):
+	"""
+		Compare VSDC item classes with the existing Item Groups, matched on item class code, or on name for groups
+		created before they had one.
+		:param records: VSDC `itemClsList`
+		:param full: Whether `records` is the whole catalogue, in which case coded groups missing from it are disabled
+		:return: (values to insert, {name: changed values} to update, names to disable)
+	"""
+	existing = frappe.get_all("Item Group", fields=["name", *tracked_fields])
+	by_code = { group.itemclscd: group for group in existing if group.itemclscd }
+	by_name = { group.name.casefold(): group for group in existing }
+
+	to_insert, to_update, seen = [], {}, set()
+	for item in records:
+		values = get_group_values(item)
+		if not values["item_group_name"] or values["itemclscd"] in seen:
+			continue
+
+		seen.add(values["itemclscd"])
+		group = by_code.get(values["itemclscd"]) or by_name.get(values["item_group_name"].casefold())
+		if group is None:
+			to_insert.append(values)
+			# Names are unique, a second class with the same name updates the group inserted for the first one
+			by_name[values["item_group_name"].casefold()] = frappe._dict(name=values["item_group_name"], **values)
+			continue
+
+		changes = { field: values[field] for field in tracked_fields if group.get(field) != values[field] }
+		if changes:
+			to_update[group.name] = changes
+
+	to_disable = [
+		group.name for code, group in by_code.items()
+		if full and code not in seen and group.useyn and group.name not in to_update
+	]
+	return to_insert, to_update, to_disable
+
+
+def sync_item_groups(records, full=False) -> dict:
+	"""
+		Insert, update and disable Item Groups so they match the VSDC item classes, in one transaction.
+		New groups are bulk inserted under the root group with their nested set bounds left unset, and the tree is
+		rebuilt once at the end instead of once per group.
+		:param records: VSDC `itemClsList`
+		:param full: Whether `records` is the whole catalogue
+		:return: Dict of group names per outcome: inserted, updated, disabled
+	"""
+	to_insert, to_update, to_disable = diff_item_groups(records, full=full)
+	if to_insert:
+		parent, timestamp, user = get_root_of("Item Group"), now(), frappe.session.user
+		fields = ["name", "owner", "creation", "modified", "modified_by", "docstatus", "idx", "parent_item_group", "is_group", "lft", "rgt", "item_group_name", *tracked_fields]
+		frappe.db.bulk_insert("Item Group", fields, [
+			(values["item_group_name"], user, timestamp, timestamp, user, 0, 0, parent, 0, 0, 0, values["item_group_name"], *(values[field] for field in tracked_fields))
+			for values in to_insert
+		])
+
+	for name, changes in to_update.items():
+		frappe.db.set_value("Item Group", name, changes)
+
+	if to_disable:
+		frappe.db.set_value("Item Group", {"name": ["in", to_disable]}, "useyn", 0)
+
+	if to_insert:
+		rebuild_tree("Item Group")
+
+	return {
+		"inserted": [values["item_group_name"] for values in to_insert],
+		"updated": list(to_update),
+		"disabled": to_disable,
+	}
@@ -0,0 +1,128 @@
+import hashlib
+import json
+
+import frappe
+
+from rra_compliance.utils.codes import get_code_index
+from rra_compliance.utils.prefetch import get_item_attributes
+
+CHUNK_SIZE = 500
+CURSOR_KEY = "rra_item_sync_cursor"
+CURSOR_TTL = 24 * 60 * 60
+
+"""
+	Item fields kept in sync with VSDC items.
+"""
+tracked_fields = ["item_name", "item_group", "item_type", "origin_country", "stock_uom", "package_unit", "tax_type", "rra_pushed", "disabled"]
+
+
+def get_item_groups() -> dict:
+	""" Item class code -> Item Group, loaded once per sync. """
+	return {
+		group.itemclscd: group.name
+		for group in frappe.get_all("Item Group", filters={"itemclscd": ["is", "set"]}, fields=["name", "itemclscd"])
+	}
+
+
+def get_item_values(item, groups, codes) -> dict:
+	"""
+		Item values of a VSDC item. Codes are translated to the names the Item fields hold, and kept as they are
+		when the code is unknown.
+		:param item: VSDC `itemList` row
+		:param groups: Dict from `get_item_groups`
+		:param codes: Transaction code index
+	"""
+	return {
+		"item_name": item.get("itemNm").strip(),
+		"item_group": groups.get(item.get("itemClsCd")),
+		"item_type": codes.get_name("Item Type", item.get("itemTyCd")) or item.get("itemTyCd"),
+		"origin_country": codes.get_name("Cuntry", item.get("orgnNatCd")) or item.get("orgnNatCd"),
+		"stock_uom": f"{codes.get_name('Quantity Unit', item.get('qtyUnitCd')) or item.get('qtyUnitCd')} - QU",
+		"package_unit": f"{codes.get_name('Packing Unit', item.get('pkgUnitCd')) or item.get('pkgUnitCd')} - PU",
+		"tax_type": codes.get_name("Taxation Type", item.get("taxTyCd")) or item.get("taxTyCd"),
+		"rra_pushed": 1,
+		"disabled": 0 if item.get("useYn") == "Y" else 1,
+	}
+
+
+def get_items_with_stock(item_codes) -> set:
+	""" Items with stock ledger entries, whose stock UOM ERPNext no longer lets change. """
+	if not item_codes:
+		return set()
+
+	return set(frappe.get_all(
+		"Stock Ledger Entry", filters={"item_code": ["in", item_codes], "is_cancelled": 0}, pluck="item_code", distinct=True
+	))
+
+
+def get_hash(values) -> str:
+	""" Digest of the tracked fields of an item, to tell whether it changed without comparing field by field. """
+	return hashlib.md5(json.dumps([str(values.get(field) or "") for field in tracked_fields]).encode()).hexdigest()
+
+
+def get_cursor_key(records) -> str:
+	""" Cache key of the progress of a sync of exactly these records, so a retry of the same response resumes. """
+	digest = hashlib.md5("\n".join(item.get("itemCd") or "" for item in records).encode()).hexdigest()
+	return frappe.cache().make_key(f"{CURSOR_KEY}:{digest}")
+
+
+def sync_items(records, chunk_size=CHUNK_SIZE, progress=None) -> dict:
+	"""
+		Create or update Items from VSDC items, chunk by chunk.
+		Lookups come from maps loaded once, existing items of a chunk are loaded in one query, and items whose
+		tracked fields hash the same as the incoming values are skipped. The stock UOM of items that have stock
+		transactions is left as it is, since ERPNext refuses to change it. Every chunk is committed on its own and,
+		as long as no item failed, recorded in the cache, so when a sync of the same response is interrupted the
+		retry starts after the last committed chunk.
+		:param records: VSDC `itemList`
+		:param chunk_size: Items per chunk and commit
+		:param progress: Optional callable of (count, message) called as items are processed
+		:return: Dict of item codes per outcome: created, updated, unchanged, failed (code -> error)
+	"""
+	records = sorted((item for item in records if item.get("itemCd")), key=lambda item: item.get("itemCd"))
+	cache = frappe.cache()
+	cursor_key = get_cursor_key(records)
+	start = int(cache.get(cursor_key) or 0)
+	if progress and start:
+		progress(start, f"Resuming after {start} items")
+
+	groups, codes = get_item_groups(), get_code_index()
+	results = {"created": [], "updated": [], "unchanged": [], "failed": {}}
+	# Failed items must be retried, so progress is only recorded up to the first chunk with a failure
+	resumable = True
+	for offset in range(start, len(records), chunk_size):
+		chunk = records[offset:offset + chunk_size]
+		existing = get_item_attributes([item.get("itemCd") for item in chunk], fields=tracked_fields)
+		with_stock = get_items_with_stock(list(existing))
+		for item in chunk:
+			code = item.get("itemCd")
+			values = get_item_values(item, groups, codes)
+			current = existing.get(code)
+			if current and code in with_stock:
+				values["stock_uom"] = current.stock_uom
+			if current and get_hash(current) == get_hash(values):
+				results["unchanged"].append(code)
+				continue
+
+			frappe.db.savepoint("rra_item_sync")
+			try:
+				if current:
+					frappe.get_doc("Item", code).update(values).save(ignore_permissions=True)
+					results["updated"].append(code)
+				else:
+					frappe.get_doc({"doctype": "Item", "item_code": code, **values}).insert(ignore_permissions=True)
+					results["created"].append(code)
+			except Exception as e:
+				frappe.db.rollback(save_point="rra_item_sync")
+				results["failed"][code] = str(e)
+
+		frappe.db.commit()
+		resumable = resumable and not results["failed"]
+		if resumable:
+			cache.set(cursor_key, offset + len(chunk), ex=CURSOR_TTL)
+
+		if progress:
+			progress(len(chunk), f"Synced {offset + len(chunk)} of {len(records)} items")
+
+	cache.delete(cursor_key)
+	return results
@@ -0,0 +1,150 @@
+import time
+from contextlib import contextmanager
+
+import frappe
+
+DEFAULT_LOCK_TTL = 120
+KEY_PREFIX = "rra_lock"
+TOKEN_KEY = "rra_lock_fencing_token"
+METRICS_KEY = "rra_lock_metrics"
+METRICS = ("acquired", "contended", "timed_out", "wait_ms", "renewed", "lost")
+
+"""
+	Compare and delete / compare and extend, so a lease is only ever released or renewed by its holder.
+"""
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+	return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+	return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class LockError(frappe.ValidationError):
+	""" Raised when a resource is held by another process. """
+
+
+class LeaseLost(frappe.ValidationError):
+	""" Raised when a lease expired and may have been taken over before its work was recorded. """
+
+
+class Lease:
+	"""
+		A TTL bound lock on one resource.
+		`token` is a fencing token: it increases with every lease granted on the site, so a holder that
+		stalled past its TTL can tell, through `check`, that a newer holder may exist.
+	"""
+	def __init__(self, manager, resource, token, ttl):
+		self.manager = manager
+		self.resource = resource
+		self.token = token
+		self.ttl = ttl
+		self.key = manager.get_key(resource)
+		self.value = str(token)
+		self.acquired_at = time.monotonic()
+
+	def is_held(self) -> bool:
+		return frappe.cache().get(self.key) == self.value.encode()
+
+	def check(self):
+		""" Make sure the lease is still held before recording the result of the work it guards. """
+		if not self.is_held():
+			self.manager.count("lost")
+			raise LeaseLost(f"Lock on {self.resource} expired before its work completed (token {self.token}).")
+
+	def renew(self, ttl=None) -> bool:
+		""" Extend the lease. :return: False if it was already lost. """
+		self.ttl = ttl or self.ttl
+		renewed = bool(frappe.cache().eval(RENEW_SCRIPT, 1, self.key, self.value, int(self.ttl * 1000)))
+		self.manager.count("renewed" if renewed else "lost")
+		return renewed
+
+	def release(self) -> bool:
+		""" Release the lease. :return: False if it had expired or been taken over in the meantime. """
+		released = bool(frappe.cache().eval(RELEASE_SCRIPT, 1, self.key, self.value))
+		if not released:
+			self.manager.count("lost")
+
+		return released
+
+
+class LockManager:
+	"""
+		Per resource locks kept in Redis, e.g. one per document being submitted to VSDC, so unrelated
+		submissions never wait on each other. Locks are leases: they expire after their TTL even if the
+		holder crashes, and long running holders renew them.
+		Acquisitions, contention, waits and lost leases are counted under `rra_lock_metrics` in the cache.
+	"""
+	def __init__(self, ttl=None):
+		self.ttl = ttl
+
+	def get_ttl(self):
+		return self.ttl or int(frappe.get_cached_doc("RRA Settings").get("lock_ttl") or DEFAULT_LOCK_TTL)
+
+	def get_key(self, resource):
+		return frappe.cache().make_key(f"{KEY_PREFIX}:{resource}")
+
+	def count(self, metric, amount=1):
+		frappe.cache().incrby(frappe.cache().make_key(f"{METRICS_KEY}:{metric}"), amount)
+
+	def acquire(self, resource, ttl=None, wait=0, poll_interval=0.1):
+		"""
+			Try to take the lock on a resource.
+			:param resource: Resource name, e.g. "save_sale:ACC-SINV-2025-00001"
+			:param ttl: Lease duration in seconds. Defaults to RRA Settings.
+			:param wait: Seconds to keep trying while the resource is held
+			:return: Lease, or None if the resource stayed held
+		"""
+		cache = frappe.cache()
+		ttl = ttl or self.get_ttl()
+		key = self.get_key(resource)
+		token = cache.incr(cache.make_key(TOKEN_KEY))
+		started = time.monotonic()
+		contended = False
+		while True:
+			if cache.set(key, str(token), nx=True, px=int(ttl * 1000)):
+				self.count("acquired")
+				if contended:
+					self.count("wait_ms", int((time.monotonic() - started) * 1000))
+				return Lease(self, resource, token, ttl)
+
+			if not contended:
+				contended = True
+				self.count("contended")
+
+			if time.monotonic() - started >= wait:
+				self.count("timed_out")
+				return None
+
+			time.sleep(poll_interval)
+
+	@contextmanager
+	def lock(self, resource, ttl=None, wait=0):
+		"""
+			Hold the lock on a resource for the duration of a block.
+			:raises LockError: If the resource stayed held by another process
+		"""
+		lease = self.acquire(resource, ttl=ttl, wait=wait)
+		if lease is None:
+			raise LockError(f"{resource} is already being processed. Please wait a moment and try again.")
+
+		try:
+			yield lease
+		finally:
+			lease.release()
+
+	def get_metrics(self) -> dict:
+		""" Counters since the cache was last cleared. """
+		cache = frappe.cache()
+		values = cache.mget([cache.make_key(f"{METRICS_KEY}:{metric}") for metric in METRICS])
+		return { metric: int(value or 0) for metric, value in zip(METRICS, values, strict=True) }
+
+
+lock_manager = LockManager()
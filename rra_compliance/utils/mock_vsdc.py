@@ -0,0 +1,294 @@
+import json
+import random
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+	Local stand-in for the RRA VSDC, for load and integration testing without hitting RRA.
+	Only the standard library is used so it can run on any lab machine:
+
+		bench rra-mock-vsdc --port 8085 --latency 120 --jitter 40 --error-rate 0.02 --duplicate-rate 0.01
+
+	Then point RRA Settings > Base URL to http://127.0.0.1:8085.
+	Submissions are remembered per TIN/branch, so re-using an invoice number gets a real `924`.
+	GET /__stats__ returns request counters and POST /__reset__ clears all state.
+"""
+
+SUCCESS = "000"
+NO_DATA = "001"
+DUPLICATE = "924"
+
+codes = [
+	("04", "Taxation Type", [("A", "A-EX"), ("B", "B-18.00%"), ("C", "C"), ("D", "D")]),
+	("07", "Payment Type", [("01", "CASH"), ("02", "CREDIT"), ("03", "CASH/CREDIT"), ("04", "BANK CHECK"), ("05", "DEBIT&CREDIT CARD"), ("06", "MOBILE MONEY"), ("07", "OTHER")]),
+	("10", "Quantity Unit", [("U", "Pieces/item [Number]"), ("KG", "Kilo-Gramme"), ("L", "Litre")]),
+	("17", "Packing Unit", [("NT", "Net"), ("BX", "Box"), ("BG", "Bag")]),
+	("24", "Item Type", [("1", "Raw Material"), ("2", "Finished Product"), ("3", "Service")]),
+	("05", "Cuntry", [("RW", "RWANDA"), ("KE", "KENYA"), ("UG", "UGANDA")]),
+	("14", "Sales Receipt Type", [("S", "Sale"), ("R", "Refund after Sale")]),
+	("38", "Purchase Receipt Type", [("P", "Purchase"), ("R", "Refund after Purchase")]),
+]
+
+item_classes = [
+	("5020230500", "Beverages", 1, "B"),
+	("5020230501", "Soft drinks", 2, "B"),
+	("5010150000", "Fresh vegetables", 1, "A"),
+]
+
+"""
+	Submissions keyed by the field VSDC treats as unique for the endpoint.
+"""
+numbered_paths = {
+	"/trnsSales/saveSales": "invcNo",
+	"/trnsPurchase/savePurchases": "invcNo",
+	"/stock/saveStockItems": "sarNo",
+}
+
+
+class MockVSDCState:
+	def __init__(self, latency=0, jitter=0, error_rate=0.0, duplicate_rate=0.0, error_status=503, seed=None):
+		self.latency = latency
+		self.jitter = jitter
+		self.error_rate = error_rate
+		self.duplicate_rate = duplicate_rate
+		self.error_status = error_status
+		self.random = random.Random(seed)
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		with self.lock:
+			self.seen = {}
+			self.items = {}
+			self.receipts = {}
+			self.stats = {"requests": 0, "errors": 0, "duplicates": 0, "injected_duplicates": 0, "by_path": {}}
+
+	def sleep(self):
+		delay = self.latency + (self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+		if delay > 0:
+			time.sleep(delay / 1000)
+
+	def count(self, key, path=None):
+		with self.lock:
+			self.stats[key] += 1
+			if path:
+				self.stats["by_path"][path] = self.stats["by_path"].get(path, 0) + 1
+
+	def roll(self, rate):
+		with self.lock:
+			return rate > 0 and self.random.random() < rate
+
+	def register(self, path, payload):
+		"""
+			Remember a numbered submission.
+			:return: False if the number was already used for this TIN/branch
+		"""
+		key = (path, payload.get("tin"), payload.get("bhfId"), str(payload.get(numbered_paths[path])))
+		with self.lock:
+			if key in self.seen:
+				return False
+
+			self.seen[key] = payload
+			return True
+
+	def next_receipt(self, payload):
+		key = (payload.get("tin"), payload.get("bhfId"))
+		with self.lock:
+			self.receipts[key] = self.receipts.get(key, 0) + 1
+			return self.receipts[key]
+
+
+def result(code=SUCCESS, data=None, message=None):
+	return {
+		"resultCd": code,
+		"resultMsg": message or {SUCCESS: "It is succeeded", NO_DATA: "There is no search result", DUPLICATE: "Invoice number already exists."}.get(code, "Error"),
+		"resultDt": datetime.now().strftime("%Y%m%d%H%M%S"),
+		"data": data,
+	}
+
+
+def init_info(state, payload):
+	return result(data={"info": {
+		"tin": payload.get("tin"), "taxprNm": "MOCK TAXPAYER", "bsnsActv": "Retail", "bhfId": payload.get("bhfId"),
+		"bhfNm": "Headquarter", "bhfOpenDt": "20200101", "prvncNm": "KIGALI CITY", "dstrtNm": "NYARUGENGE",
+		"sctrNm": "NYARUGENGE", "locDesc": "Mock location", "hqYn": "Y", "mgrNm": "Mock Manager",
+		"mgrTelNo": "0780000000", "mgrEmail": "manager@example.com", "sdcId": "SDC010000001",
+		"mrcNo": "WIS00000001", "dvcId": "0000000001", "intrlKey": "MOCKINTRLKEY", "signKey": "MOCKSIGNKEY", "cmcKey": "MOCKCMCKEY",
+	}})
+
+
+def select_codes(state, payload):
+	return result(data={"clsList": [
+		{
+			"cdCls": cls, "cdClsNm": name, "cdClsDesc": None, "useYn": "Y",
+			"userDfnNm1": None, "userDfnNm2": None, "userDfnNm3": None,
+			"dtlList": [
+				{"cd": cd, "cdNm": nm, "cdDesc": nm, "useYn": "Y", "srtOrd": idx, "userDfn1": None, "userDfn2": None, "userDfn3": None}
+				for idx, (cd, nm) in enumerate(details, start=1)
+			],
+		} for cls, name, details in codes
+	]})
+
+
+def select_item_classes(state, payload):
+	return result(data={"itemClsList": [
+		{"itemClsCd": cd, "itemClsNm": name, "itemClsLvl": lvl, "taxTyCd": tax, "mjrTgYn": "N", "useYn": "Y"}
+		for cd, name, lvl, tax in item_classes
+	]})
+
+
+def select_items(state, payload):
+	with state.lock:
+		items = [item for (tin, _), item in state.items.items() if tin == payload.get("tin")]
+
+	return result(data={"itemList": items}) if items else result(NO_DATA)
+
+
+def save_item(state, payload):
+	with state.lock:
+		state.items[(payload.get("tin"), payload.get("itemCd"))] = payload
+
+	return result()
+
+
+def save_numbered(path):
+	def handler(state, payload):
+		if not state.register(path, payload):
+			state.count("duplicates")
+			return result(DUPLICATE)
+
+		if path != "/trnsSales/saveSales":
+			return result()
+
+		rcpt_no = state.next_receipt(payload)
+		return result(data={
+			"rcptNo": rcpt_no,
+			"totRcptNo": rcpt_no,
+			"intrlData": f"MOCK{rcpt_no:022d}",
+			"rcptSign": f"MOCKSIGN{rcpt_no:08d}",
+			"vsdcRcptPbctDate": datetime.now().strftime("%Y%m%d%H%M%S"),
+			"sdcId": "SDC010000001",
+			"mrcNo": "WIS00000001",
+		})
+
+	return handler
+
+
+def empty_list(key):
+	return lambda state, payload: result(data={key: []})
+
+
+def ok(state, payload):
+	return result()
+
+
+routes = {
+	"/initializer/selectInitInfo": init_info,
+	"/code/selectCodes": select_codes,
+	"/itemClass/selectItemsClass": select_item_classes,
+	"/customers/selectCustomer": lambda state, payload: result(data={"custList": [
+		{"tin": payload.get("custmTin"), "taxprNm": f"CUSTOMER {payload.get('custmTin')}", "taxprSttsCd": "A"}
+	]}),
+	"/branches/selectBranches": lambda state, payload: result(data={"bhfList": [
+		{"tin": payload.get("tin"), "bhfId": "00", "bhfNm": "Headquarter", "brnchNm": "Headquarter", "bhfSttsCd": "01", "prvncNm": "KIGALI CITY",
+		"dstrtNm": "NYARUGENGE", "sctrNm": "NYARUGENGE", "locDesc": "Mock location", "mgrNm": "Mock Manager",
+		"mgrTelNo": "0780000000", "mgrEmail": "manager@example.com", "hqYn": "Y"}
+	]}),
+	"/notices/selectNotices": empty_list("noticeList"),
+	"/branches/saveBrancheCustomers": ok,
+	"/branches/saveBrancheUsers": ok,
+	"/branches/saveBrancheInsurances": ok,
+	"/items/selectItems": select_items,
+	"/items/saveItems": save_item,
+	"/items/saveItemComposition": ok,
+	"/imports/selectImportItems": empty_list("itemList"),
+	"/imports/updateImportItems": ok,
+	"/trnsSales/saveSales": save_numbered("/trnsSales/saveSales"),
+	"/trnsPurchase/selectTrnsPurchaseSales": empty_list("saleList"),
+	"/trnsPurchase/savePurchases": save_numbered("/trnsPurchase/savePurchases"),
+	"/stock/selectStockItems": empty_list("stockList"),
+	"/stock/saveStockItems": save_numbered("/stock/saveStockItems"),
+	"/stockMaster/saveStockMaster": ok,
+}
+
+
+class MockVSDCHandler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+	state: MockVSDCState = None
+	quiet = True
+
+	def send_json(self, status, body):
+		content = json.dumps(body).encode()
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(content)))
+		self.end_headers()
+		self.wfile.write(content)
+
+	def do_GET(self):
+		if self.path == "/__stats__":
+			with self.state.lock:
+				return self.send_json(200, self.state.stats)
+
+		self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+	def do_POST(self):
+		length = int(self.headers.get("Content-Length") or 0)
+		body = self.rfile.read(length) if length else b""
+		path = self.path.rstrip("/")
+		if path == "/__reset__":
+			self.state.reset()
+			return self.send_json(200, {"reset": True})
+
+		handler = routes.get(path)
+		if handler is None:
+			return self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+		self.state.count("requests", path)
+		self.state.sleep()
+		try:
+			payload = json.loads(body or b"{}")
+		except ValueError:
+			return self.send_json(400, {"error": "Invalid JSON"})
+
+		if self.state.roll(self.state.error_rate):
+			self.state.count("errors")
+			return self.send_json(self.state.error_status, {"error": "Injected failure"})
+
+		if path in numbered_paths and self.state.roll(self.state.duplicate_rate):
+			self.state.count("injected_duplicates")
+			return self.send_json(200, result(DUPLICATE))
+
+		self.send_json(200, handler(self.state, payload))
+
+	def log_message(self, format, *args):
+		if not self.quiet:
+			super().log_message(format, *args)
+
+
+def make_server(host="127.0.0.1", port=8085, quiet=True, **options) -> ThreadingHTTPServer:
+	"""
+		Build a mock VSDC server without starting it.
+		:param options: Passed to MockVSDCState: latency and jitter (ms), error_rate, duplicate_rate, error_status, seed
+		:return: ThreadingHTTPServer. Its state is available as `server.state`.
+	"""
+	state = MockVSDCState(**options)
+	handler = type("BoundMockVSDCHandler", (MockVSDCHandler,), {"state": state, "quiet": quiet})
+	server = ThreadingHTTPServer((host, port), handler)
+	server.daemon_threads = True
+	server.state = state
+	return server
+
+
+def serve(host="127.0.0.1", port=8085, quiet=True, **options):
+	""" Run a mock VSDC server until interrupted. """
+	server = make_server(host, port, quiet=quiet, **options)
+	print(f"Mock VSDC listening on http://{host}:{server.server_port}")
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
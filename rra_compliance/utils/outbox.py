@@ -0,0 +1,258 @@
+from datetime import timedelta
+
+import frappe
+import requests
+from frappe.utils import add_to_date, now_datetime
+
+from rra_compliance.utils.locks import lock_manager
+from rra_compliance.utils.sequence import action_kinds, sequence_kinds
+from rra_compliance.utils.transport import get_deadline, is_ambiguous
+
+OUTBOX_DOCTYPE = "RRA Outbox"
+DRAIN_LOCK = "rra_outbox_drain"
+MAX_ATTEMPTS = 8
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 3600
+DRAIN_LIMIT = 500
+DEFAULT_LATENCY_BUDGET = 3.0
+
+"""
+	Actions that can be attempted inline in Hybrid submission mode.
+"""
+hybrid_actions = {"save_sale"}
+
+"""
+	Submissions are recorded in RRA Outbox in the same transaction as the document that triggers them,
+	and sent to VSDC by a background job once that transaction is committed. A submit waits on VSDC at most
+	for the Hybrid mode latency budget, and a submission is never lost or sent for a document that was rolled back.
+"""
+
+
+def enqueue_submission(action, doc, number=None):
+	"""
+		Record a pending VSDC submission for a document and drain the outbox after commit.
+		:param action: One of the factory's `bulk_handlers`
+		:param doc: Document to submit
+		:param number: Number an attempt went out with without a definite answer, to be reused by the retries.
+			Only for attempts that may have reached VSDC: a `924` on it is then held for reconciliation.
+		:return: Name of the RRA Outbox entry
+	"""
+	name = frappe.db.get_value(OUTBOX_DOCTYPE, {
+		"action": action, "reference_name": doc.name, "status": ["in", ["Queued", "Processing"]]
+	})
+	if not name:
+		name = frappe.get_doc({
+			"doctype": OUTBOX_DOCTYPE,
+			"action": action,
+			"reference_doctype": doc.doctype,
+			"reference_name": doc.name,
+			"company": doc.get("company"),
+			"status": "Queued",
+			"next_retry_at": now_datetime(),
+			"allocated_number": number,
+			"number_sent": 1 if number else 0,
+		}).insert(ignore_permissions=True).name
+	elif number:
+		frappe.db.set_value(OUTBOX_DOCTYPE, name, {"allocated_number": number, "number_sent": 1})
+
+	if doc.meta.has_field("rra_status"):
+		doc.db_set("rra_status", "Pending", update_modified=False)
+
+	frappe.enqueue(drain, queue="short", enqueue_after_commit=True, job_id=DRAIN_LOCK, deduplicate=True)
+	return name
+
+
+def submit(action, doc):
+	"""
+		Submit a document to VSDC according to RRA Settings > Sales Submission Mode.
+		In Hybrid mode the submission is attempted inline, bounded by the latency budget, and handed to the outbox
+		if VSDC is unreachable, too slow or answers with a transient error. Otherwise it always goes to the outbox.
+		When the attempt may have reached VSDC, the outbox retries it with the same number.
+		:param action: One of the factory's `bulk_handlers`
+		:param doc: Document being submitted
+	"""
+	settings = frappe.get_cached_doc("RRA Settings")
+	if action not in hybrid_actions or settings.get("submission_mode") != "Hybrid":
+		return enqueue_submission(action, doc)
+
+	from rra_compliance.setup import RRAComplianceFactory
+
+	rra = RRAComplianceFactory()
+	prepare, apply = rra.bulk_handlers[action]
+	deadline = get_deadline(settings.get("latency_budget") or DEFAULT_LATENCY_BUDGET)
+	with lock_manager.lock(f"{action}:{doc.name}"):
+		payload, log = prepare(doc.name)
+		try:
+			response = rra.transport.post(rra.get_url(action), payload, deadline=deadline)
+		except (requests.Timeout, requests.ConnectionError) as e:
+			response = e
+
+		if isinstance(response, Exception) or rra.transport.retry_policy.is_failure(response):
+			if not is_ambiguous(response):
+				# Refused before anything was sent (deadline, rate limit, open circuit) or answered definitely
+				return enqueue_submission(action, doc)
+
+			return enqueue_submission(action, doc, number=log.get(sequence_kinds[action_kinds[action]][2]))
+
+		apply(log, rra.handle_response(payload, response, print_if='fail', print_to='frappe'))
+
+
+def get_retry_delay(attempts):
+	""" Seconds to wait before the next attempt, doubling per attempt. """
+	return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** max(0, attempts - 1)))
+
+
+def get_due_entries(limit=DRAIN_LIMIT):
+	"""
+		Entries ready to be sent: queued ones whose retry time has come, and ones whose drain stopped renewing its
+		claim on them (see `claim`).
+	"""
+	return frappe.get_all(
+		OUTBOX_DOCTYPE,
+		filters={"status": ["in", ["Queued", "Processing"]], "next_retry_at": ["<=", now_datetime()]},
+		pluck="name",
+		order_by="creation asc",
+		limit=limit,
+	)
+
+
+def claim(names, token):
+	"""
+		Claim due entries for one drain, in a single conditional update, so an entry is never sent by two drains.
+		A claim lasts a lock lease and is extended by the drain's heartbeat (`extend_claims`) after every batch,
+		so an entry is only taken over once the drain sending it stopped.
+		:param names: Entries found due
+		:param token: Token of the claiming drain
+		:return: The entries claimed
+	"""
+	now = now_datetime()
+	frappe.db.set_value(
+		OUTBOX_DOCTYPE,
+		{"name": ["in", names], "status": ["in", ["Queued", "Processing"]], "next_retry_at": ["<=", now]},
+		{"status": "Processing", "claimed_by": token, "next_retry_at": add_to_date(now, seconds=lock_manager.get_ttl())},
+	)
+	frappe.db.commit()
+	return frappe.get_all(
+		OUTBOX_DOCTYPE,
+		filters={"name": ["in", names], "status": "Processing", "claimed_by": token},
+		fields=["name", "action", "reference_name", "attempts", "allocated_number", "number_sent"],
+		order_by="creation asc",
+	)
+
+
+def extend_claims(token):
+	""" Keep a drain's claims from expiring while it is still sending them. """
+	frappe.db.set_value(
+		OUTBOX_DOCTYPE, {"status": "Processing", "claimed_by": token},
+		"next_retry_at", add_to_date(now_datetime(), seconds=lock_manager.get_ttl()), update_modified=False,
+	)
+	frappe.db.commit()
+
+
+def assign_numbers(dispatcher, action, entries):
+	"""
+		Give the entries of a numbered action their number before anything is sent, and keep it on the entry.
+		A read timeout leaves VSDC's outcome unknown, so every retry has to send the same number again: a new one
+		would report the submission twice if the first attempt was recorded.
+		:return: Tuple of (dict of document name -> number, names whose number already went out without a definite answer)
+	"""
+	if action not in action_kinds:
+		return {}, []
+
+	retried = [entry.reference_name for entry in entries if entry.number_sent]
+	fresh = [entry for entry in entries if not entry.allocated_number]
+	allocated = dispatcher.get_numbers(action, [entry.reference_name for entry in fresh]) if fresh else {}
+	for entry in fresh:
+		entry.allocated_number = allocated[entry.reference_name]
+		frappe.db.set_value(OUTBOX_DOCTYPE, entry.name, "allocated_number", entry.allocated_number, update_modified=False)
+
+	frappe.db.commit()
+	return { entry.reference_name: entry.allocated_number for entry in entries }, retried
+
+
+def drain(limit=DRAIN_LIMIT):
+	"""
+		Send due outbox entries to VSDC, grouped per action through the bulk dispatcher.
+		Only one drain runs at a time and it keeps going until nothing is due, so entries written while it runs
+		are picked up too. Its lease and its claims on the entries are renewed after every batch. The dispatcher
+		provides the concurrency.
+		:return: Dict of dispatcher results per action, or None if another drain is running
+	"""
+	from rra_compliance.setup import RRAComplianceFactory
+	from rra_compliance.utils.dispatch import RRABulkDispatcher
+
+	lease = lock_manager.acquire(DRAIN_LOCK)
+	if lease is None:
+		return None
+
+	token = frappe.generate_hash(length=16)
+
+	def heartbeat():
+		lease.renew()
+		extend_claims(token)
+
+	try:
+		dispatcher = RRABulkDispatcher(RRAComplianceFactory())
+		results = {}
+		while due := get_due_entries(limit):
+			entries = claim(due, token)
+			if not entries:
+				break
+
+			for action in dict.fromkeys(e.action for e in entries):
+				group = [e for e in entries if e.action == action]
+				numbers, retried = assign_numbers(dispatcher, action, group)
+				result = dispatcher.run(
+					action, [e.reference_name for e in group], numbers=numbers, retried=retried, heartbeat=heartbeat
+				)
+				record_results(group, result, token)
+				frappe.db.commit()
+				heartbeat()
+				for key in ("submitted", "failed", "skipped", "held", "reconcile"):
+					results.setdefault(action, {}).setdefault(key, []).extend(result[key])
+
+		return results
+	finally:
+		lease.release()
+
+
+def record_results(entries, results, token):
+	""" Update the outbox entries still claimed by a drain from the dispatcher's results, releasing the claims. """
+	submitted = set(results["submitted"])
+	skipped = set(results["skipped"])
+	held = set(results["held"])
+	reconcile = set(results["reconcile"])
+	ambiguous = set(results["ambiguous"])
+	now = now_datetime()
+	for entry in entries:
+		claimed = {"name": entry.name, "claimed_by": token}
+		if entry.reference_name in submitted:
+			frappe.db.set_value(OUTBOX_DOCTYPE, claimed, {
+				"status": "Done", "attempts": entry.attempts + 1, "last_error": None, "claimed_by": None,
+			})
+		elif entry.reference_name in skipped or entry.reference_name in held:
+			# Being submitted by another process, or waiting on its items: look again shortly without counting an attempt
+			frappe.db.set_value(OUTBOX_DOCTYPE, claimed, {
+				"status": "Queued",
+				"next_retry_at": now + timedelta(seconds=RETRY_BASE_DELAY),
+				"last_error": results["errors"].get(entry.reference_name),
+				"claimed_by": None,
+			})
+		elif entry.reference_name in reconcile:
+			# Retrying would only get another 924: left for someone to reconcile with VSDC
+			frappe.db.set_value(OUTBOX_DOCTYPE, claimed, {
+				"status": "Failed",
+				"attempts": entry.attempts + 1,
+				"last_error": results["errors"].get(entry.reference_name),
+				"claimed_by": None,
+			})
+		else:
+			attempts = entry.attempts + 1
+			frappe.db.set_value(OUTBOX_DOCTYPE, claimed, {
+				"status": "Failed" if attempts >= MAX_ATTEMPTS else "Queued",
+				"attempts": attempts,
+				"next_retry_at": now + timedelta(seconds=get_retry_delay(attempts)),
+				"last_error": results["errors"].get(entry.reference_name),
+				"number_sent": 1 if entry.number_sent or entry.reference_name in ambiguous else 0,
+				"claimed_by": None,
+			})
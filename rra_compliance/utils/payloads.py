@@ -0,0 +1,228 @@
+import json
+
+import frappe
+
+from rra_compliance.utils.functions import shorten_string
+from rra_compliance.utils.tax_rates import get_tax_category
+
+"""
+	Single pass payload builder for the sales (saveSales) and purchase (savePurchases) schemas.
+	Every invoice line is prepared once (item attributes, codes, tax amount and category), then the
+	item list and the per category tax totals are produced from that same pass.
+	Fields that differ between the two schemas are keyed by schema in `item_field_map`.
+"""
+
+item_field_map = {
+	"itemSeq": lambda line: line.item.idx,
+	"itemCd": lambda line: line.item.item_code,
+	"itemClsCd": lambda line: line.attributes.itemclscd,
+	"itemNm": lambda line: line.item.item_name,
+	"pkgUnitCd": lambda line: line.pkg_unit_cd,
+	"qtyUnitCd": lambda line: line.qty_unit_cd,
+	"qty": {
+		"sale": lambda line: f"{line.item.qty:.2f}",
+		"purchase": lambda line: int(line.item.qty),
+	},
+	"pkg": {
+		"sale": lambda line: f"{line.item.qty:.2f}",
+		"purchase": lambda line: int(line.item.qty),
+	},
+	"prc": {
+		"sale": lambda line: f"{line.item.base_rate + line.item.discount_amount:.2f}",
+		"purchase": lambda line: f"{line.item.base_net_rate + (line.tax_amount / line.item.qty):.2f}",
+	},
+	"dcRt": lambda line: f"{line.item.discount_percentage:.2f}",
+	"dcAmt": {
+		"sale": lambda line: f"{line.item.discount_amount * line.item.qty:.2f}",
+		"purchase": lambda line: f"{line.item.discount_amount:.2f}",
+	},
+	"splyAmt": {
+		"sale": lambda line: f"{line.item.base_amount + (line.item.discount_amount * line.item.qty):.2f}",
+		"purchase": lambda line: f"{line.item.base_net_amount + line.tax_amount:.2f}",
+	},
+	"taxTyCd": lambda line: line.tax_ty_cd,
+	"taxblAmt": {
+		"sale": lambda line: f"{line.item.base_amount:.2f}",
+		"purchase": lambda line: f"{line.item.base_net_amount + line.tax_amount:.2f}",
+	},
+	"totAmt": {
+		"sale": lambda line: f"{line.item.base_amount:.2f}",
+		"purchase": lambda line: f"{line.item.base_net_amount + line.tax_amount:.2f}",
+	},
+	"taxAmt": lambda line: f"{line.tax_amount:.2f}",  # Not in the documentation but seems required.
+}
+
+compiled_item_fields = {
+	schema: [(field, getter[schema] if isinstance(getter, dict) else getter) for field, getter in item_field_map.items()]
+	for schema in ("sale", "purchase")
+}
+
+
+def get_item_tax_amounts(doc) -> dict:
+	""" Tax amount per item code, from the first tax row's item wise breakdown. """
+	return { key: val[1] for key, val in json.loads(doc.taxes[0].item_wise_tax_detail).items() }
+
+
+def get_invoice_lines(doc, item_attributes, codes, tax_table) -> list:
+	"""
+		Resolve everything the payload needs from each invoice line, once.
+		:param doc: Sales or Purchase Invoice
+		:param item_attributes: Map returned by `get_item_attributes`
+		:param codes: Transaction code index
+		:param tax_table: Tax rate table of the invoice's company
+		:return: List of frappe._dict with item, attributes, tax_amount, category and the RRA codes
+	"""
+	tax_amounts = get_item_tax_amounts(doc)
+	lines = []
+	for item in doc.items:
+		attributes = item_attributes[item.item_code]
+		category = get_tax_category(tax_table, item.item_tax_template)
+		lines.append(frappe._dict({
+			"item": item,
+			"attributes": attributes,
+			"tax_amount": tax_amounts.get(item.item_code, 0),
+			"category": category,
+			"pkg_unit_cd": codes.get_code("Packing Unit", attributes.package_unit.split(' - ')[0]),
+			"qty_unit_cd": codes.get_code("Quantity Unit", item.uom.split(' - ')[0]),
+			"tax_ty_cd": codes.get_code("Taxation Type", category.get("title")),
+		}))
+
+	return lines
+
+
+def aggregate_tax_categories(lines, tax_table) -> dict:
+	"""
+		Taxable amount, rate and tax amount per RRA tax category, in a single pass over the lines.
+		:return: Dict of taxblAmt<X>, taxRt<X> and taxAmt<X> fields for every category of the company
+	"""
+	totals = {letter: [0.0, 0.0] for letter in tax_table["rates"]}
+	for line in lines:
+		total = totals.get((line.category.get("title") or "")[:1])
+		if total is not None:
+			total[0] += line.item.base_net_amount + line.tax_amount
+			total[1] += line.tax_amount
+
+	return {
+		**{ f"taxblAmt{letter}": f"{taxable:.2f}" for letter, (taxable, _) in totals.items() },
+		**{ f"taxRt{letter}": f"{category['rate']:.2f}" for letter, category in tax_table["rates"].items() },
+		**{ f"taxAmt{letter}": f"{tax:.2f}" for letter, (_, tax) in totals.items() },
+	}
+
+
+def build_item_list(schema, lines) -> list:
+	fields = compiled_item_fields[schema]
+	return [{ field: getter(line) for field, getter in fields } for line in lines]
+
+
+def get_common_fields(doc, lines, tax_table) -> dict:
+	return {
+		**aggregate_tax_categories(lines, tax_table),
+		"totTaxblAmt": f"{doc.base_grand_total:.2f}",
+		"totTaxAmt": f"{doc.base_total_taxes_and_charges:.2f}",
+		"totAmt": f"{doc.base_grand_total:.2f}",
+		"regrNm": shorten_string(doc.owner, 60),
+		"regrId": shorten_string(doc.owner, 20),
+		"modrNm": shorten_string(doc.modified_by, 60),
+		"modrId": shorten_string(doc.modified_by, 20),
+		"totItemCnt": len(lines),
+	}
+
+
+def build_sale_payload(base_payload, sales_invoice, customer, invc_no, date, lines, codes, tax_table) -> dict:
+	"""
+		Build a saveSales payload.
+		:param base_payload: TIN and branch of the company
+		:param lines: Lines returned by `get_invoice_lines`
+		:return: Payload dict
+	"""
+	if sales_invoice.get('payments'):
+		payment_type = sales_invoice.get('payments')[0].mode_of_payment if len(sales_invoice.get('payments')) == 1 else "OTHER"
+	else:
+		payment_type = "CREDIT"
+
+	return {
+		**base_payload,
+		"salesDt": date.strftime("%Y%m%d"),
+		"cfmDt": date.strftime("%Y%m%d%H%M%S"),
+		"invcNo": invc_no,
+		"rptNo": invc_no,
+		"orgInvcNo": 0,
+		**({"custTin": customer.tax_id, "prcOrdCd": sales_invoice.purchase_code} if customer.tax_id else {}),
+		"custNm": customer.customer_name,
+		"salesTyCd": "N",
+		"rcptTyCd": codes.get_code("Sales Receipt Type", "Sale"),
+		"pmtTyCd": codes.get_code("Payment Type", payment_type),
+		"salesSttsCd": "05",
+		"prchrAcptcYn": "Y" if not sales_invoice.is_return else "N",
+		**get_common_fields(sales_invoice, lines, tax_table),
+		"itemList": build_item_list("sale", lines),
+	}
+
+
+def build_purchase_payload(base_payload, purchase_invoice, supplier, invc_no, date, lines, codes, tax_table) -> dict:
+	"""
+		Build a savePurchases payload.
+		:param base_payload: TIN and branch of the company
+		:param lines: Lines returned by `get_invoice_lines`
+		:return: Payload dict
+	"""
+	return {
+		**base_payload,
+		"invcNo": invc_no,
+		"cfmDt": date.strftime("%Y%m%d%H%M%S"),
+		"pchsDt": date.strftime("%Y%m%d"),
+		"wrhsDt": date.strftime("%Y%m%d%H%M%S"),
+		**({"supplrTin": supplier.tax_id} if supplier.tax_id else {}),
+		"supplrNm": supplier.supplier_name,
+		"orgInvcNo": 0,
+		**({"spplrBhfId": supplier.get("branch_id")} if supplier.get("branch_id") else {}),
+		**({"spplrInvcNo": purchase_invoice.bill_no} if purchase_invoice.bill_no else {}),
+		**({"spplrSdcId": purchase_invoice.get("sdc_id")} if purchase_invoice.get("sdc_id") else {}),
+		"regTyCd": "M",
+		"pchsTyCd": "N",
+		"rcptTyCd": codes.get_code("Purchase Receipt Type", "Purchase"),
+		"pmtTyCd": codes.get_code("Payment Type", purchase_invoice.get('mode_of_payment') or "CREDIT"),
+		"pchsSttsCd": "05",
+		**get_common_fields(purchase_invoice, lines, tax_table),
+		"itemList": build_item_list("purchase", lines),
+	}
+
+
+def benchmark(lines=200, categories=4, repeat=50) -> dict:
+	"""
+		Compare the single pass tax aggregation with the per category scan it replaced, on synthetic lines.
+		:param lines: Number of invoice lines
+		:param categories: Number of tax categories of the company
+		:param repeat: Number of payloads built per run
+		:return: Dict with the total seconds of each approach
+	"""
+	import random
+	import timeit
+
+	letters = "ABCDEFGHIJ"[:categories]
+	tax_table = {"rates": { letter: {"rate": 18.0 if letter == "B" else 0.0, "title": f"{letter}-TAX"} for letter in letters }}
+	synthetic = [
+		frappe._dict({
+			"item": frappe._dict({"item_code": f"ITEM-{i}", "base_net_amount": random.uniform(1, 1000)}),
+			"tax_amount": random.uniform(0, 180),
+			"category": tax_table["rates"][random.choice(letters)],
+		}) for i in range(lines)
+	]
+
+	def per_category_scan():
+		titles = { line.item.item_code: line.category["title"] for line in synthetic }
+		tax_amounts = { line.item.item_code: line.tax_amount for line in synthetic }
+		tax_rates = { category["title"]: category["rate"] for category in tax_table["rates"].values() }
+		return {
+			**{ f"taxblAmt{title[0]}": "{:.2f}".format(sum(line.item.base_net_amount + tax_amounts.get(line.item.item_code, 0)
+				for line in synthetic if titles.get(line.item.item_code) == title)) for title in tax_rates },
+			**{ f"taxRt{title[0]}": f"{rate:.2f}" for title, rate in tax_rates.items() },
+			**{ f"taxAmt{title[0]}": "{:.2f}".format(sum(tax_amounts.get(line.item.item_code, 0)
+				for line in synthetic if titles.get(line.item.item_code) == title)) for title in tax_rates },
+		}
+
+	assert per_category_scan() == aggregate_tax_categories(synthetic, tax_table)
+	return {
+		"per_category_scan": timeit.timeit(per_category_scan, number=repeat),
+		"single_pass": timeit.timeit(lambda: aggregate_tax_categories(synthetic, tax_table), number=repeat),
+	}
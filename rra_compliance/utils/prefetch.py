@@ -0,0 +1,21 @@
+import frappe
+
+item_fields = ["itemclscd", "package_unit", "stock_uom", "item_name", "tax_type"]
+
+
+def get_item_attributes(item_codes, fields=None) -> dict:
+	"""
+		Load Item attributes needed for payloads in a single query.
+		:param item_codes: Item codes, duplicates allowed
+		:param fields: Item fields to load. Defaults to the fields used by the payload builders.
+		:return: Dict of item code -> frappe._dict of the requested fields
+	"""
+	codes = list({code for code in item_codes if code})
+	if not codes:
+		return {}
+
+	return {
+		row.name: row
+		for row in frappe.get_all("Item", filters={"name": ["in", codes]}, fields=["name", *(fields or item_fields)])
+	}
+
@@ -0,0 +1,127 @@
+import frappe
+from erpnext.accounts.doctype.sales_invoice.sales_invoice import get_bank_cash_account
+from frappe.utils import get_datetime
+
+from rra_compliance.utils.codes import get_code_name
+from rra_compliance.utils.staging import mark_processed
+
+PROGRESS_EVENT = "rra_purchase_import_progress"
+PROGRESS_INTERVAL = 10
+
+"""
+	Purchases mapped in RRA Purchase Mapper are turned into submitted Purchase Invoices by a background job,
+	so the import neither holds the web request nor stops at the first purchase that fails.
+"""
+
+
+def enqueue_import(company, purchases):
+	"""
+		Import mapped purchases in the background.
+		:param company: Company the purchases belong to
+		:param purchases: VSDC purchases, with their items mapped to Item codes
+		:return: Job id
+	"""
+	job = frappe.enqueue(
+		import_purchases, queue="long", timeout=3600,
+		company=company, purchases=purchases, user=frappe.session.user,
+	)
+	return job.id if job else None
+
+
+def get_imported_bills(company, purchases) -> set:
+	""" (supplier, bill_no) of the purchases already imported, in one query. """
+	bill_nos = list({ str(purchase.get("spplrInvcNo")) for purchase in purchases if purchase.get("spplrInvcNo") })
+	if not bill_nos:
+		return set()
+
+	return {
+		(row.supplier, row.bill_no)
+		for row in frappe.get_all(
+			"Purchase Invoice",
+			filters={"company": company, "bill_no": ["in", bill_nos], "docstatus": ["!=", 2]},
+			fields=["supplier", "bill_no"],
+		)
+	}
+
+
+def make_purchase_invoice(company, purchase, get_account):
+	""" Unsaved Purchase Invoice of a mapped VSDC purchase. """
+	confirmed_on = get_datetime(purchase.get("cfmDt"))
+	mode_of_payment = get_code_name("Payment Type", purchase.get("pmtTyCd"))
+	doc = frappe.get_doc({
+		"doctype": "Purchase Invoice",
+		"company": company,
+		"supplier": purchase.get("supplier") or purchase.get("spplrNm"),
+		"is_paid": 1,
+		"posting_date": confirmed_on.date(),
+		"posting_time": confirmed_on.time(),
+		"bill_date": confirmed_on.date(),
+		"bill_no": purchase.get("spplrInvcNo"),
+		"mode_of_payment": mode_of_payment,
+		"cash_bank_account": get_account(mode_of_payment),
+		"paid_amount": purchase.get("totAmt"),
+		"sdc_id": purchase.get("sdcId") or purchase.get("spplrSdcId"),
+	})
+	for item in purchase.get("itemList", []):
+		doc.append("items", {
+			"item_name": item.get("itemNm"),
+			"item_code": item.get("itemCd"),
+			"qty": item.get("qty"),
+			"rate": item.get("prc"),
+			"basic_rate": item.get("prc")
+		})
+
+	return doc
+
+
+def import_purchases(company, purchases, user=None):
+	"""
+		Create and submit a Purchase Invoice per mapped purchase, committing each one on its own.
+		Purchases already imported for the same supplier and bill number are skipped (ones without a bill number
+		never are), and one that fails is rolled back and reported without stopping the others. Progress is published to `user` as it goes.
+		:param company: Company the purchases belong to
+		:param purchases: VSDC purchases, with their items mapped to Item codes
+		:param user: User to report progress to
+		:return: Dict with the invoices "created", the bill numbers "skipped" and the "failed" ones (bill number -> error)
+	"""
+	purchases = frappe.parse_json(purchases)
+	imported = get_imported_bills(company, purchases)
+	accounts = {}
+
+	def get_account(mode_of_payment):
+		if mode_of_payment not in accounts:
+			accounts[mode_of_payment] = get_bank_cash_account(mode_of_payment, company).get("account")
+
+		return accounts[mode_of_payment]
+
+	results = {"created": [], "skipped": [], "failed": {}}
+	for index, purchase in enumerate(purchases, start=1):
+		bill_no = purchase.get("spplrInvcNo")
+		supplier = purchase.get("supplier") or purchase.get("spplrNm")
+		if bill_no and (supplier, str(bill_no)) in imported:
+			results["skipped"].append(bill_no)
+			mark_processed([purchase.get("staged_record")])
+			frappe.db.commit()
+		else:
+			try:
+				doc = make_purchase_invoice(company, purchase, get_account)
+				doc.insert()
+				doc.submit()
+				mark_processed([purchase.get("staged_record")])
+				frappe.db.commit()
+				if bill_no:
+					imported.add((supplier, str(bill_no)))
+				results["created"].append(doc.name)
+			except Exception as e:
+				frappe.db.rollback()
+				results["failed"][bill_no] = str(e)
+				frappe.log_error(title="RRA Purchase Import Error", message=f"Purchase {bill_no} from {supplier}: {e}")
+
+		if index % PROGRESS_INTERVAL == 0 or index == len(purchases):
+			frappe.publish_realtime(PROGRESS_EVENT, {
+				"company": company, "progress": index, "total": len(purchases),
+				"created": len(results["created"]), "skipped": len(results["skipped"]), "failed": len(results["failed"]),
+				**({ "done": 1, "errors": results["failed"] } if index == len(purchases) else {}),
+			}, user=user)
+
+	return results
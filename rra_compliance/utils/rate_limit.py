@@ -0,0 +1,89 @@
+import math
+import time
+
+import frappe
+import requests
+
+KEY_PREFIX = "rra_rate_limit"
+METRICS = ("requests", "waited", "wait_ms")
+
+"""
+	Token bucket kept in a Redis hash (tokens, ts), refilled from Redis' own clock so every worker agrees.
+	A request always takes its token, letting the balance go negative; the caller then waits until the balance
+	would have been refilled. Waiting callers are therefore served in arrival order and never spin on Redis.
+	Returns the wait in milliseconds. When the wait would reach the caller's budget (ARGV[3], -1 for none) the
+	token is not taken and the wait is returned negated, so a request that is never sent costs nothing.
+"""
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local budget = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate / 1000) - 1
+local wait = 0
+if tokens < 0 then
+	wait = math.ceil(-tokens * 1000 / rate)
+	if budget >= 0 and wait >= budget then
+		return -wait
+	end
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + wait + 1000)
+return wait
+"""
+
+
+class RateLimitExceeded(requests.Timeout):
+	""" Raised when waiting for a token would overrun the caller's deadline. """
+
+
+class RateLimiter:
+	"""
+		Token bucket rate limiter per TIN/branch and VSDC endpoint, shared by every worker through Redis.
+		Safe to use from the dispatcher's threads: the Redis client and site key prefix are taken when the limiter
+		is built on the main thread, so no frappe context is needed afterwards.
+		Requests, how many of them had to wait and the total wait are counted under `rra_rate_limit:metrics`.
+	"""
+	def __init__(self, rate, burst=None):
+		self.rate = float(rate)
+		self.burst = max(1, int(burst or math.ceil(self.rate)))
+		self.redis = frappe.cache()
+		self.prefix = frappe.cache().make_key(KEY_PREFIX)
+
+	def get_key(self, tin, bhf_id, url):
+		return f"{self.prefix}:{tin}:{bhf_id}:{url}"
+
+	def count(self, metric, amount=1):
+		self.redis.incrby(f"{self.prefix}:metrics:{metric}", amount)
+
+	def acquire(self, tin, bhf_id, url, deadline=None) -> float:
+		"""
+			Take a token, waiting as long as needed.
+			:param deadline: Optional absolute `time.monotonic()` deadline
+			:return: Seconds waited
+			:raises RateLimitExceeded: If the token would only be available after the deadline
+		"""
+		budget = max(0, int((deadline - time.monotonic()) * 1000)) if deadline is not None else -1
+		wait = int(self.redis.eval(TOKEN_BUCKET_SCRIPT, 1, self.get_key(tin, bhf_id, url), self.rate, self.burst, budget)) / 1000
+		if wait < 0:
+			raise RateLimitExceeded(f"VSDC rate limit for {url} would delay the request past its deadline.")
+
+		self.count("requests")
+		if not wait:
+			return 0
+
+		self.count("waited")
+		self.count("wait_ms", int(wait * 1000))
+		time.sleep(wait)
+		return wait
+
+
+def get_metrics() -> dict:
+	""" Rate limiter counters since the cache was last cleared. """
+	cache = frappe.cache()
+	values = cache.mget([cache.make_key(f"{KEY_PREFIX}:metrics:{metric}") for metric in METRICS])
+	return { metric: int(value or 0) for metric, value in zip(METRICS, values, strict=True) }
@@ -1,3 +1,5 @@
+import frappe
+
 rra_to_frappe = {
 	"Stock I/O Type": "Stock Entry",
 	"Payment Type": "Mode of Payment",
@@ -24,37 +26,110 @@ rra_to_frappe = {
 }
 
 frappe_to_rra = {v: k for k, v in rra_to_frappe.items()}
+
+def get_payment_type(name):
+	""" Mode of Payment type of a VSDC payment type name. """
+	name = name.lower()
+	return "Cash" if "cash" in name else "Bank" if "bank" in name or "card" in name else "Phone" if "mobile" in name else "General"
+
+
+def get_translation_context():
+	"""
+		Database values the translations below depend on, resolved once per code sync.
+		:return: Dict with the default company, its VAT account and default cash and bank accounts
+	"""
+	return frappe._dict({
+		"company": frappe.defaults.get_global_default("company"),
+		"vat_account": frappe.db.get_value("Account", {"name": ["like", "VAT - %"]}, "name", order_by="creation desc"),
+		"cash_account": frappe.db.get_value("Account", {"account_type": "Cash"}, "name"),
+		"bank_account": frappe.db.get_value("Account", {"account_type": "Bank"}, "name"),
+	})
+
+
+"""
+	Doctype -> {fieldname: source}, where source is the key of the value in a VSDC code (dtlList row),
+	or a callable of (code, code class, translation context) for derived values.
+"""
 to_replace = {
 	'Country': {
 		"country_name": "cdNm",
 		"code": "cd",
 	},
 	'UOM': {
-		"uom_name": {"eval": "i.get('cdNm')+' - '+('PU' if item.get('cdClsNm') == 'Packing Unit' else 'QU')"},
+		"uom_name": lambda i, item, context: i.get('cdNm') + ' - ' + ('PU' if item.get('cdClsNm') == 'Packing Unit' else 'QU'),
 	},
 	"Item Tax Template": {
 		"title": "cdNm",
-		"taxes": {
-			"eval": """
-[{
-"tax_type": frappe.get_last_doc("Account", filters={"name": ["like", "VAT - %"]}).name,
-"tax_rate": 18 if i.get("cd") == "B" else 0
-}]
-"""
-		}
+		"company": lambda i, item, context: context.company,
+		"taxes": lambda i, item, context: [{
+			"tax_type": context.vat_account,
+			"tax_rate": 18 if i.get("cd") == "B" else 0
+		}],
 	},
 	"Mode of Payment": {
 		"mode_of_payment": "cdNm",
-		"type": {
-			'eval': "'Cash' if 'cash' in i.get('cdNm').lower() else 'Bank' if 'bank' in i.get('cdNm').lower() or 'card' in i.get('cdNm').lower() else 'Phone' if 'mobile' in i.get('cdNm').lower() else 'General'"
-		}, # Forgive me father, for I have sinned. May you guide whoever is reading this expression.
-		"accounts": {
-			"eval": """
-[{
-"company": frappe.defaults.get_global_default("company"),
-"default_account": frappe.get_value("Account", {"account_type": "Cash"}, "name") if 'cash' in i.get('cdNm').lower() or 'mobile' in i.get('cdNm').lower() else frappe.get_value("Account", {"account_type": "Bank"}, "name")
-}]
+		"type": lambda i, item, context: get_payment_type(i.get('cdNm')),
+		"accounts": lambda i, item, context: [{
+			"company": context.company,
+			"default_account": context.cash_account if 'cash' in i.get('cdNm').lower() or 'mobile' in i.get('cdNm').lower() else context.bank_account
+		}],
+	},
+}
+
+
+def translate(doctype, i, item, context) -> dict:
+	"""
+		Values of the `doctype` document a VSDC code translates to.
+		:param i: Code (dtlList row)
+		:param item: Code class the code belongs to
+		:param context: Dict from `get_translation_context`
+	"""
+	return {
+		key: value(i, item, context) if callable(value) else i.get(value)
+		for key, value in to_replace[doctype].items()
+	}
+
+
+def yes_no(value):
+	return 1 if value == "Y" else 0
+
+
+"""
+	Doctype -> field map of the VSDC master data records upserted into it, see `rra_compliance.utils.upsert`.
 """
-		}
+upsert_maps = {
+	"Branch": {
+		"key": "branch",
+		"bulk": True,
+		"fields": {
+			"branch": lambda r: (r.get("brnchNm") or "").strip(),
+			"bhfid": "bhfId",
+			"bhfsttscd": "bhfSttsCd",
+			"prvncnm": "prvncNm",
+			"dstrtnm": "dstrtNm",
+			"sctrnm": "sctrNm",
+			"locdesc": "locDesc",
+			"mgrnm": "mgrNm",
+			"mgrtelno": "mgrTelNo",
+			"mgremail": "mgrEmail",
+			"hqyn": lambda r: yes_no(r.get("hqYn")),
+		},
+	},
+	"Customer": {
+		"key": "tax_id",
+		"fields": {
+			"tax_id": "tin",
+			"customer_name": lambda r: r.get("taxprNm") or r.get("taxprnm"),
+			"taxprsttscd": lambda r: r.get("taxprSttsCd") or r.get("taxPrSttsCd"),
+		},
+	},
+	"Supplier": {
+		"key": "tax_id",
+		"fallback_key": "supplier_name",
+		"fields": {
+			"supplier_name": "spplrNm",
+			"tax_id": "spplrTin",
+			"branch_id": "spplrBhfId",
+		},
 	},
 }
@@ -0,0 +1,127 @@
+import frappe
+from frappe.utils import now
+
+SEQUENCE_DOCTYPE = "RRA Invoice Sequence"
+KEY_PREFIX = "rra_invoice_sequence"
+MAX_RESYNC_PROBES = 32
+
+"""
+	Document kind -> (source doctype, log doctype, number field)
+"""
+sequence_kinds = {
+	"sale": ("Sales Invoice", "RRA Sales Invoice Log", "invc_no"),
+	"purchase": ("Purchase Invoice", "RRA Purchase Invoice Log", "invc_no"),
+	"stock": ("Stock Ledger Entry", "RRA Stock IO Log", "sar_no"),
+}
+
+action_kinds = {
+	"save_sale": "sale",
+	"save_purchase": "purchase",
+	"update_item_stock": "stock",
+}
+
+"""
+	INCRBY only when the counter exists, so a flushed Redis can never restart numbering from zero.
+"""
+INCREMENT_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then
+	return false
+end
+return redis.call('incrby', KEYS[1], ARGV[1])
+"""
+
+
+class InvoiceSequence:
+	"""
+		Allocator of VSDC invoice (or stored and released) numbers for a company's TIN/branch and a document kind.
+		Numbers come from a Redis counter, so concurrent workers allocate with one atomic INCRBY and a batch
+		can take a whole contiguous block at once, without scanning or locking the log tables.
+		The counter is checkpointed to RRA Invoice Sequence by `checkpoint_sequences` and, when missing,
+		re-seeded from the highest of that checkpoint, the last logged number and the numbers held by the outbox.
+	"""
+	def __init__(self, company, kind):
+		self.company = company
+		self.kind = kind
+		self.tin, self.bhf_id = frappe.get_cached_value("Company", company, ["tax_id", "branch_id"])
+		self.name = f"{self.tin}-{self.bhf_id}-{kind}"
+		self.key = frappe.cache().make_key(f"{KEY_PREFIX}:{self.name}")
+
+	def get_floor(self) -> int:
+		"""
+			Highest number already used: the checkpoint, the last logged number or the last number given to an
+			RRA Outbox entry, whichever is higher. Outbox numbers may be in flight without being logged yet.
+		"""
+		_, doctype, fieldname = sequence_kinds[self.kind]
+		checkpoint = frappe.db.get_value(SEQUENCE_DOCTYPE, self.name, "last_number") or 0
+		logged = frappe.db.sql(
+			f"select max(`{fieldname}`) from `tab{doctype}` where company = %s or coalesce(company, '') = ''",
+			self.company,
+		)[0][0] or 0
+		actions = [action for action, kind in action_kinds.items() if kind == self.kind]
+		allocated = frappe.db.sql(
+			"select max(allocated_number) from `tabRRA Outbox` where company = %s and action in %s",
+			(self.company, actions),
+		)[0][0] or 0
+		return max(int(checkpoint), int(logged), int(allocated))
+
+	def allocate(self, count=1) -> int:
+		"""
+			Reserve a contiguous block of numbers.
+			:param count: Size of the block
+			:return: First number of the block
+		"""
+		cache = frappe.cache()
+		end = cache.eval(INCREMENT_SCRIPT, 1, self.key, count)
+		if end is None:
+			cache.set(self.key, self.get_floor(), nx=True)
+			end = cache.eval(INCREMENT_SCRIPT, 1, self.key, count)
+
+		return int(end) - count + 1
+
+	def advance_to(self, number):
+		""" Make sure the next allocation is above `number`, e.g. after VSDC reported it as already used. """
+		cache = frappe.cache()
+		if cache.get(self.key) is None:
+			cache.set(self.key, self.get_floor(), nx=True)
+
+		cache.eval("if tonumber(redis.call('get', KEYS[1])) < tonumber(ARGV[1]) then redis.call('set', KEYS[1], ARGV[1]) end", 1, self.key, number)
+
+	def get_current(self):
+		""" Last number handed out, or None if the counter is not in Redis. """
+		value = frappe.cache().get(self.key)
+		return int(value) if value is not None else None
+
+	def checkpoint(self):
+		""" Persist the counter to RRA Invoice Sequence. """
+		current = self.get_current()
+		if current is None:
+			return
+
+		if frappe.db.exists(SEQUENCE_DOCTYPE, self.name):
+			frappe.db.sql(
+				f"update `tab{SEQUENCE_DOCTYPE}` set last_number = greatest(last_number, %s), modified = %s where name = %s",
+				(current, now(), self.name),
+			)
+		else:
+			frappe.get_doc({
+				"doctype": SEQUENCE_DOCTYPE,
+				"company": self.company,
+				"kind": self.kind,
+				"tin": self.tin,
+				"bhf_id": self.bhf_id,
+				"last_number": current,
+			}).insert(ignore_permissions=True)
+
+
+def allocate(company, kind, count=1) -> int:
+	""" Shortcut for `InvoiceSequence(company, kind).allocate(count)`. """
+	return InvoiceSequence(company, kind).allocate(count)
+
+
+def checkpoint_sequences():
+	""" Persist the Redis counters of every company with a TIN. Scheduled hourly. """
+	for company in frappe.get_all("Company", filters={"tax_id": ["is", "set"]}, pluck="name"):
+		for kind in sequence_kinds:
+			InvoiceSequence(company, kind).checkpoint()
+
+	frappe.db.commit()
@@ -0,0 +1,158 @@
+import frappe
+from frappe.utils import cint, getdate, now
+
+from rra_compliance.utils.bulk import bulk_insert_docs
+from rra_compliance.utils.locks import lock_manager
+
+STAGING_DOCTYPE = "RRA Staged Record"
+UPDATED_EVENT = "rra_staged_records_updated"
+PAGE_LENGTH = 20
+MAX_PAGE_LENGTH = 200
+
+"""
+	Purchases and imports fetched from VSDC are staged per company by a scheduled job, and the mapper screens
+	page through the staged records instead of waiting on VSDC for the whole list every time they are opened.
+"""
+
+
+def parse_date(value):
+	try:
+		return getdate(value) if value else None
+	except Exception:
+		return None
+
+
+"""
+	Kind -> how to fetch its records and what they are filtered and identified by.
+"""
+staged_kinds = {
+	"Purchase": {
+		"action": "get_purchases",
+		"list_key": "saleList",
+		"key": lambda r: f"{r.get('spplrTin')}-{r.get('spplrInvcNo')}",
+		"title": lambda r: r.get("spplrNm"),
+		"tin": lambda r: r.get("spplrTin"),
+		"date": lambda r: parse_date(r.get("cfmDt") or r.get("salesDt")),
+	},
+	"Import": {
+		"action": "get_imported_items",
+		"list_key": "itemList",
+		"key": lambda r: f"{r.get('taskCd')}-{r.get('dclDe')}-{r.get('itemSeq')}",
+		"title": lambda r: r.get("itemNm"),
+		"tin": lambda r: None,
+		"date": lambda r: parse_date(r.get("dclDe")),
+	},
+}
+
+
+def stage(company, kind, full=False, rra=None):
+	"""
+		Fetch the purchases or imports of a company changed on VSDC since the last run, and stage them.
+		Records already staged are refreshed without losing whether they were processed. Purchases get their
+		suppliers resolved here, so the mapper does not have to.
+		:param company: Company to fetch for
+		:param kind: "Purchase" or "Import"
+		:param full: Fetch every record instead of the changes since the last run
+		:return: Dict with the number of records "inserted" and "updated", or None if the company is already being staged
+	"""
+	from rra_compliance.setup import RRAComplianceFactory
+
+	config = staged_kinds[kind]
+	lease = lock_manager.acquire(f"rra_stage:{company}:{kind}", ttl=30 * 60)
+	if lease is None:
+		return None
+
+	try:
+		rra = rra or RRAComplianceFactory()
+		rra.set_payload(company)
+		records, result_dt = rra.fetch_changes(config["action"], config["list_key"], full=full, print_if='fail', print_to='frappe')
+		if kind == "Purchase":
+			rra.attach_suppliers(records)
+
+		records = { config["key"](record): record for record in records }
+		existing = dict(frappe.get_all(
+			STAGING_DOCTYPE,
+			filters={"company": company, "kind": kind, "record_key": ["in", list(records) or [""]]},
+			fields=["record_key", "name"],
+			as_list=True,
+		))
+		timestamp, new = now(), []
+		for key, record in records.items():
+			values = {
+				"title": config["title"](record),
+				"tin": config["tin"](record),
+				"document_date": config["date"](record),
+				"fetched_on": timestamp,
+				"data": frappe.as_json(record, indent=None),
+			}
+			if key in existing:
+				frappe.db.set_value(STAGING_DOCTYPE, existing[key], values, update_modified=False)
+			else:
+				new.append(frappe.new_doc(STAGING_DOCTYPE).update({ "company": company, "kind": kind, "record_key": key, **values }))
+
+		bulk_insert_docs(new)
+		frappe.db.commit()
+		rra.advance_watermark(config["action"], result_dt)
+		frappe.publish_realtime(UPDATED_EVENT, {"company": company, "kind": kind})
+		return {"inserted": len(new), "updated": len(records) - len(new)}
+	finally:
+		lease.release()
+
+
+def stage_all():
+	""" Stage the purchases and imports of every company with a TIN. Scheduled hourly. """
+	from rra_compliance.setup import RRAComplianceFactory
+
+	rra = RRAComplianceFactory()
+	for company in frappe.get_all("Company", filters={"tax_id": ["is", "set"]}, pluck="name"):
+		for kind in staged_kinds:
+			try:
+				stage(company, kind, rra=rra)
+			except Exception:
+				frappe.db.rollback()
+				frappe.log_error(title=f"RRA staging failed: {company} {kind}")
+
+
+def enqueue_stage(company, kind, full=False):
+	""" Stage a company's records now, in the background. Requests made while one is queued are merged into it. """
+	frappe.enqueue(
+		stage, queue="long", timeout=1800, job_id=f"rra_stage::{company}::{kind}", deduplicate=True,
+		company=company, kind=kind, full=full,
+	)
+
+
+def get_page(company, kind, from_date=None, search=None, processed=0, start=0, page_length=PAGE_LENGTH) -> dict:
+	"""
+		A page of staged records, newest first.
+		:param from_date: Only records dated on or after this date
+		:param search: Text matched against the title, TIN and record key
+		:param processed: Whether to list processed records instead of pending ones
+		:return: Dict with the "records", each with its staged record name under "staged_record", the "total"
+			matching records, and when the company's records were last "fetched_on"
+	"""
+	filters = {"company": company, "kind": kind, "processed": cint(processed)}
+	if from_date:
+		filters["document_date"] = [">=", getdate(from_date)]
+
+	or_filters = { field: ["like", f"%{search}%"] for field in ["title", "tin", "record_key"] } if search else None
+	start, page_length = cint(start), min(cint(page_length) or PAGE_LENGTH, MAX_PAGE_LENGTH)
+	rows = frappe.get_all(
+		STAGING_DOCTYPE, filters=filters, or_filters=or_filters, fields=["name", "data"],
+		order_by="document_date desc, record_key asc", limit_start=start, limit_page_length=page_length,
+	)
+	total = frappe.get_all(STAGING_DOCTYPE, filters=filters, or_filters=or_filters, fields=["count(name) as total"])[0].total
+	fetched_on = frappe.get_all(STAGING_DOCTYPE, filters={"company": company, "kind": kind}, fields=["max(fetched_on) as fetched_on"])[0].fetched_on
+	return {
+		"records": [{ **frappe.parse_json(row.data), "staged_record": row.name } for row in rows],
+		"total": total,
+		"start": start,
+		"page_length": page_length,
+		"fetched_on": fetched_on,
+	}
+
+
+def mark_processed(names):
+	""" Hide staged records from the pending list once they were imported or sent. """
+	names = [name for name in names if name]
+	if names:
+		frappe.db.set_value(STAGING_DOCTYPE, {"name": ["in", names]}, "processed", 1, update_modified=False)
@@ -0,0 +1,70 @@
+import frappe
+from frappe.utils import flt
+
+CACHE_KEY = "rra_tax_rate_table"
+
+
+def build_tax_rate_table(company) -> dict:
+	"""
+		Build the RRA tax rate table for a company from its Item Tax Templates.
+		Templates are titled after the RRA Taxation Type (e.g. "B-18.00%"), whose first letter is the tax category.
+		:param company: Company name
+		:return: Dict with
+			"rates": tax category letter -> {"rate", "template", "title"}
+			"templates": template name -> tax category letter
+			"titles": template title -> tax category letter
+	"""
+	abbr = frappe.get_cached_value("Company", company, "abbr") if company else None
+	templates = frappe.get_all("Item Tax Template", fields=["name", "title", "company"], order_by="creation asc")
+	own = [t for t in templates if t.company == company]
+	templates = own or [t for t in templates if not t.company] or templates
+
+	details = {}
+	for row in frappe.get_all(
+		"Item Tax Template Detail",
+		filters={"parent": ["in", [t.name for t in templates] or [""]], "tax_type": ["like", "VAT - %"]},
+		fields=["parent", "tax_type", "tax_rate"],
+	):
+		if row.parent not in details or row.tax_type == f"VAT - {abbr}":
+			details[row.parent] = flt(row.tax_rate)
+
+	table = {"rates": {}, "templates": {}, "titles": {}}
+	for template in templates:
+		if not template.title:
+			continue
+
+		letter = template.title.strip()[0]
+		table["rates"][letter] = {"rate": details.get(template.name, 0.0), "template": template.name, "title": template.title}
+		table["templates"][template.name] = letter
+		table["titles"][template.title] = letter
+
+	return table
+
+
+def get_tax_rate_table(company=None) -> dict:
+	""" Get the cached tax rate table for a company. See `build_tax_rate_table`. """
+	company = company or frappe.defaults.get_global_default("company")
+	table = frappe.cache().hget(CACHE_KEY, company)
+	if table is None:
+		table = build_tax_rate_table(company)
+		frappe.cache().hset(CACHE_KEY, company, table)
+
+	return table
+
+
+def get_tax_category(table, template=None, title=None) -> dict:
+	"""
+		Find the tax category of an Item Tax Template in a tax rate table.
+		:param table: Table returned by `get_tax_rate_table`
+		:param template: Item Tax Template name
+		:param title: Item Tax Template title, used when the name is not known.
+			Defaults to the name without its " - <company abbr>" suffix.
+		:return: Dict with "rate", "template" and "title", or an empty dict
+	"""
+	letter = table["templates"].get(template) or table["titles"].get(title or (template or "").rsplit(" - ", 1)[0])
+	return table["rates"].get(letter) or {}
+
+
+def clear_tax_rate_table(doc=None, method=None, *args):
+	""" Invalidate the tables of every company. Used as a doc event on Item Tax Template and Account. """
+	frappe.cache().delete_value(CACHE_KEY)
@@ -0,0 +1,266 @@
+import random
+import threading
+import time
+
+import frappe
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from rra_compliance.utils.rate_limit import RateLimiter, RateLimitExceeded
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 30.0
+DEFAULT_RETRY_ATTEMPTS = 3
+DEFAULT_RETRY_BASE_DELAY = 0.5
+DEFAULT_RETRY_MAX_DELAY = 8.0
+DEFAULT_CIRCUIT_THRESHOLD = 5
+DEFAULT_CIRCUIT_RESET_TIMEOUT = 30.0
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+class DeadlineExceeded(requests.Timeout):
+	""" Raised when the caller's deadline has passed before the request could be sent. """
+
+
+class CircuitOpenError(requests.ConnectionError):
+	""" Raised without contacting VSDC while the circuit for an endpoint is open. """
+
+
+class RetryPolicy:
+	"""
+		Exponential backoff with full jitter for transient transport failures.
+		Only failures where VSDC cannot have recorded the submission are retried: connection errors and
+		gateway/throttling statuses. Read timeouts and 500s are not retried, as retrying a submission that
+		did go through would burn a new invoice number on a 924. Business failures (any `resultCd` in a 2xx
+		response) are never retried here.
+	"""
+	retry_statuses = frozenset({429, 502, 503, 504})
+
+	def __init__(self, attempts=DEFAULT_RETRY_ATTEMPTS, base_delay=DEFAULT_RETRY_BASE_DELAY, max_delay=DEFAULT_RETRY_MAX_DELAY):
+		self.attempts = max(1, attempts)
+		self.base_delay = base_delay
+		self.max_delay = max_delay
+
+	def get_delay(self, attempt):
+		""" Delay in seconds before the given retry attempt (1 based). """
+		return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+	def is_retryable(self, response=None, error=None):
+		if error is not None:
+			return isinstance(error, requests.ConnectionError) and not isinstance(error, CircuitOpenError)
+
+		return response.status_code in self.retry_statuses
+
+	def is_failure(self, response=None, error=None):
+		""" Whether the outcome counts against the endpoint's circuit. """
+		if error is not None:
+			return not isinstance(error, CircuitOpenError)
+
+		return response.status_code >= 500 or response.status_code == 429
+
+
+class CircuitBreaker:
+	"""
+		Per endpoint circuit breaker.
+		After `threshold` consecutive failures the circuit opens and calls fail immediately for
+		`reset_timeout` seconds. A single trial call is then let through; its outcome closes or re-opens it.
+	"""
+	def __init__(self, threshold=DEFAULT_CIRCUIT_THRESHOLD, reset_timeout=DEFAULT_CIRCUIT_RESET_TIMEOUT):
+		self.threshold = max(1, threshold)
+		self.reset_timeout = reset_timeout
+		self._failures = {}
+		self._opened_at = {}
+		self._trial = set()
+		self._lock = threading.Lock()
+
+	def before_request(self, url):
+		with self._lock:
+			opened_at = self._opened_at.get(url)
+			if opened_at is None:
+				return
+
+			if time.monotonic() - opened_at < self.reset_timeout or url in self._trial:
+				raise CircuitOpenError(f"VSDC endpoint {url} is unavailable. Circuit is open after {self._failures.get(url)} consecutive failures.")
+
+			self._trial.add(url)
+
+	def record_success(self, url):
+		with self._lock:
+			self._failures.pop(url, None)
+			self._opened_at.pop(url, None)
+			self._trial.discard(url)
+
+	def record_failure(self, url):
+		with self._lock:
+			self._failures[url] = self._failures.get(url, 0) + 1
+			self._trial.discard(url)
+			if self._failures[url] >= self.threshold:
+				self._opened_at[url] = time.monotonic()
+
+	def release(self, url):
+		""" Give back the trial slot of a call that ended before VSDC could answer, without counting it. """
+		with self._lock:
+			self._trial.discard(url)
+
+	def is_open(self, url):
+		with self._lock:
+			return url in self._opened_at
+
+
+class RRATransport:
+	"""
+		Pooled, keep-alive HTTP transport for VSDC calls.
+		A single session is kept per process so TCP and TLS connections are reused between submissions.
+	"""
+	def __init__(self, pool_size=DEFAULT_POOL_SIZE, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+		retry_policy=None, circuit_breaker=None, rate_limiter=None):
+		self.pool_size = pool_size
+		self.connect_timeout = connect_timeout
+		self.read_timeout = read_timeout
+		self.retry_policy = retry_policy or RetryPolicy()
+		self.circuit_breaker = circuit_breaker or CircuitBreaker()
+		self.rate_limiter = rate_limiter
+
+		adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+		self.session = requests.Session()
+		self.session.mount("http://", adapter)
+		self.session.mount("https://", adapter)
+		self.session.headers.update({"Content-Type": "application/json", "Connection": "keep-alive"})
+
+	def get_timeout(self, deadline=None):
+		"""
+			Get the (connect, read) timeout tuple for a request.
+			:param deadline: Absolute `time.monotonic()` value by which the caller needs an answer
+			:return: Tuple of connect and read timeouts in seconds
+		"""
+		if deadline is None:
+			return (self.connect_timeout, self.read_timeout)
+
+		remaining = deadline - time.monotonic()
+		if remaining <= 0:
+			raise DeadlineExceeded("Deadline exceeded before the request to VSDC could be sent.")
+
+		return (min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+
+	def post(self, url, payload, deadline=None) -> requests.Response:
+		"""
+			Post a JSON payload to VSDC.
+			:param url: Full endpoint URL
+			:param payload: JSON serializable payload
+			:param deadline: Optional absolute `time.monotonic()` deadline propagated from the caller
+			:return: requests.Response
+			:raises requests.RequestException: When VSDC could not be reached, including `CircuitOpenError`, or when the rate
+				limit would delay the request past the deadline (`RateLimitExceeded`)
+		"""
+		attempt = 0
+		while True:
+			attempt += 1
+			if self.rate_limiter:
+				self.rate_limiter.acquire(payload.get("tin"), payload.get("bhfId"), url, deadline=deadline)
+
+			timeout = self.get_timeout(deadline)
+			self.circuit_breaker.before_request(url)
+			response, error = None, None
+			try:
+				response = self.session.post(url, json=payload, timeout=timeout)
+			except requests.RequestException as e:
+				error = e
+			except Exception:
+				# Not a transport failure, e.g. a payload that cannot be encoded: the circuit must not stay on trial
+				self.circuit_breaker.release(url)
+				raise
+
+			if not self.retry_policy.is_failure(response, error):
+				self.circuit_breaker.record_success(url)
+				return response
+
+			self.circuit_breaker.record_failure(url)
+
+			delay = self.retry_policy.get_delay(attempt)
+			if (
+				attempt >= self.retry_policy.attempts
+				or not self.retry_policy.is_retryable(response, error)
+				or (deadline is not None and time.monotonic() + delay >= deadline)
+			):
+				if error is not None:
+					raise error
+				return response
+
+			time.sleep(delay)
+
+	def close(self):
+		self.session.close()
+
+	def __repr__(self):
+		return f"RRATransport(pool_size={self.pool_size}, connect_timeout={self.connect_timeout}, read_timeout={self.read_timeout})"
+
+
+def is_ambiguous(outcome) -> bool:
+	"""
+		Whether a request may have reached VSDC without a definite answer coming back: a read timeout, a connection
+		dropped once established, or a 5xx. VSDC may then have recorded it, so a retry has to send the same number.
+		Requests refused before anything was sent (deadline, rate limit, open circuit, no connection) are not.
+		:param outcome: requests.Response, or the exception raised while sending
+	"""
+	if isinstance(outcome, requests.Response):
+		return outcome.status_code >= 500
+
+	if isinstance(outcome, (DeadlineExceeded, RateLimitExceeded, CircuitOpenError, requests.ConnectTimeout)):
+		return False
+
+	if isinstance(outcome, requests.ConnectionError):
+		reason = getattr(outcome.args[0], "reason", None) if outcome.args else None
+		return not isinstance(reason, NewConnectionError)
+
+	return isinstance(outcome, requests.Timeout)
+
+
+def get_deadline(seconds):
+	""" Convert a latency budget in seconds into an absolute deadline usable by the transport. """
+	return time.monotonic() + seconds if seconds else None
+
+
+def get_transport() -> RRATransport:
+	"""
+		Get the process wide transport configured from RRA Settings.
+		Transports are shared per site and configuration, so a settings change simply builds a new pool.
+	"""
+	settings = frappe.get_cached_doc("RRA Settings")
+	config = (
+		int(settings.get("pool_size") or DEFAULT_POOL_SIZE),
+		float(settings.get("connect_timeout") or DEFAULT_CONNECT_TIMEOUT),
+		float(settings.get("read_timeout") or DEFAULT_READ_TIMEOUT),
+		int(settings.get("retry_attempts") or DEFAULT_RETRY_ATTEMPTS),
+		float(settings.get("retry_base_delay") or DEFAULT_RETRY_BASE_DELAY),
+		int(settings.get("circuit_threshold") or DEFAULT_CIRCUIT_THRESHOLD),
+		float(settings.get("circuit_reset_timeout") or DEFAULT_CIRCUIT_RESET_TIMEOUT),
+		float(settings.get("rate_limit") or 0),
+		int(settings.get("rate_limit_burst") or 0),
+		frappe.local.site,
+	)
+	transport = _transports.get(config)
+	if transport is None:
+		with _transports_lock:
+			transport = _transports.get(config)
+			if transport is None:
+				pool_size, connect_timeout, read_timeout, attempts, base_delay, threshold, reset_timeout, rate, burst, _ = config
+				transport = _transports[config] = RRATransport(
+					pool_size, connect_timeout, read_timeout,
+					retry_policy=RetryPolicy(attempts=attempts, base_delay=base_delay),
+					circuit_breaker=CircuitBreaker(threshold=threshold, reset_timeout=reset_timeout),
+					rate_limiter=RateLimiter(rate, burst) if rate else None,
+				)
+
+	return transport
+
+
+def clear_transports():
+	""" Close and forget every pooled transport in this process. """
+	with _transports_lock:
+		for transport in _transports.values():
+			transport.close()
+		_transports.clear()
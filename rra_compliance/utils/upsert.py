@@ -0,0 +1,152 @@
+import frappe
+from frappe.utils import cstr
+
+from rra_compliance.utils.bulk import bulk_insert_docs
+
+BATCH_SIZE = 500
+
+"""
+	Upserts of VSDC master data records into Frappe doctypes, driven by the field maps in
+	`rra_compliance.utils.rra_frappe_translation.upsert_maps`. A field map is a dict with:
+		"key": Fieldname records are matched on, also one of "fields"
+		"fallback_key": Optional fieldname records without a key, or whose key matches nothing, are matched on
+		"fields": {fieldname: VSDC key of the value, or a callable of the record for derived values}
+		"insert_only": Fieldnames only set when the document is created
+		"bulk": Whether new documents can be bulk inserted, skipping their controllers
+"""
+
+
+def get_values(field_map, record) -> dict:
+	""" Frappe values of a VSDC record. """
+	return {
+		fieldname: source(record) if callable(source) else record.get(source)
+		for fieldname, source in field_map["fields"].items()
+	}
+
+
+def get_match_key(field_map, record=None, values=None) -> tuple:
+	""" Key a record is matched on: its key, or its fallback key when it has no key. """
+	values = values or get_values(field_map, record)
+	if values.get(field_map["key"]):
+		return ("key", cstr(values[field_map["key"]]).casefold())
+
+	fallback = field_map.get("fallback_key")
+	if fallback and values.get(fallback):
+		return ("fallback", cstr(values[fallback]).casefold())
+
+
+def get_existing(doctype, key_field, keys, fields) -> dict:
+	""" Existing documents by key, with the mapped fields, in one query per batch of keys. """
+	existing = {}
+	keys = list(keys)
+	for start in range(0, len(keys), BATCH_SIZE):
+		for row in frappe.get_all(
+			doctype, filters={key_field: ["in", keys[start:start + BATCH_SIZE]]}, fields=["name", *dict.fromkeys([key_field, *fields])]
+		):
+			existing.setdefault(cstr(row.get(key_field)).casefold(), row)
+
+	return existing
+
+
+def upsert(doctype, records, field_map, update=True, batch_size=BATCH_SIZE, progress=None) -> dict:
+	"""
+		Insert or update documents from VSDC records.
+		Existing documents are loaded in one query, records without changes are skipped, and only the changed fields
+		are written. New documents are bulk inserted when the map allows it and inserted through their controller
+		otherwise. Every batch is committed on its own, and a failing record does not stop the others.
+		:param doctype: Target doctype
+		:param records: VSDC records
+		:param field_map: Field map, see above
+		:param update: Whether existing documents are updated, or only missing ones created
+		:param batch_size: Records per commit
+		:param progress: Optional callable of (count, message) called as records are processed
+		:return: Dict of document names per outcome: inserted, updated, unchanged, failed (key -> error),
+			and "names": document name per match key (see `get_match_key`)
+	"""
+	key_field, fallback_field = field_map["key"], field_map.get("fallback_key")
+	insert_only = set(field_map.get("insert_only") or [])
+	fields = [field for field in field_map["fields"] if field not in insert_only]
+	rows = {}
+	for record in records:
+		values = get_values(field_map, record)
+		match_key = get_match_key(field_map, values=values)
+		if match_key:
+			rows.setdefault(match_key, values)
+
+	by_key = get_existing(doctype, key_field, [values[key_field] for values in rows.values() if values.get(key_field)], fields)
+	by_fallback = get_existing(doctype, fallback_field, [
+		values[fallback_field] for values in rows.values()
+		if values.get(fallback_field) and cstr(values.get(key_field)).casefold() not in by_key
+	], fields) if fallback_field else {}
+
+	results = {"inserted": [], "updated": [], "unchanged": [], "failed": {}, "names": {}}
+	rows = list(rows.items())
+	for start in range(0, len(rows), batch_size):
+		batch, new_docs = rows[start:start + batch_size], []
+		for match_key, values in batch:
+			current = by_key.get(cstr(values.get(key_field)).casefold()) if values.get(key_field) else None
+			if current is None and fallback_field:
+				current = by_fallback.get(cstr(values.get(fallback_field)).casefold())
+
+			if current is None:
+				doc = frappe.new_doc(doctype).update(values)
+				doc.match_key = match_key
+				new_docs.append(doc)
+				continue
+
+			results["names"][match_key] = current.name
+			changes = {
+				field: value for field, value in values.items()
+				if update and field not in insert_only and cstr(current.get(field)) != cstr(value)
+			}
+			if values.get(key_field) and not current.get(key_field):
+				# Matched on the fallback key: record the key so the document is matched on it from now on
+				changes[key_field] = values[key_field]
+
+			if changes:
+				frappe.db.set_value(doctype, current.name, changes)
+				results["updated"].append(current.name)
+			else:
+				results["unchanged"].append(current.name)
+
+		if field_map.get("bulk"):
+			frappe.db.savepoint("rra_upsert")
+			try:
+				results["inserted"] += bulk_insert_docs(new_docs, ignore_duplicates=True)
+				results["names"].update({ doc.match_key: doc.name for doc in new_docs })
+			except Exception as e:
+				frappe.db.rollback(save_point="rra_upsert")
+				results["failed"].update({ doc.get(key_field) or doc.get(fallback_field): str(e) for doc in new_docs })
+		else:
+			for doc in new_docs:
+				frappe.db.savepoint("rra_upsert")
+				try:
+					results["inserted"].append(doc.insert(ignore_permissions=True).name)
+					results["names"][doc.match_key] = doc.name
+				except Exception as e:
+					frappe.db.rollback(save_point="rra_upsert")
+					results["failed"][doc.get(key_field) or doc.get(fallback_field)] = str(e)
+
+		frappe.db.commit()
+		if progress:
+			progress(len(batch), f"Synced {start + len(batch)} of {len(rows)} {doctype} records")
+
+	return results
+
+
+def remove(doctype, records, field_map) -> dict:
+	"""
+		Delete the documents matching VSDC records.
+		:return: Dict with the names deleted and the ones that could not be (name -> error)
+	"""
+	keys = { cstr(get_values(field_map, record).get(field_map["key"])) for record in records }
+	results = {"deleted": [], "failed": {}}
+	for row in get_existing(doctype, field_map["key"], keys - {""}, []).values():
+		try:
+			frappe.delete_doc(doctype, row.name, ignore_permissions=True)
+			results["deleted"].append(row.name)
+		except Exception as e:
+			results["failed"][row.name] = str(e)
+
+	frappe.db.commit()
+	return results
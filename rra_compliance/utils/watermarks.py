@@ -0,0 +1,56 @@
+import frappe
+from frappe.utils import now
+
+WATERMARK_DOCTYPE = "RRA Sync Watermark"
+EPOCH = "20180520000000"
+
+"""
+	VSDC result codes of a successful lookup: "000" with data, "001" when nothing changed since lastReqDt.
+"""
+success_codes = ("000", "001")
+
+
+class SyncWatermark:
+	"""
+		Last successful sync of a VSDC master data endpoint for a TIN/branch.
+		The watermark is VSDC's own `resultDt` of the request that fetched the changes, so the next sync asks for
+		everything changed since then regardless of clock drift between VSDC and this site.
+	"""
+	def __init__(self, tin, bhf_id, endpoint, company=None):
+		self.tin = tin
+		self.bhf_id = bhf_id
+		self.endpoint = endpoint
+		self.company = company
+		self.name = f"{tin}-{bhf_id}-{endpoint}"
+
+	def get(self) -> str:
+		""" lastReqDt to send: the watermark, or the start of VSDC records if the endpoint was never synced. """
+		return frappe.db.get_value(WATERMARK_DOCTYPE, self.name, "last_req_dt") or EPOCH
+
+	def advance(self, result_dt):
+		"""
+			Move the watermark to `result_dt` once the changes fetched with it are applied.
+			It is updated in one statement and never moves backwards, so overlapping syncs cannot lose changes.
+		"""
+		if not result_dt:
+			return
+
+		if frappe.db.exists(WATERMARK_DOCTYPE, self.name):
+			frappe.db.sql(
+				f"update `tab{WATERMARK_DOCTYPE}` set last_req_dt = greatest(coalesce(last_req_dt, ''), %s), last_synced_on = %s, modified = %s where name = %s",
+				(result_dt, now(), now(), self.name),
+			)
+		else:
+			frappe.get_doc({
+				"doctype": WATERMARK_DOCTYPE,
+				"company": self.company,
+				"endpoint": self.endpoint,
+				"tin": self.tin,
+				"bhf_id": self.bhf_id,
+				"last_req_dt": result_dt,
+				"last_synced_on": now(),
+			}).insert(ignore_permissions=True)
+
+	def reset(self):
+		""" Forget the watermark so the next sync fetches everything. """
+		frappe.db.delete(WATERMARK_DOCTYPE, {"name": self.name})